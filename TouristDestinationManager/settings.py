@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 
 import os
 from pathlib import Path
+from django.core.exceptions import ImproperlyConfigured
 from dotenv import load_dotenv
 
 # Load environment variables
@@ -46,6 +47,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so its timings and query counts cover the whole stack
+    'destinations.middleware.RequestLoggingMiddleware',
+    'destinations.profiling.SQLProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -53,7 +57,6 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
-    'destinations.middleware.RequestLoggingMiddleware',
 ]
 
 ROOT_URLCONF = 'TouristDestinationManager.urls'
@@ -105,6 +108,37 @@ DATABASES = {
 #     }
 # }
 
+# Cache
+# A file cache under BASE_DIR by default. Every process on the host shares it,
+# so invalidation from management commands, background workers and other
+# gunicorn workers reaches the web processes; a per-process local memory cache
+# would keep serving stale pages. Set CACHE_URL to redis://host:port/db for a
+# Redis cache shared between hosts (requires the redis package) or to
+# file:///path for a file cache elsewhere.
+CACHE_URL = os.getenv('CACHE_URL') or f'file://{BASE_DIR / ".django_cache"}'
+
+if CACHE_URL.startswith(('redis://', 'rediss://')):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': CACHE_URL,
+        }
+    }
+elif CACHE_URL.startswith('file://'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': CACHE_URL[len('file://'):],
+            'OPTIONS': {'MAX_ENTRIES': 10000},
+        }
+    }
+else:
+    raise ImproperlyConfigured('CACHE_URL must start with redis://, rediss:// or file://')
+
+# Lifetime of cached destination pages and API payloads, in seconds. Entries
+# are also invalidated whenever a destination or one of its images changes.
+DESTINATION_CACHE_TIMEOUT = int(os.getenv('DESTINATION_CACHE_TIMEOUT', 6 * 60 * 60))
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -136,6 +170,43 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Store destination images and their derivatives under the hash of their
+# contents, so identical files are kept once. Run `manage.py dedupe_media`
+# after turning this on to convert existing media.
+DESTINATION_CONTENT_ADDRESSED_MEDIA = os.getenv('CONTENT_ADDRESSED_MEDIA', 'False') == 'True'
+
+# Transliterate non-ASCII place names (with the optional "unidecode"
+# package) when generating slugs, instead of dropping those characters.
+DESTINATION_SLUG_TRANSLITERATE = os.getenv('SLUG_TRANSLITERATE', 'True') == 'True'
+
+# Spatial index behind the nearby API: grid cell size in degrees, and how
+# often (seconds) each process checks the database for changed coordinates.
+DESTINATION_GEO_CELL_SIZE = float(os.getenv('GEO_CELL_SIZE', 0.25))
+DESTINATION_GEO_REFRESH_SECONDS = float(os.getenv('GEO_REFRESH_SECONDS', 5))
+
+# Request metrics (served at /metrics): share of requests written to the
+# JSON request log (slow and failed ones always are) and what counts as
+# slow. Only staff can scrape unless a bearer token is set (Prometheus'
+# bearer_token option) or scraper addresses are listed. Behind a reverse
+# proxy on the same host every request arrives from 127.0.0.1, so list
+# addresses only when REMOTE_ADDR really is the scraper's.
+DESTINATION_METRICS_LOG_SAMPLE_RATE = float(os.getenv('METRICS_LOG_SAMPLE_RATE', 0.01))
+DESTINATION_METRICS_SLOW_MS = float(os.getenv('METRICS_SLOW_MS', 1000))
+DESTINATION_METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+DESTINATION_METRICS_ALLOWED_IPS = [ip for ip in os.getenv('METRICS_ALLOWED_IPS', '').split(',') if ip]
+
+# SQL profiling with N+1 detection: on for every request, or only for
+# requests sending "X-SQL-Profile: <token>". Reports go to the log and to
+# /destinations/debug/sql/ (staff only). A query shape repeated this many
+# times in one request is reported as N+1.
+DESTINATION_SQL_PROFILE = os.getenv('SQL_PROFILE', 'False') == 'True'
+DESTINATION_SQL_PROFILE_TOKEN = os.getenv('SQL_PROFILE_TOKEN', '')
+DESTINATION_SQL_PROFILE_THRESHOLD = int(os.getenv('SQL_PROFILE_THRESHOLD', 5))
+
+# Public address of the site, used for the absolute URLs in the sitemap
+# written by `manage.py generate_sitemap`.
+DESTINATION_SITE_URL = os.getenv('SITE_URL', 'http://localhost:8000')
+
 # Default primary key field type
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
@@ -18,6 +18,7 @@ handler500 = 'destinations.views.handler500'
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('', destination_views.home, name='home'),
+    path('metrics', destination_views.metrics, name='metrics'),
     path('destinations/', include('destinations.urls', namespace='destinations')),
     path('login/', auth_views.LoginView.as_view(template_name='registration/login.html'), name='login'),
     path('logout/', auth_views.LogoutView.as_view(next_page='home'), name='logout'),
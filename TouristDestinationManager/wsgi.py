@@ -14,3 +14,9 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'TouristDestinationManager.settings')
 
 application = get_wsgi_application()
+
+# Load the nearby API's spatial index while the worker starts, not on its
+# first request.
+from destinations import geo  # noqa: E402
+
+geo.start_index()
@@ -1,6 +1,7 @@
 # In destinations/admin.py
 from django.contrib import admin
 from .models import Destination, DestinationImage
+from .search import search_destinations
 from django.utils.html import format_html
 
 class DestinationImageInline(admin.TabularInline):
@@ -39,10 +40,17 @@ class DestinationAdmin(admin.ModelAdmin):
         }),
     ]
 
+    def get_search_results(self, request, queryset, search_term):
+        # Use the full-text index instead of OR-ed icontains scans; results
+        # come back ordered by relevance.
+        if not search_term.strip():
+            return queryset, False
+        return search_destinations(queryset, search_term), False
+
 @admin.register(DestinationImage)
 class DestinationImageAdmin(admin.ModelAdmin):
-    list_display = ['__str__', 'destination', 'created_at']
-    list_filter = ['created_at']
+    list_display = ['__str__', 'destination', 'thumbnail_status', 'created_at']
+    list_filter = ['thumbnail_status', 'created_at']
     search_fields = ['destination__place_name', 'caption']
     readonly_fields = ['created_at', 'image_preview']
     
@@ -4,3 +4,10 @@ from django.apps import AppConfig
 class DestinationsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'destinations'
+
+    def ready(self):
+        from django.core import checks
+        from . import signals  # noqa: F401
+        from .search import check_search_triggers
+
+        checks.register(check_search_triggers, checks.Tags.database)
@@ -0,0 +1,226 @@
+"""
+Backup and restore helpers shared by the backup_database and
+restore_database commands.
+
+A backup is a directory holding a ``manifest.json`` plus either a
+``pg_dump`` directory-format dump (PostgreSQL) or one compressed logical
+dump per model (any engine), and optionally a ``media/`` snapshot.
+"""
+import gzip
+import hashlib
+import json
+import os
+import shutil
+from contextlib import contextmanager
+
+from django.core.management.color import no_style
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections
+
+from .models import Destination, DestinationImage, ImageDerivative, ImageJob
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Dumped and restored in this order, so foreign keys always point backwards.
+BACKUP_MODELS = (Destination, DestinationImage, ImageDerivative, ImageJob)
+
+MANIFEST = 'manifest.json'
+PG_DUMP_DIR = 'database'
+DATA_DIR = 'data'
+MEDIA_DIR = 'media'
+
+COMPRESSED_EXTENSIONS = {'zstd': '.ndjson.zst', 'gzip': '.ndjson.gz'}
+
+READ_SIZE = 1 << 20
+
+
+def default_compression():
+    return 'zstd' if zstandard is not None else 'gzip'
+
+
+def open_dump(path, mode):
+    """Open a logical dump for text I/O, picking the codec from the extension."""
+    if path.endswith('.zst'):
+        if zstandard is None:
+            raise RuntimeError('This backup is zstd-compressed; install the "zstandard" package')
+        return zstandard.open(path, mode + 't', encoding='utf-8')
+    return gzip.open(path, mode + 't', encoding='utf-8')
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(READ_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def model_label(model):
+    return model._meta.label_lower
+
+
+def dump_model(model, directory, compression, chunk_size, using='default'):
+    """
+    Stream every row of ``model`` into ``directory`` as compressed NDJSON: a
+    header line naming the columns, then one JSON array per row. Returns the
+    manifest entry for the file.
+    """
+    columns = [field.attname for field in model._meta.concrete_fields]
+    filename = model_label(model) + COMPRESSED_EXTENSIONS[compression]
+    path = os.path.join(directory, filename)
+    rows = model._base_manager.using(using).order_by('pk').values_list(*columns)
+
+    count = 0
+    with open_dump(path, 'w') as f:
+        f.write(json.dumps({'model': model_label(model), 'columns': columns}) + '\n')
+        for row in rows.iterator(chunk_size=chunk_size):
+            f.write(json.dumps(row, cls=DjangoJSONEncoder) + '\n')
+            count += 1
+    return {'file': filename, 'rows': count, 'sha256': file_sha256(path)}
+
+
+def read_dump(path):
+    """Yield the column list, then each row dict, from a logical dump."""
+    with open_dump(path, 'r') as f:
+        header = json.loads(f.readline())
+        columns = header['columns']
+        for line in f:
+            yield dict(zip(columns, json.loads(line)))
+
+
+@contextmanager
+def preserved_timestamps(models):
+    """Stop auto_now/auto_now_add from overwriting restored timestamps."""
+    fields = [
+        field for model in models for field in model._meta.concrete_fields
+        if getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False)
+    ]
+    saved = [(field, field.auto_now, field.auto_now_add) for field in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now, auto_now_add in saved:
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+def load_model(model, path, chunk_size, using='default'):
+    """Bulk-insert the rows of one logical dump; returns the row count."""
+    count = 0
+    batch = []
+    for row in read_dump(path):
+        batch.append(model(**row))
+        if len(batch) == chunk_size:
+            model._base_manager.using(using).bulk_create(batch)
+            count += len(batch)
+            batch = []
+    if batch:
+        model._base_manager.using(using).bulk_create(batch)
+        count += len(batch)
+    return count
+
+
+def reset_sequences(using='default'):
+    connection = connections[using]
+    statements = connection.ops.sequence_reset_sql(no_style(), BACKUP_MODELS)
+    if statements:
+        with connection.cursor() as cursor:
+            for sql in statements:
+                cursor.execute(sql)
+
+
+def snapshot_media(media_root, target, previous=None):
+    """
+    Copy MEDIA_ROOT into ``target``, hard-linking files that are unchanged
+    (same size and mtime) since the ``previous`` snapshot instead of copying
+    them, so each backup only costs the space of new media.
+    """
+    stats = {'files': 0, 'linked': 0, 'copied': 0, 'bytes_copied': 0}
+    for dirpath, _, filenames in os.walk(media_root):
+        relative_dir = os.path.relpath(dirpath, media_root)
+        os.makedirs(os.path.join(target, relative_dir), exist_ok=True)
+        for filename in filenames:
+            relative = os.path.normpath(os.path.join(relative_dir, filename))
+            source = os.path.join(media_root, relative)
+            destination = os.path.join(target, relative)
+            stat = os.stat(source)
+            stats['files'] += 1
+
+            if previous:
+                candidate = os.path.join(previous, relative)
+                try:
+                    old = os.stat(candidate)
+                    if old.st_size == stat.st_size and int(old.st_mtime) == int(stat.st_mtime):
+                        os.link(candidate, destination)
+                        stats['linked'] += 1
+                        continue
+                except OSError:
+                    pass
+            shutil.copy2(source, destination)
+            stats['copied'] += 1
+            stats['bytes_copied'] += stat.st_size
+    return stats
+
+
+def pg_env(db):
+    env = os.environ.copy()
+    if db.get('PASSWORD'):
+        env['PGPASSWORD'] = db['PASSWORD']
+    return env
+
+
+def pg_connection_args(db):
+    args = []
+    if db.get('USER'):
+        args += ['-U', db['USER']]
+    if db.get('HOST'):
+        args += ['-h', db['HOST']]
+    if db.get('PORT'):
+        args += ['-p', str(db['PORT'])]
+    return args
+
+
+def read_manifest(backup_dir):
+    with open(os.path.join(backup_dir, MANIFEST), encoding='utf-8') as f:
+        return json.load(f)
+
+
+def write_manifest(backup_dir, manifest):
+    with open(os.path.join(backup_dir, MANIFEST), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+
+
+def verify_logical(backup_dir, manifest):
+    """Check checksums and row counts of each logical dump; returns a list of problems."""
+    problems = []
+    for label, entry in manifest['tables'].items():
+        path = os.path.join(backup_dir, DATA_DIR, entry['file'])
+        if not os.path.exists(path):
+            problems.append(f'{label}: {entry["file"]} is missing')
+            continue
+        if file_sha256(path) != entry['sha256']:
+            problems.append(f'{label}: checksum mismatch')
+            continue
+        try:
+            rows = sum(1 for _ in read_dump(path))
+        except (OSError, EOFError, ValueError) as e:
+            problems.append(f'{label}: unreadable ({e})')
+            continue
+        if rows != entry['rows']:
+            problems.append(f'{label}: {rows} rows, manifest says {entry["rows"]}')
+    return problems
+
+
+def verify_media(backup_dir, manifest):
+    media = manifest.get('media')
+    if not media:
+        return []
+    root = os.path.join(backup_dir, MEDIA_DIR)
+    files = sum(len(filenames) for _, _, filenames in os.walk(root))
+    if files != media['files']:
+        return [f'media: {files} files, manifest says {media["files"]}']
+    return []
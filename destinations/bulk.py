@@ -0,0 +1,178 @@
+"""
+Batch create/update/delete of destinations for the bulk API endpoint.
+
+Each function takes validated items and returns one result dict per item,
+keyed by the item's index in the request. Writes happen in a single
+transaction with bulk_create/bulk_update and plain DELETEs, bypassing save()
+and the model signals, so cache invalidation is done here for the whole
+batch.
+"""
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from . import cache, facets, geo
+from .models import Destination, DestinationImage, ImageDerivative, ImageJob, delete_files
+from .slugs import allocate_slugs
+
+
+def result(index, status, obj=None, **extra):
+    entry = {'index': index, 'status': status}
+    if obj is not None:
+        entry.update(id=obj.pk, slug=obj.slug)
+    entry.update(extra)
+    return entry
+
+
+def bulk_create_destinations(items):
+    """Create destinations from ``(index, attrs)`` pairs."""
+    slugs, errors = allocate_slugs([
+        (index, None, attrs.get('slug', ''), attrs['place_name']) for index, attrs in items
+    ])
+    results = {index: result(index, 'error', errors=errors[index]) for index in errors}
+    created = [
+        (index, Destination(**{**attrs, 'slug': slugs[index]}))
+        for index, attrs in items if index not in errors
+    ]
+    if not created:
+        return results
+    for _, obj in created:
+        geo.update_coordinates(obj)
+
+    try:
+        with transaction.atomic():
+            Destination.objects.bulk_create([obj for _, obj in created])
+    except IntegrityError:
+        # A concurrent write took one of the slugs after they were allocated
+        created = insert_one_by_one(items, created, results)
+        if not created:
+            return results
+    if any(obj.pk is None for _, obj in created):
+        # Backends that can't return ids from a bulk insert (MySQL)
+        ids = dict(Destination.objects.filter(slug__in=[obj.slug for _, obj in created]).values_list('slug', 'pk'))
+        for _, obj in created:
+            obj.pk = ids.get(obj.slug)
+    cache.invalidate_destination(*(obj.slug for _, obj in created))
+    facets.record_changes([(None, facets.facet_values(obj)) for _, obj in created])
+
+    for index, obj in created:
+        results[index] = result(index, 'created', obj)
+    return results
+
+
+def insert_one_by_one(items, created, results):
+    """
+    Allocate the slugs of ``created`` again and insert the rows one at a
+    time, recording an error result for each row that still clashes.
+    Returns the rows that were inserted.
+    """
+    attrs_by_index = dict(items)
+    slugs, errors = allocate_slugs([
+        (index, None, attrs_by_index[index].get('slug', ''), obj.place_name) for index, obj in created
+    ])
+    inserted = []
+    for index, obj in created:
+        if index not in errors:
+            obj.slug = slugs[index]
+            try:
+                with transaction.atomic():
+                    Destination.objects.bulk_create([obj])
+            except IntegrityError:
+                errors[index] = {'slug': ['A destination with this slug was created at the same time.']}
+            else:
+                inserted.append((index, obj))
+                continue
+        results[index] = result(index, 'error', errors=errors[index])
+    return inserted
+
+
+def bulk_update_destinations(items):
+    """Apply partial updates from ``(index, pk, attrs)`` triples."""
+    results = {}
+    targets = Destination.objects.in_bulk([pk for _, pk, _ in items if pk is not None])
+    seen = set()
+    pending = []
+    for index, pk, attrs in items:
+        if pk is None:
+            results[index] = result(index, 'error', errors={'id': ['This field is required.']})
+        elif pk not in targets:
+            results[index] = result(index, 'not_found', id=pk)
+        elif pk in seen:
+            results[index] = result(index, 'error', errors={'id': ['Destination appears more than once.']})
+        else:
+            seen.add(pk)
+            pending.append((index, targets[pk], attrs))
+
+    slugs, errors = allocate_slugs([
+        (index, obj.pk, attrs['slug'], attrs.get('place_name', obj.place_name))
+        for index, obj, attrs in pending if 'slug' in attrs
+    ])
+    now = timezone.now()
+    fields = {'updated_at'}
+    updated = []
+    old_slugs = []
+    for index, obj, attrs in pending:
+        if index in errors:
+            results[index] = result(index, 'error', errors=errors[index])
+            continue
+        old_slugs.append(obj.slug)
+        for name, value in attrs.items():
+            setattr(obj, name, value)
+        if index in slugs:
+            obj.slug = slugs[index]
+        if geo.update_coordinates(obj):
+            fields.update(('latitude', 'longitude'))
+        # bulk_update() doesn't run auto_now
+        obj.updated_at = now
+        fields.update(attrs)
+        updated.append((index, obj))
+    if not updated:
+        return results
+
+    with transaction.atomic():
+        Destination.objects.bulk_update([obj for _, obj in updated], sorted(fields), batch_size=500)
+    cache.invalidate_destination(*old_slugs, *(obj.slug for _, obj in updated))
+    facets.record_changes([
+        (facets.facet_values(obj, loaded=True), facets.facet_values(obj)) for _, obj in updated
+    ])
+
+    for index, obj in updated:
+        results[index] = result(index, 'updated', obj)
+    return results
+
+
+def bulk_delete_destinations(items):
+    """Delete destinations from ``(index, slug)`` pairs."""
+    found = {}
+    old_values = []
+    rows = Destination.objects.filter(slug__in=[slug for _, slug in items]).values_list(
+        'slug', 'pk', *facets.FACET_FIELDS
+    )
+    for slug, pk, *values in rows:
+        found[slug] = pk
+        old_values.append(dict(zip(facets.FACET_FIELDS, values)))
+
+    if found:
+        ids = list(found.values())
+        derivatives = ImageDerivative.objects.filter(image__destination_id__in=ids)
+        images = DestinationImage.objects.filter(destination_id__in=ids)
+        with transaction.atomic():
+            files = set(derivatives.values_list('file', flat=True))
+            for names in images.values_list('image', 'thumbnail'):
+                files.update(names)
+            # Plain DELETEs: a cascading delete sends signals per row, and
+            # the image handlers would touch the destination once per image.
+            for queryset in (
+                derivatives, ImageJob.objects.filter(image__destination_id__in=ids), images,
+                Destination.objects.filter(pk__in=ids),
+            ):
+                queryset._raw_delete(queryset.db)
+            # After the rows, so content-addressed files see accurate references
+            transaction.on_commit(lambda: delete_files(files))
+            geo.record_deletions(ids)
+        cache.invalidate_destination(*found)
+        facets.record_changes([(values, None) for values in old_values])
+    return {
+        index: result(index, 'deleted', id=found[slug], slug=slug) if slug in found
+        else result(index, 'not_found', slug=slug)
+        for index, slug in items
+    }
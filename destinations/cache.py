@@ -0,0 +1,179 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.contrib.messages.storage.cookie import CookieStorage
+from django.core.cache import caches
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import parse_http_date_safe
+from rest_framework.response import Response
+
+from .conditional import ConditionalGetMixin
+
+# Cached payloads are grouped into namespaces that can be purged on their own:
+#   list   - rendered list pages
+#   detail - rendered detail pages
+#   api    - DestinationViewSet list/retrieve payloads
+#   facets - state/district/weather counts (see facets.py)
+NAMESPACES = ('list', 'detail', 'api', 'facets')
+
+# Entries are also tagged with a scope: 'list' for anything built from the
+# whole table, or 'slug:<slug>' for a single destination. Saving or deleting
+# a destination bumps the 'list' scope and its own slug scope.
+LIST_SCOPE = 'list'
+
+# Headers restored on a cache hit.
+CACHED_HEADERS = ('Content-Type', 'ETag', 'Last-Modified', 'Vary')
+
+
+def get_cache():
+    return caches[getattr(settings, 'DESTINATION_CACHE_ALIAS', 'default')]
+
+
+def get_timeout():
+    return getattr(settings, 'DESTINATION_CACHE_TIMEOUT', 6 * 60 * 60)
+
+
+def slug_scope(slug):
+    return f'slug:{slug}'
+
+
+def _version_key(kind, name):
+    return f'destinations:version:{kind}:{name}'
+
+
+def _new_version():
+    # Seeded from the clock rather than 1, so a version key that gets evicted
+    # never comes back with a number that old entries were stored under.
+    return time.time_ns()
+
+
+def bump(kind, name):
+    """Move a version on, returning the new value."""
+    cache = get_cache()
+    key = _version_key(kind, name)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        version = _new_version()
+        cache.set(key, version, timeout=None)
+        return version
+
+
+def get_version(kind, name):
+    """The current value of a version, starting it if it doesn't exist yet."""
+    cache = get_cache()
+    key = _version_key(kind, name)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, _new_version(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def forget_version(kind, name):
+    """Drop a version, so the next get_version() starts a fresh one far ahead of it."""
+    get_cache().delete(_version_key(kind, name))
+
+
+def make_key(namespace, scope, *parts):
+    """Build a cache key that changes whenever its namespace or scope is bumped."""
+    cache = get_cache()
+    version_keys = [_version_key('namespace', namespace), _version_key('scope', scope)]
+    versions = cache.get_many(version_keys)
+
+    missing = {key: _new_version() for key in version_keys if key not in versions}
+    if missing:
+        cache.set_many(missing, timeout=None)
+        versions.update(missing)
+
+    digest = hashlib.md5('|'.join(str(part) for part in parts).encode()).hexdigest()
+    return f'destinations:{namespace}:{versions[version_keys[0]]}:{versions[version_keys[1]]}:{digest}'
+
+
+def invalidate_destination(*slugs):
+    """Drop every cached list and the cached pages/payloads of the given slugs."""
+    bump('scope', LIST_SCOPE)
+    for slug in slugs:
+        if slug:
+            bump('scope', slug_scope(slug))
+
+
+def purge_namespace(namespace):
+    if namespace not in NAMESPACES:
+        raise ValueError(f'Unknown cache namespace: {namespace}')
+    bump('namespace', namespace)
+
+
+class CachedResponseMixin(ConditionalGetMixin):
+    """
+    Caches successful GET responses under ``cache_namespace``, in front of
+    the conditional-GET handling.
+
+    Template views cache the rendered page for anonymous visitors only,
+    because logged-in users see edit links and flash messages. API views cache
+    the serialized ``response.data`` for everyone. A cache hit runs no database
+    queries and still answers If-None-Match/If-Modified-Since from the stored
+    validators.
+    """
+    cache_namespace = None
+
+    def get_cache_scope(self, request, *args, **kwargs):
+        return LIST_SCOPE
+
+    def is_cacheable(self, request):
+        if request.method != 'GET':
+            return False
+        if self.cache_namespace == 'api':
+            return True
+        return not request.user.is_authenticated and CookieStorage.cookie_name not in request.COOKIES
+
+    def cached_response(self, request, handler, *args, **kwargs):
+        if not self.is_cacheable(request):
+            return self.conditional_response(request, handler, *args, **kwargs)
+
+        cache = get_cache()
+        key = make_key(
+            self.cache_namespace,
+            self.get_cache_scope(request, *args, **kwargs),
+            request.build_absolute_uri(),
+            request.META.get('HTTP_ACCEPT', ''),
+        )
+        entry = cache.get(key)
+        if entry is not None:
+            response = self.response_from_cache(request, entry)
+        else:
+            response = self.conditional_response(request, handler, *args, **kwargs)
+            if response.status_code == 200:
+                cache.set(key, self.cache_entry(response), get_timeout())
+
+        if self.cache_namespace != 'api':
+            # The page differs for logged-in users, so shared caches must key
+            # on the session cookie even when a hit never touched the session.
+            patch_vary_headers(response, ('Cookie',))
+        return response
+
+    def cache_entry(self, response):
+        headers = {name: response[name] for name in CACHED_HEADERS if response.has_header(name)}
+        if self.cache_namespace == 'api':
+            return {'data': response.data, 'headers': headers}
+        if hasattr(response, 'render') and not response.is_rendered:
+            response.render()
+        return {'content': response.content, 'headers': headers}
+
+    def response_from_cache(self, request, entry):
+        headers = dict(entry['headers'])
+        if 'data' in entry:
+            headers.pop('Content-Type', None)  # set by the negotiated renderer
+            response = Response(entry['data'], headers=headers)
+        else:
+            response = HttpResponse(entry['content'], headers=headers)
+
+        last_modified = parse_http_date_safe(headers.get('Last-Modified', ''))
+        return get_conditional_response(
+            request,
+            etag=headers.get('ETag'),
+            last_modified=last_modified,
+            response=response,
+        )
@@ -0,0 +1,59 @@
+import hashlib
+from calendar import timegm
+
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+
+def make_etag(*parts):
+    return hashlib.md5('|'.join(str(part) for part in parts).encode()).hexdigest()
+
+
+def list_validators(queryset, *extra):
+    """
+    ETag and Last-Modified for a list of destinations, from one aggregate
+    query. The row count catches deletions that leave MAX(updated_at) alone.
+    """
+    stats = queryset.order_by().aggregate(last_modified=Max('updated_at'), count=Count('id'))
+    etag = make_etag(stats['count'], stats['last_modified'], *extra)
+    return etag, stats['last_modified']
+
+
+def detail_validators(queryset, *extra):
+    """ETag and Last-Modified for a single destination, or (None, None) if it doesn't exist."""
+    last_modified = queryset.values_list('updated_at', flat=True).first()
+    if last_modified is None:
+        return None, None
+    return make_etag(last_modified, *extra), last_modified
+
+
+class ConditionalGetMixin:
+    """
+    Answers If-None-Match/If-Modified-Since with a 304 before the view does
+    any rendering or serialization work.
+
+    ``Destination.updated_at`` is bumped whenever one of its images changes
+    (see signals.py), so it is the only timestamp the validators need.
+    """
+
+    def get_validators(self, request, *args, **kwargs):
+        """Return ``(etag, last_modified)``; either may be None."""
+        raise NotImplementedError
+
+    def conditional_response(self, request, handler, *args, **kwargs):
+        etag, last_modified = self.get_validators(request, *args, **kwargs)
+        etag = quote_etag(etag) if etag else None
+        timestamp = timegm(last_modified.utctimetuple()) if last_modified else None
+
+        response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+        if response is not None:
+            return response
+
+        response = handler(request, *args, **kwargs)
+        if response.status_code == 200:
+            if etag and not response.has_header('ETag'):
+                response.headers['ETag'] = etag
+            if timestamp and not response.has_header('Last-Modified'):
+                response.headers['Last-Modified'] = http_date(timestamp)
+        return response
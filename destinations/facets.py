@@ -0,0 +1,126 @@
+"""
+Per-value counts of state, district and weather, for the filter dropdowns
+and the facets API action.
+
+Totals over the whole table are computed with one grouped query per
+facet, cached, and then kept current by the save/delete signals, which
+move a row's counts from its old values to its new ones instead of
+recomputing. Paths that bypass the signals (bulk updates, imports) call
+``record_changes()`` or ``invalidate()`` themselves. Counts under a set of
+filters are cached in the list scope, so any change drops them.
+"""
+import math
+import time
+
+from django.db.models import Count
+
+from . import cache
+from .filters import filter_destinations, get_filter_params
+from .models import Destination
+
+FACET_FIELDS = ('state', 'district', 'weather')
+
+# Only bumped by invalidate(); ordinary edits update the totals in place.
+TOTALS_SCOPE = 'facets'
+# Re-counted from the database at least this often, which bounds any drift
+# from two processes updating the cached totals at the same moment. In-place
+# updates keep the expiry of the original count rather than restarting it.
+TOTALS_TIMEOUT = 60 * 60
+
+
+def compute_facets(queryset):
+    """{field: {value: count}} with one grouped query per facet."""
+    return {
+        field: dict(
+            queryset.order_by().values_list(field).annotate(count=Count('pk')).values_list(field, 'count')
+        )
+        for field in FACET_FIELDS
+    }
+
+
+def as_lists(counts):
+    """{field: [(value, count), ...]} sorted by value, for templates and the API."""
+    return {field: sorted(counts.get(field, {}).items()) for field in FACET_FIELDS}
+
+
+def totals_key():
+    return cache.make_key('facets', TOTALS_SCOPE)
+
+
+def remaining_timeout(entry):
+    """Seconds until cached totals are due for a recount; 0 once they are."""
+    # Entries cached before computed_at was recorded are simply recounted
+    computed_at = entry.get('computed_at')
+    if computed_at is None:
+        return 0
+    return max(0, math.ceil(computed_at + TOTALS_TIMEOUT - time.time()))
+
+
+def get_totals():
+    store = cache.get_cache()
+    key = totals_key()
+    entry = store.get(key)
+    if entry is None or not remaining_timeout(entry):
+        entry = {'computed_at': time.time(), 'counts': compute_facets(Destination.objects.all())}
+        store.set(key, entry, TOTALS_TIMEOUT)
+    return entry['counts']
+
+
+def get_facets(params=None):
+    """Facet counts for the whole table, or under the filters in ``params``."""
+    filters = get_filter_params(params or {})
+    if not filters:
+        return as_lists(get_totals())
+
+    store = cache.get_cache()
+    key = cache.make_key('facets', cache.LIST_SCOPE, *sorted(filters.items()))
+    counts = store.get(key)
+    if counts is None:
+        counts = compute_facets(filter_destinations(Destination.objects.all(), filters))
+        store.set(key, counts, cache.get_timeout())
+    return as_lists(counts)
+
+
+def record_changes(changes):
+    """
+    Apply ``(old, new)`` pairs of {field: value} dicts to the cached totals;
+    ``old`` is None for a created row and ``new`` is None for a deleted one.
+    Nothing to do if the totals aren't cached: the next read counts afresh.
+    """
+    store = cache.get_cache()
+    key = totals_key()
+    entry = store.get(key)
+    if entry is None:
+        return
+    timeout = remaining_timeout(entry)
+    if not timeout:
+        store.delete(key)
+        return
+    counts = entry['counts']
+    for old, new in changes:
+        for field in FACET_FIELDS:
+            before = old.get(field) if old else None
+            after = new.get(field) if new else None
+            if old and new and before == after:
+                continue
+            values = counts.setdefault(field, {})
+            if old:
+                values[before] = values.get(before, 0) - 1
+                if values[before] <= 0:
+                    del values[before]
+            if new:
+                values[after] = values.get(after, 0) + 1
+    store.set(key, entry, timeout)
+
+
+def facet_values(destination, loaded=False):
+    if loaded:
+        values = getattr(destination, '_loaded_values', None)
+        if values is None or any(field not in values for field in FACET_FIELDS):
+            return None
+        return {field: values[field] for field in FACET_FIELDS}
+    return {field: getattr(destination, field) for field in FACET_FIELDS}
+
+
+def invalidate():
+    cache.bump('scope', TOTALS_SCOPE)
@@ -0,0 +1,30 @@
+from .search import search_destinations
+
+# Request parameters that map straight onto an indexed column.
+EXACT_FILTER_FIELDS = ('state', 'district', 'weather')
+
+
+def get_filter_params(params):
+    """Return the non-empty filter values from a GET/query_params dict."""
+    filters = {}
+    for name in ('q',) + EXACT_FILTER_FIELDS:
+        value = params.get(name, '').strip()
+        if value:
+            filters[name] = value
+    return filters
+
+
+def filter_destinations(queryset, params):
+    """Apply keyword, state, district and weather filters in the database."""
+    filters = get_filter_params(params)
+
+    # Exact matches so the lookups can use the column indexes.
+    for field in EXACT_FILTER_FIELDS:
+        if field in filters:
+            queryset = queryset.filter(**{field: filters[field]})
+
+    # Ranked full-text search; this also orders the results by relevance.
+    if 'q' in filters:
+        queryset = search_destinations(queryset, filters['q'])
+
+    return queryset
@@ -0,0 +1,444 @@
+"""
+Coordinates for destinations and an in-process spatial index over them.
+
+Coordinates are parsed from Google Maps links where the link carries them
+(``@lat,lng``, ``!3dlat!4dlng``, ``?q=lat,lng``...). Short links
+(``goo.gl/maps/...``) don't, and are left without coordinates rather than
+resolved over the network.
+
+``GridIndex`` buckets points into fixed-size lat/lng cells and answers
+k-nearest, radius and bounding-box queries by visiting cells in rings
+around the query point, stopping once no unvisited cell can hold anything
+closer. Each process keeps one index (``get_index()``), built in a
+background thread and then refreshed incrementally: from ``updated_at`` and
+the highest id for new and edited rows, and from tombstones left in the
+shared cache for deleted ones, so it never needs a full reload for ordinary
+edits.
+"""
+import heapq
+import math
+import re
+import threading
+import time
+from array import array
+from urllib.parse import parse_qs, unquote, urlparse
+
+from django.apps import apps
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Max, Q
+
+from . import cache
+
+EARTH_RADIUS_KM = 6371.0088
+
+# Deleted ids are left in the cache as numbered tombstones for the indexes of
+# every process to apply. An index further behind than MAX_TOMBSTONES, or
+# missing one that expired, rebuilds instead.
+DELETIONS = 'geo-deletions'
+TOMBSTONE_TIMEOUT = 24 * 60 * 60
+MAX_TOMBSTONES = 1000
+
+# Most precise first: !3d/!4d is the place itself, @ is the map centre
+PLACE_PATTERN = re.compile(r'!3d(-?\d+(?:\.\d+)?)!4d(-?\d+(?:\.\d+)?)')
+CENTRE_PATTERN = re.compile(r'@(-?\d+(?:\.\d+)?),\s*(-?\d+(?:\.\d+)?)')
+PAIR_PATTERN = re.compile(r'^\s*(-?\d+(?:\.\d+)?)\s*,\s*(-?\d+(?:\.\d+)?)\s*$')
+COORDINATE_PARAMS = ('q', 'query', 'll', 'center', 'destination', 'daddr', 'sll')
+
+
+def valid_coordinates(lat, lng):
+    return -90 <= lat <= 90 and -180 <= lng <= 180
+
+
+def parse_map_link(url):
+    """(latitude, longitude) from a map link, or None if it has none."""
+    if not url:
+        return None
+    url = unquote(url)
+    candidates = [PLACE_PATTERN.search(url), CENTRE_PATTERN.search(url)]
+    query = parse_qs(urlparse(url).query)
+    for name in COORDINATE_PARAMS:
+        for value in query.get(name, []):
+            candidates.append(PAIR_PATTERN.match(value))
+    for match in candidates:
+        if match:
+            lat, lng = float(match.group(1)), float(match.group(2))
+            if valid_coordinates(lat, lng):
+                return lat, lng
+    return None
+
+
+def update_coordinates(destination):
+    """
+    Re-derive a destination's coordinates from its map link when the link
+    changed and the coordinates weren't set explicitly at the same time.
+    Returns True if the coordinates changed.
+    """
+    if 'google_map_link' in destination.get_deferred_fields():
+        return False
+    loaded = getattr(destination, '_loaded_values', {})
+    if destination.google_map_link == loaded.get('google_map_link') and destination.pk:
+        return False
+    current = (destination.latitude, destination.longitude)
+    if current != (loaded.get('latitude'), loaded.get('longitude')) and None not in current:
+        return False
+    coordinates = parse_map_link(destination.google_map_link) or (None, None)
+    if coordinates == current:
+        return False
+    destination.latitude, destination.longitude = coordinates
+    return True
+
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = (math.sin((lat2 - lat1) / 2) ** 2
+         + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+class GridIndex:
+    """
+    Points bucketed into ``cell_size``-degree cells. Each cell keeps its ids
+    and coordinates in flat arrays (24 bytes a point) so a million
+    destinations fit comfortably in memory.
+    """
+
+    def __init__(self, cell_size=0.25):
+        self.cell_size = cell_size
+        self.rows = math.ceil(180 / cell_size)
+        self.cols = math.ceil(360 / cell_size)
+        self.cells = {}
+        self.cell_of = {}
+
+    def __len__(self):
+        return len(self.cell_of)
+
+    def __contains__(self, pk):
+        return pk in self.cell_of
+
+    def cell(self, lat, lng):
+        row = min(int((lat + 90) / self.cell_size), self.rows - 1)
+        col = int(((lng + 180) % 360) / self.cell_size) % self.cols
+        return row, col
+
+    def add(self, pk, lat, lng):
+        self.discard(pk)
+        row, col = self.cell(lat, lng)
+        key = row * self.cols + col
+        bucket = self.cells.get(key)
+        if bucket is None:
+            bucket = self.cells[key] = (array('q'), array('d'), array('d'))
+        bucket[0].append(pk)
+        bucket[1].append(lat)
+        bucket[2].append(lng)
+        self.cell_of[pk] = key
+
+    def discard(self, pk):
+        key = self.cell_of.pop(pk, None)
+        if key is None:
+            return
+        ids, lats, lngs = self.cells[key]
+        i = ids.index(pk)
+        for column in (ids, lats, lngs):
+            del column[i]
+        if not ids:
+            del self.cells[key]
+
+    def ring(self, row, col, r):
+        """Keys of the cells at Chebyshev distance ``r`` from (row, col)."""
+        keys = set()
+        for dr in range(-r, r + 1):
+            y = row + dr
+            if not 0 <= y < self.rows:
+                continue
+            if abs(dr) == r:
+                offsets = range(-r, r + 1)
+            else:
+                offsets = (-r, r)
+            for dc in offsets:
+                keys.add(y * self.cols + (col + dc) % self.cols)
+        return keys
+
+    def ring_bound(self, lat, r):
+        """Lower bound (km) on the distance from ``lat`` to anything in ring ``r``."""
+        if r <= 1:
+            return 0.0
+        degrees = (r - 1) * self.cell_size
+        by_lat = math.radians(degrees)
+        # Distance from the point to the meridian ``degrees`` away, which
+        # no point beyond it can beat (capped by the way over the pole)
+        by_lng = min(
+            math.asin(math.sin(math.radians(min(degrees, 90))) * math.cos(math.radians(lat))),
+            math.radians(90 - abs(lat)),
+        )
+        return EARTH_RADIUS_KM * min(by_lat, by_lng)
+
+    def search(self, lat, lng, k=None, max_km=None):
+        """
+        ``[(distance_km, pk)]`` nearest first: the ``k`` nearest points,
+        or every point within ``max_km``, or both limits at once.
+        """
+        if not self.cell_of or k == 0:
+            return []
+        row, col = self.cell(lat, lng)
+        best = []  # max-heap of (-distance, pk) when k is set
+        seen = 0
+        # Further out, rings would wrap round and revisit columns
+        max_ring = max(self.rows, self.cols // 2)
+        for r in range(max_ring + 1):
+            bound = self.ring_bound(lat, r)
+            if max_km is not None and bound > max_km:
+                break
+            if k is not None and len(best) == k and bound > -best[0][0]:
+                break
+            if seen == len(self.cell_of):
+                break
+            for key in self.ring(row, col, r):
+                bucket = self.cells.get(key)
+                if bucket is None:
+                    continue
+                seen += len(bucket[0])
+                for pk, plat, plng in zip(*bucket):
+                    distance = haversine_km(lat, lng, plat, plng)
+                    if max_km is not None and distance > max_km:
+                        continue
+                    if k is None:
+                        best.append((-distance, pk))
+                    elif len(best) < k:
+                        heapq.heappush(best, (-distance, pk))
+                    elif distance < -best[0][0]:
+                        heapq.heapreplace(best, (-distance, pk))
+        return sorted((-negative, pk) for negative, pk in best)
+
+    def nearest(self, lat, lng, k=10, max_km=None):
+        return self.search(lat, lng, k=k, max_km=max_km)
+
+    def within(self, lat, lng, km):
+        return self.search(lat, lng, max_km=km)
+
+    def bbox(self, south, west, north, east):
+        """Ids inside the box; ``west > east`` means it crosses the antimeridian."""
+        crosses = west > east
+        first_row, _ = self.cell(max(south, -90), 0)
+        last_row, _ = self.cell(min(north, 90), 0)
+        _, first_col = self.cell(0, west)
+        _, last_col = self.cell(0, east)
+        cols = last_col - first_col + 1 if last_col >= first_col else self.cols - first_col + last_col + 1
+        if crosses and cols <= 1:
+            cols = self.cols
+        wanted = (last_row - first_row + 1) * cols
+        if wanted > len(self.cells):
+            keys = self.cells.keys()
+        else:
+            keys = [
+                y * self.cols + (first_col + dc) % self.cols
+                for y in range(first_row, last_row + 1) for dc in range(cols)
+            ]
+
+        found = []
+        for key in keys:
+            bucket = self.cells.get(key)
+            if bucket is None:
+                continue
+            for pk, plat, plng in zip(*bucket):
+                if not south <= plat <= north:
+                    continue
+                if (west <= plng or plng <= east) if crosses else (west <= plng <= east):
+                    found.append(pk)
+        return found
+
+
+def tombstone_key(version):
+    return f'destinations:geo:tombstone:{version}'
+
+
+def record_deletions(pks):
+    """Leave a tombstone for deleted ids once the deleting transaction commits."""
+    pks = list(pks)
+    if pks:
+        transaction.on_commit(lambda: _write_tombstone(pks))
+
+
+def _write_tombstone(pks):
+    store = cache.get_cache()
+    # add() fails if another process took the same version number first
+    for _ in range(5):
+        if store.add(tombstone_key(cache.bump('version', DELETIONS)), pks, TOMBSTONE_TIMEOUT):
+            return
+    forget_deletions()
+
+
+def forget_deletions():
+    """Make every index rebuild, for deletes too large to list (e.g. a restore)."""
+    cache.forget_version('version', DELETIONS)
+
+
+class IndexNotReady(Exception):
+    """The index is still being built for the first time."""
+
+
+class DestinationIndex:
+    """
+    A GridIndex of every destination with coordinates. The first build runs
+    in a background thread; after that, at most every ``refresh_interval``
+    seconds, rows changed since MAX(updated_at) or added past MAX(id) are
+    re-read and tombstoned ids discarded.
+    """
+
+    def __init__(self, cell_size, refresh_interval):
+        self.cell_size = cell_size
+        self.refresh_interval = refresh_interval
+        self.lock = threading.RLock()
+        self.grid = None
+        self.seen_updated_at = None
+        self.seen_id = None
+        self.seen_deletions = None
+        self.checked_at = None
+        self.builder = None
+
+    def model(self):
+        return apps.get_model('destinations', 'Destination')
+
+    def stats(self):
+        # Both read from an index end, unlike a COUNT
+        return self.model().objects.aggregate(latest=Max('updated_at'), last_id=Max('pk'))
+
+    def start(self):
+        """Build the index in a background thread, unless a build is already running."""
+        with self.lock:
+            if self.builder is None or not self.builder.is_alive():
+                self.builder = threading.Thread(target=self.build_in_background, name='geo-index', daemon=True)
+                self.builder.start()
+
+    def build_in_background(self):
+        try:
+            self.rebuild()
+        finally:
+            connection.close()
+
+    def rebuild(self):
+        # Read the change markers first: anything that happens while the rows
+        # are loaded is picked up again by the next catch_up().
+        deletions = cache.get_version('version', DELETIONS)
+        stats = self.stats()
+        grid = GridIndex(self.cell_size)
+        rows = self.model().objects.filter(latitude__isnull=False, longitude__isnull=False)
+        for pk, lat, lng in rows.values_list('pk', 'latitude', 'longitude').iterator(chunk_size=10000):
+            grid.add(pk, lat, lng)
+        with self.lock:
+            self.grid = grid
+            self.seen_updated_at = stats['latest']
+            self.seen_id = stats['last_id']
+            self.seen_deletions = deletions
+            self.checked_at = time.monotonic()
+
+    def refresh(self, force=False):
+        with self.lock:
+            if self.grid is None:
+                self.start()
+                return self
+            now = time.monotonic()
+            if force or now - self.checked_at >= self.refresh_interval:
+                self.catch_up()
+                self.checked_at = now
+        return self
+
+    def catch_up(self):
+        if not self.apply_tombstones():
+            # Too far behind to replay: keep answering from this grid while
+            # a fresh one is built
+            self.start()
+
+        stats = self.stats()
+        latest, last_id = stats['latest'], stats['last_id']
+        changed = Q()
+        if latest is not None and (self.seen_updated_at is None or latest > self.seen_updated_at):
+            # >= re-reads rows sharing the last timestamp, which is harmless
+            changed |= Q(updated_at__gte=self.seen_updated_at) if self.seen_updated_at else Q(pk__isnull=False)
+        if last_id is not None and (self.seen_id is None or last_id > self.seen_id):
+            # Inserts that keep an older updated_at (restores, imports)
+            changed |= Q(pk__gt=self.seen_id or 0)
+        if changed:
+            rows = self.model().objects.filter(changed).values_list('pk', 'latitude', 'longitude')
+            for pk, lat, lng in rows.iterator(chunk_size=10000):
+                if lat is None or lng is None:
+                    self.grid.discard(pk)
+                else:
+                    self.grid.add(pk, lat, lng)
+        self.seen_updated_at = latest or self.seen_updated_at
+        self.seen_id = last_id or self.seen_id
+
+    def apply_tombstones(self):
+        """Discard ids deleted since the last refresh; False if that can't be done."""
+        version = cache.get_version('version', DELETIONS)
+        if version == self.seen_deletions:
+            return True
+        if not 0 < version - self.seen_deletions <= MAX_TOMBSTONES:
+            return False
+        keys = [tombstone_key(v) for v in range(self.seen_deletions + 1, version + 1)]
+        tombstones = cache.get_cache().get_many(keys)
+        if len(tombstones) < len(keys):
+            return False
+        for pks in tombstones.values():
+            for pk in pks:
+                self.grid.discard(pk)
+        self.seen_deletions = version
+        return True
+
+    # Queries hold the lock so a concurrent catch_up() can't move points
+    # between cells mid-scan.
+    def query(self, method, *args, **kwargs):
+        with self.lock:
+            if self.grid is None:
+                raise IndexNotReady()
+            return getattr(self.grid, method)(*args, **kwargs)
+
+    def nearest(self, lat, lng, k=10, max_km=None):
+        return self.query('nearest', lat, lng, k=k, max_km=max_km)
+
+    def within(self, lat, lng, km):
+        return self.query('within', lat, lng, km)
+
+    def bbox(self, south, west, north, east):
+        return self.query('bbox', south, west, north, east)
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def _get_or_create_index():
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = DestinationIndex(
+                getattr(settings, 'DESTINATION_GEO_CELL_SIZE', 0.25),
+                getattr(settings, 'DESTINATION_GEO_REFRESH_SECONDS', 5),
+            )
+    return _index
+
+
+def get_index():
+    """
+    The process-wide destination index, caught up with recent changes. Its
+    queries raise IndexNotReady until the first background build finishes.
+    """
+    return _get_or_create_index().refresh()
+
+
+def start_index():
+    """Begin building the index in the background, e.g. as a web worker starts."""
+    _get_or_create_index().start()
+
+
+def build_index():
+    """Build the index in this thread and return it."""
+    index = _get_or_create_index()
+    index.rebuild()
+    return index
+
+
+def reset_index():
+    global _index
+    with _index_lock:
+        _index = None
@@ -0,0 +1,142 @@
+"""
+Image rendering helpers.
+
+These functions only deal with bytes and file paths, never with models or
+the database, so they can run inside ProcessPoolExecutor workers.
+"""
+import os
+from io import BytesIO
+
+from PIL import Image
+
+try:
+    # Registers an AVIF encoder with Pillow releases that lack a built-in one
+    import pillow_avif  # noqa: F401
+except ImportError:
+    pass
+
+THUMBNAIL_SIZE = (300, 200)
+THUMBNAIL_QUALITY = 85
+
+# Widths rendered for srcset. Heights follow the aspect ratio.
+RESPONSIVE_WIDTHS = (320, 640, 960, 1280, 1920)
+
+
+def open_source(source):
+    """Open a filesystem path or raw image bytes with PIL."""
+    if isinstance(source, bytes):
+        return Image.open(BytesIO(source))
+    return Image.open(source)
+
+
+def flatten(img):
+    """Return an RGB copy of ``img``, painting any transparency onto white."""
+    if img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info):
+        img = img.convert('RGBA')
+        background = Image.new('RGB', img.size, (255, 255, 255))
+        background.paste(img, mask=img.split()[-1])
+        return background
+    if img.mode != 'RGB':
+        return img.convert('RGB')
+    return img
+
+
+# Encoder settings per derivative format, plus the MIME type used in <source>.
+FORMATS = {
+    'jpeg': {
+        'format': 'JPEG', 'extension': 'jpg', 'mime_type': 'image/jpeg',
+        'options': {'quality': 85, 'optimize': True, 'progressive': True},
+    },
+    'webp': {
+        'format': 'WEBP', 'extension': 'webp', 'mime_type': 'image/webp',
+        'options': {'quality': 80, 'method': 4},
+    },
+}
+
+Image.init()
+if 'AVIF' in Image.SAVE:
+    FORMATS['avif'] = {
+        'format': 'AVIF', 'extension': 'avif', 'mime_type': 'image/avif',
+        'options': {'quality': 60},
+    }
+
+# Responsive formats in order of preference (best compression first).
+RESPONSIVE_FORMATS = tuple(fmt for fmt in ('avif', 'webp') if fmt in FORMATS)
+
+
+def responsive_specs():
+    """The (max_width, max_height, format) derivatives generated for every upload."""
+    return [(width, 0, fmt) for fmt in RESPONSIVE_FORMATS for width in RESPONSIVE_WIDTHS]
+
+
+def fit_size(size, max_width, max_height):
+    """
+    Size of ``size`` scaled down to fit ``max_width`` x ``max_height``,
+    keeping the aspect ratio. A max of 0 leaves that side unconstrained, and
+    images are never scaled up.
+    """
+    width, height = size
+    scale = min(
+        max_width / width if max_width else 1,
+        max_height / height if max_height else 1,
+        1,
+    )
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def render_thumbnail(source, size=THUMBNAIL_SIZE, quality=THUMBNAIL_QUALITY):
+    """Downscale ``source`` to fit within ``size`` and return JPEG bytes."""
+    with open_source(source) as img:
+        # For JPEGs this decodes at 1/2, 1/4 or 1/8 scale, which is much faster
+        # than decoding the full image only to throw most of it away.
+        img.draft('RGB', fit_size(img.size, *size))
+        img.thumbnail(size)
+        img = flatten(img)
+        output = BytesIO()
+        img.save(output, format='JPEG', quality=quality)
+    return output.getvalue()
+
+
+def render_derivatives(source, specs):
+    """
+    Decode ``source`` once and render every ``(max_width, max_height, format)``
+    in ``specs``. Returns ``[(spec, data, width, height), ...]``.
+    """
+    results = []
+    with open_source(source) as img:
+        sizes = [fit_size(img.size, max_width, max_height) for max_width, max_height, _ in specs]
+        img.draft('RGB', (max(w for w, _ in sizes), max(h for _, h in sizes)))
+        img = flatten(img)
+
+        for spec, size in zip(specs, sizes):
+            encoder = FORMATS[spec[2]]
+            resized = img.resize(fit_size(img.size, *size), Image.Resampling.LANCZOS)
+            output = BytesIO()
+            resized.save(output, format=encoder['format'], **encoder['options'])
+            results.append((spec, output.getvalue(), resized.width, resized.height))
+    return results
+
+
+def derivative_name(image_name, image_id, max_width, max_height, fmt):
+    """Storage name of a derivative, e.g. ``derivatives/12/goa_640x0.webp``."""
+    stem = os.path.splitext(os.path.basename(image_name))[0]
+    extension = FORMATS[fmt]['extension']
+    return f'derivatives/{image_id}/{stem}_{max_width}x{max_height}.{extension}'
+
+
+def thumbnail_name(image_name):
+    """Storage name of the thumbnail generated for ``image_name``."""
+    stem = os.path.splitext(os.path.basename(image_name))[0]
+    return f'thumbnails/thumb_{stem}.jpg'
+
+
+def read_source(field_file):
+    """
+    What a worker process should open for ``field_file``: its local path when
+    the storage has one, otherwise the file's bytes.
+    """
+    try:
+        return field_file.path
+    except NotImplementedError:
+        with field_file.open('rb') as f:
+            return f.read()
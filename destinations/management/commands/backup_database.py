@@ -1,12 +1,17 @@
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
 import os
 import subprocess
+import time
 from datetime import datetime
 import shutil
+from destinations import backup
+from destinations.backup import BACKUP_MODELS, DATA_DIR, MEDIA_DIR, PG_DUMP_DIR
 
 class Command(BaseCommand):
-    help = 'Backup the database'
+    help = 'Backup the database (and optionally media) into a timestamped directory'
 
     def add_arguments(self, parser):
         parser.add_argument(
@@ -21,75 +26,139 @@ class Command(BaseCommand):
             default=5,
             help='Number of backups to keep (default: 5)'
         )
+        parser.add_argument(
+            '--logical',
+            action='store_true',
+            help='Use the engine-independent logical dump even on PostgreSQL'
+        )
+        parser.add_argument(
+            '--jobs',
+            type=int,
+            default=os.cpu_count() or 1,
+            help='Parallel pg_dump jobs (default: number of CPUs)'
+        )
+        parser.add_argument(
+            '--compress',
+            choices=sorted(backup.COMPRESSED_EXTENSIONS),
+            default=backup.default_compression(),
+            help='Compression for logical dumps (default: zstd when installed, else gzip)'
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=2000,
+            help='Rows fetched per query by the logical dump (default: 2000)'
+        )
+        parser.add_argument(
+            '--media',
+            action='store_true',
+            help='Snapshot MEDIA_ROOT too, hard-linking files unchanged since the previous backup'
+        )
 
     def handle(self, *args, **options):
         output_dir = options['output']
         keep_backups = max(1, options['keep'])
-        
+
         # Create output directory if it doesn't exist
         os.makedirs(output_dir, exist_ok=True)
-        
-        # Get database settings
-        db = settings.DATABASES['default']
-        db_name = db['NAME']
-        db_user = db.get('USER', '')
-        db_password = db.get('PASSWORD', '')
-        db_host = db.get('HOST', 'localhost')
-        db_port = db.get('PORT', '')
-        
-        # Generate backup filename with timestamp
+        previous = self.latest_backup(output_dir)
+
+        # Each backup is a directory: manifest.json plus the dump and media
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        backup_file = os.path.join(output_dir, f'backup_{timestamp}.sql')
-        
-        # Build the pg_dump command
-        cmd = ['pg_dump']
-        
-        if db_user:
-            cmd.extend(['-U', db_user])
-        if db_host:
-            cmd.extend(['-h', db_host])
-        if db_port:
-            cmd.extend(['-p', str(db_port)])
-        
-        cmd.extend(['-F', 'c', '-f', backup_file, db_name])
-        
-        # Set PGPASSWORD environment variable if password is provided
-        env = os.environ.copy()
-        if db_password:
-            env['PGPASSWORD'] = db_password
-        
-        # Run the backup command
-        self.stdout.write(f'Backing up database to {backup_file}...')
+        backup_dir = os.path.join(output_dir, f'backup_{timestamp}')
+        suffix = 1
+        while os.path.exists(backup_dir):
+            backup_dir = os.path.join(output_dir, f'backup_{timestamp}_{suffix}')
+            suffix += 1
+        os.makedirs(backup_dir)
+        manifest = {
+            'created_at': timezone.now().isoformat(),
+            'engine': connection.vendor,
+        }
+
+        self.stdout.write(f'Backing up database to {backup_dir}...')
+        start = time.perf_counter()
         try:
-            subprocess.run(cmd, check=True, env=env)
-            self.stdout.write(self.style.SUCCESS('Backup completed successfully!'))
-            
-            # Clean up old backups
-            self.cleanup_old_backups(output_dir, keep_backups)
-            
-        except subprocess.CalledProcessError as e:
+            if connection.vendor == 'postgresql' and not options['logical']:
+                self.pg_dump(backup_dir, options['jobs'])
+                manifest['format'] = 'pg_dump'
+            else:
+                manifest['format'] = 'logical'
+                manifest['tables'] = self.logical_dump(backup_dir, options['compress'], max(1, options['chunk_size']))
+
+            if options['media']:
+                previous_media = os.path.join(previous, MEDIA_DIR) if previous else None
+                stats = backup.snapshot_media(
+                    settings.MEDIA_ROOT, os.path.join(backup_dir, MEDIA_DIR),
+                    previous_media if previous_media and os.path.isdir(previous_media) else None,
+                )
+                manifest['media'] = stats
+                self.stdout.write(
+                    f'Media: {stats["files"]} files, {stats["linked"]} hard-linked from the previous backup, '
+                    f'{stats["copied"]} copied ({stats["bytes_copied"] / (1024 * 1024):.1f} MB)'
+                )
+
+            # Written last: a backup without a manifest is incomplete
+            backup.write_manifest(backup_dir, manifest)
+        except (subprocess.CalledProcessError, OSError, CommandError) as e:
             self.stdout.write(self.style.ERROR(f'Backup failed: {e}'))
-            # Remove the incomplete backup file if it exists
-            if os.path.exists(backup_file):
-                os.remove(backup_file)
-    
+            # Remove the incomplete backup
+            shutil.rmtree(backup_dir, ignore_errors=True)
+            return
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Backup completed successfully in {time.perf_counter() - start:.1f}s!'
+        ))
+        # Clean up old backups
+        self.cleanup_old_backups(output_dir, keep_backups)
+
+    def pg_dump(self, backup_dir, jobs):
+        db = settings.DATABASES['default']
+        # Directory format is the only one pg_dump can write in parallel
+        cmd = ['pg_dump', *backup.pg_connection_args(db), '-F', 'd', '-j', str(max(1, jobs)),
+               '-f', os.path.join(backup_dir, PG_DUMP_DIR), db['NAME']]
+        try:
+            subprocess.run(cmd, check=True, env=backup.pg_env(db))
+        except FileNotFoundError:
+            raise CommandError('pg_dump not found; install the PostgreSQL client tools or use --logical')
+
+    def logical_dump(self, backup_dir, compression, chunk_size):
+        if compression == 'zstd' and backup.zstandard is None:
+            raise CommandError('--compress zstd requires the "zstandard" package')
+        data_dir = os.path.join(backup_dir, DATA_DIR)
+        os.makedirs(data_dir)
+        tables = {}
+        # One transaction, so engines with snapshot reads (MySQL's default
+        # REPEATABLE READ, SQLite) dump all tables as of the same moment.
+        with transaction.atomic():
+            for model in BACKUP_MODELS:
+                entry = backup.dump_model(model, data_dir, compression, chunk_size)
+                tables[backup.model_label(model)] = entry
+                self.stdout.write(f'  {backup.model_label(model)}: {entry["rows"]} rows')
+        return tables
+
+    def latest_backup(self, backup_dir):
+        backups = self.list_backups(backup_dir)
+        return backups[-1][1] if backups else None
+
+    def list_backups(self, backup_dir):
+        """Complete backups (those with a manifest), oldest first."""
+        backups = []
+        for filename in os.listdir(backup_dir):
+            filepath = os.path.join(backup_dir, filename)
+            if filename.startswith('backup_') and os.path.exists(os.path.join(filepath, backup.MANIFEST)):
+                backups.append((filename, filepath))
+        return sorted(backups)
+
     def cleanup_old_backups(self, backup_dir, keep):
         """Remove old backups, keeping only the specified number of most recent ones."""
         try:
-            # Get all backup files
-            backups = []
-            for filename in os.listdir(backup_dir):
-                if filename.startswith('backup_') and filename.endswith('.sql'):
-                    filepath = os.path.join(backup_dir, filename)
-                    backups.append((os.path.getmtime(filepath), filepath))
-            
-            # Sort by modification time (oldest first)
-            backups.sort()
-            
-            # Remove old backups
+            backups = self.list_backups(backup_dir)
+
+            # Hard-linked media stays on disk while a newer snapshot uses it
             for _, filepath in backups[:-keep]:
                 self.stdout.write(f'Removing old backup: {filepath}')
-                os.remove(filepath)
-                
+                shutil.rmtree(filepath)
+
         except Exception as e:
-            self.stdout.write(self.style.ERROR(f'Error cleaning up old backups: {e}'))
\ No newline at end of file
+            self.stdout.write(self.style.ERROR(f'Error cleaning up old backups: {e}'))
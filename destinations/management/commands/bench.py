@@ -0,0 +1,287 @@
+import json
+import math
+import os
+import platform
+import shutil
+import tempfile
+import time
+from io import StringIO
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client, override_settings
+from django.test.utils import (
+    CaptureQueriesContext, setup_databases, setup_test_environment, teardown_databases, teardown_test_environment,
+)
+from django.urls import reverse
+from destinations import synthetic
+from destinations.models import Destination
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+REQUEST_CASES = ('list', 'detail', 'api_list', 'api_retrieve', 'search')
+BATCH_CASES = ('export', 'import', 'thumbnails')
+SEARCH_QUERIES = ['fort', 'golden temple', 'kerala', 'misty falls', 'market', 'zzz']
+
+
+def percentile(sorted_values, q):
+    """Nearest-rank percentile of an already sorted list."""
+    index = max(0, min(len(sorted_values) - 1, math.ceil(q * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return round(peak / (1024 * 1024 if platform.system() == 'Darwin' else 1024), 1)
+
+
+def summarize(timings, queries, rows):
+    timings = sorted(timings)
+    total = sum(timings) / 1_000_000_000
+    return {
+        'runs': len(timings),
+        'p50_ms': round(percentile(timings, 0.50) / 1_000_000, 3),
+        'p95_ms': round(percentile(timings, 0.95) / 1_000_000, 3),
+        'p99_ms': round(percentile(timings, 0.99) / 1_000_000, 3),
+        'max_ms': round(timings[-1] / 1_000_000, 3),
+        'ops_per_s': round(len(timings) / total, 2) if total else None,
+        'rows_per_s': round(rows * len(timings) / total, 1) if total and rows else None,
+        'queries': max(queries),
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def compare(report, baseline, tolerance):
+    """Regressions of ``report`` against ``baseline``, as human readable lines."""
+    regressions = []
+    for name, current in report['cases'].items():
+        previous = baseline.get('cases', {}).get(name)
+        if previous is None:
+            continue
+        for metric in ('p50_ms', 'p95_ms'):
+            if previous[metric] and current[metric] > previous[metric] * (1 + tolerance):
+                regressions.append(
+                    f'{name}: {metric} {current[metric]} > {previous[metric]} (+{tolerance:.0%} allowed)'
+                )
+        if current['queries'] > previous['queries']:
+            regressions.append(f'{name}: queries {current["queries"]} > {previous["queries"]}')
+    current_rss, previous_rss = report.get('peak_rss_mb'), baseline.get('peak_rss_mb')
+    if current_rss and previous_rss and current_rss > previous_rss * (1 + tolerance):
+        regressions.append(f'peak_rss_mb {current_rss} > {previous_rss} (+{tolerance:.0%} allowed)')
+    return regressions
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the destination hot paths on synthetic data, optionally failing on regressions'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--count',
+            type=int,
+            default=1000,
+            help='Synthetic destinations to create (default: 1000)'
+        )
+        parser.add_argument(
+            '--images',
+            type=int,
+            default=1,
+            help='Images per destination (default: 1)'
+        )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            default=42,
+            help='Random seed for the synthetic data (default: 42)'
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=50,
+            help='Runs of each request case (default: 50)'
+        )
+        parser.add_argument(
+            '--batch-repeat',
+            type=int,
+            default=3,
+            help='Runs of export, import and thumbnail generation (default: 3)'
+        )
+        parser.add_argument(
+            '--cases',
+            type=str,
+            default=','.join(REQUEST_CASES + BATCH_CASES),
+            help='Comma-separated cases to run (default: all)'
+        )
+        parser.add_argument(
+            '--output',
+            type=str,
+            help='Write the JSON report to this file instead of stdout'
+        )
+        parser.add_argument(
+            '--baseline',
+            type=str,
+            help='Fail if the results regress against this earlier report'
+        )
+        parser.add_argument(
+            '--tolerance',
+            type=float,
+            default=0.25,
+            help='Allowed slowdown against the baseline, as a fraction (default: 0.25)'
+        )
+        parser.add_argument(
+            '--save-baseline',
+            type=str,
+            help='Also write the report to this file, for later --baseline runs'
+        )
+        parser.add_argument(
+            '--current-db',
+            action='store_true',
+            help='Use the configured database inside a rolled-back transaction instead of a test database'
+        )
+
+    def handle(self, *args, **options):
+        cases = [case.strip() for case in options['cases'].split(',') if case.strip()]
+        unknown = set(cases) - set(REQUEST_CASES + BATCH_CASES)
+        if unknown:
+            raise CommandError(f'Unknown cases: {", ".join(sorted(unknown))}')
+        baseline = None
+        if options['baseline']:
+            try:
+                with open(options['baseline']) as f:
+                    baseline = json.load(f)
+            except (OSError, ValueError) as e:
+                raise CommandError(f'Could not read baseline {options["baseline"]}: {e}')
+
+        media_root = tempfile.mkdtemp(prefix='bench-media-')
+        try:
+            with override_settings(MEDIA_ROOT=media_root):
+                if options['current_db']:
+                    with transaction.atomic():
+                        report = self.run(cases, media_root, options)
+                        transaction.set_rollback(True)
+                else:
+                    report = self.run_in_test_databases(cases, media_root, options)
+        finally:
+            shutil.rmtree(media_root, ignore_errors=True)
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+            self.stdout.write(self.style.SUCCESS(f'Report written to {options["output"]}'))
+        else:
+            self.stdout.write(output)
+        if options['save_baseline']:
+            with open(options['save_baseline'], 'w') as f:
+                f.write(output + '\n')
+            self.stdout.write(self.style.SUCCESS(f'Baseline saved to {options["save_baseline"]}'))
+
+        if baseline is not None:
+            if (baseline.get('count'), baseline.get('images')) != (report['count'], report['images']):
+                self.stdout.write(self.style.WARNING(
+                    f'Baseline was run with {baseline.get("count")} destinations x {baseline.get("images")} images'
+                ))
+            regressions = compare(report, baseline, options['tolerance'])
+            if regressions:
+                raise CommandError('Performance regressions:\n  ' + '\n  '.join(regressions))
+            self.stdout.write(self.style.SUCCESS('No regressions against the baseline'))
+
+    def run_in_test_databases(self, cases, media_root, options):
+        # The synthetic rows go into throwaway test databases, never the real ones
+        setup_test_environment()
+        old_config = setup_databases(verbosity=0, interactive=False)
+        try:
+            return self.run(cases, media_root, options)
+        finally:
+            teardown_databases(old_config, verbosity=0)
+            teardown_test_environment()
+
+    def run(self, cases, media_root, options):
+        start = time.perf_counter()
+        synthetic.create_destinations(options['count'], images=options['images'], seed=options['seed'])
+        populate_s = time.perf_counter() - start
+
+        self.client = Client()
+        self.work_dir = os.path.join(media_root, 'bench')
+        os.makedirs(self.work_dir)
+        self.slugs = list(Destination.objects.order_by('pk').values_list('slug', flat=True)[:max(1, options['repeat'])])
+        self.total = Destination.objects.count()
+        if 'import' in cases:
+            # Import reads back an export of the synthetic rows
+            call_command('export_data', output=self.export_path, stdout=StringIO())
+
+        results = {}
+        for case in cases:
+            repeat = options['repeat'] if case in REQUEST_CASES else options['batch_repeat']
+            results[case] = self.measure(case, max(1, repeat))
+        return {
+            'count': options['count'],
+            'images': options['images'],
+            'seed': options['seed'],
+            'database': connection.vendor,
+            'populate_s': round(populate_s, 3),
+            'peak_rss_mb': peak_rss_mb(),
+            'cases': results,
+        }
+
+    def measure(self, case, repeat):
+        """Time ``repeat`` cold runs of a case: the cache is cleared before each."""
+        step = getattr(self, f'case_{case}')
+        timings, queries = [], []
+        rows = 0
+        for i in range(repeat):
+            cache.clear()
+            with CaptureQueriesContext(connection) as context:
+                start = time.perf_counter_ns()
+                rows = step(i)
+                timings.append(time.perf_counter_ns() - start)
+            queries.append(len(context.captured_queries))
+        return summarize(timings, queries, rows)
+
+    def get(self, path, **params):
+        response = self.client.get(path, params)
+        if response.status_code != 200:
+            raise CommandError(f'GET {path} returned {response.status_code}')
+        return response
+
+    def case_list(self, i):
+        self.get(reverse('destinations:destination-list'))
+
+    def case_detail(self, i):
+        self.get(reverse('destinations:destination-detail', args=[self.slugs[i % len(self.slugs)]]))
+
+    def case_api_list(self, i):
+        self.get(reverse('destinations:api-root') + 'destinations/')
+
+    def case_api_retrieve(self, i):
+        self.get(reverse('destinations:api-root') + f'destinations/{self.slugs[i % len(self.slugs)]}/')
+
+    def case_search(self, i):
+        self.get(reverse('destinations:destination-list'), q=SEARCH_QUERIES[i % len(SEARCH_QUERIES)])
+
+    def case_export(self, i):
+        call_command('export_data', output=self.export_path, stdout=StringIO())
+        return self.total
+
+    def case_import(self, i):
+        call_command('import_data', self.export_path, image_root=settings.MEDIA_ROOT, stdout=StringIO())
+        return self.total
+
+    def case_thumbnails(self, i):
+        call_command(
+            'generate_thumbnails', force=True, restart=True,
+            checkpoint=os.path.join(self.work_dir, 'thumbnails.json'), stdout=StringIO(),
+        )
+        return self.total
+
+    @property
+    def export_path(self):
+        return os.path.join(self.work_dir, 'export.json')
@@ -0,0 +1,98 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from destinations.models import Destination
+from destinations.search import icontains_search, search_destinations
+
+STATES = ['Kerala', 'Goa', 'Rajasthan', 'Tamil Nadu', 'Himachal Pradesh', 'Meghalaya', 'Uttar Pradesh', 'Karnataka']
+WORDS = [
+    'temple', 'beach', 'fort', 'palace', 'lake', 'hill', 'valley', 'falls', 'garden', 'museum',
+    'river', 'forest', 'sanctuary', 'cave', 'market', 'bay', 'island', 'peak', 'monastery', 'desert',
+    'ancient', 'royal', 'serene', 'colonial', 'sacred', 'misty', 'golden', 'marble', 'tea', 'spice',
+]
+QUERIES = ['temple', 'golden palace', 'misty hill', 'beach', 'kerala', 'marble fort', 'spice market', 'zzz']
+
+
+class Command(BaseCommand):
+    help = 'Benchmark full-text search against the icontains scan on synthetic data'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes',
+            type=str,
+            default='10000,100000,1000000',
+            help='Comma-separated table sizes to benchmark (default: 10000,100000,1000000)'
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=5,
+            help='Times to run each query per size (default: 5)'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=5000,
+            help='Rows per bulk_create batch (default: 5000)'
+        )
+
+    def handle(self, *args, **options):
+        try:
+            sizes = sorted(int(size) for size in options['sizes'].split(','))
+        except ValueError:
+            raise CommandError('--sizes must be a comma-separated list of integers')
+
+        rng = random.Random(42)
+
+        # Everything runs inside one transaction that is rolled back, so the
+        # synthetic rows never reach the real table.
+        with transaction.atomic():
+            created = 0
+            for size in sizes:
+                self.populate(size - created, created, rng, options['batch_size'])
+                created = max(created, size)
+
+                self.stdout.write(self.style.MIGRATE_HEADING(f'\n{created} rows'))
+                self.stdout.write(f'{"query":<16}{"fulltext ms":>14}{"icontains ms":>14}{"hits":>10}')
+                for query in QUERIES:
+                    fulltext_ms, hits = self.time_query(search_destinations, query, options['repeat'])
+                    icontains_ms, _ = self.time_query(icontains_search, query, options['repeat'])
+                    self.stdout.write(f'{query:<16}{fulltext_ms:>14.2f}{icontains_ms:>14.2f}{hits:>10}')
+
+            transaction.set_rollback(True)
+
+        self.stdout.write(self.style.SUCCESS('\nBenchmark complete (synthetic rows rolled back)'))
+
+    def populate(self, count, offset, rng, batch_size):
+        """Insert ``count`` synthetic destinations with bulk_create."""
+        batch = []
+        for i in range(offset, offset + count):
+            name = ' '.join(rng.sample(WORDS, 2)).title()
+            batch.append(Destination(
+                place_name=name,
+                slug=f'bench-{i}',
+                weather=rng.choice(['Sunny', 'Cloudy', 'Rainy', 'Snowy']),
+                state=rng.choice(STATES),
+                district=f'District {rng.randint(1, 500)}',
+                description=' '.join(rng.choices(WORDS, k=30)),
+            ))
+            if len(batch) >= batch_size:
+                Destination.objects.bulk_create(batch)
+                batch = []
+        if batch:
+            Destination.objects.bulk_create(batch)
+
+    def time_query(self, search, query, repeat):
+        """Median milliseconds to fetch the first page and the total count."""
+        timings = []
+        hits = 0
+        for _ in range(repeat):
+            start = time.perf_counter()
+            queryset = search(Destination.objects.all(), query)
+            list(queryset[:10])
+            hits = queryset.count()
+            timings.append((time.perf_counter() - start) * 1000)
+        return statistics.median(timings), hits
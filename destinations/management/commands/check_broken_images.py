@@ -1,39 +1,195 @@
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 from django.core.management.base import BaseCommand
-from destinations.models import DestinationImage
-import os
-from django.core.files.storage import default_storage
+from django.db import transaction
+from django.utils import timezone
+from destinations.models import Destination, DestinationImage, ImageJob
+from PIL import Image
+
+# Problems an image can have. Only the thumbnail ones are fixable, by
+# queueing derivative generation again.
+MISSING_FILE = 'missing_file'
+EMPTY_FIELD = 'empty_field'
+UNREADABLE = 'unreadable'
+UNDECODABLE = 'undecodable'
+BAD_DIMENSIONS = 'bad_dimensions'
+MISSING_THUMBNAIL = 'missing_thumbnail'
+FAILED_THUMBNAIL = 'failed_thumbnail'
+FIXABLE = (MISSING_THUMBNAIL, FAILED_THUMBNAIL)
+
+
+def verify_image(f):
+    """Run PIL's structural check, then decode a reduced copy to prove the pixel data is readable."""
+    with Image.open(f) as img:
+        img.verify()
+    f.seek(0)
+    with Image.open(f) as img:
+        size = img.size
+        # draft() lets JPEGs decode at 1/8 scale, which still reads every block
+        img.draft('RGB', (64, 64))
+        img.load()
+    return size
+
 
 class Command(BaseCommand):
-    help = 'Check for broken image references in the database'
+    help = 'Check images for missing or corrupt files and missing thumbnails'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify',
+            action='store_true',
+            help='Decode every image with PIL and check its dimensions (slower)'
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=16,
+            help='Threads reading from storage in parallel (default: 16)'
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=2000,
+            help='Images fetched from the database per query (default: 2000)'
+        )
+        parser.add_argument(
+            '--report',
+            type=str,
+            metavar='PATH',
+            help='Write a JSON report to PATH ("-" for stdout)'
+        )
+        parser.add_argument(
+            '--fix',
+            action='store_true',
+            help='Queue thumbnail generation again for images with a missing or failed thumbnail'
+        )
 
     def handle(self, *args, **options):
-        broken_images = []
-        
-        for img in DestinationImage.objects.all():
-            if not img.image:
-                broken_images.append((img, 'Image field is empty'))
-                continue
-            
-            if not default_storage.exists(img.image.name):
-                broken_images.append((img, 'File does not exist'))
-                continue
-            
-            try:
-                # Try to open the image to check if it's valid
-                with default_storage.open(img.image.name) as f:
-                    # Just read a small part of the file to check if it's accessible
-                    f.read(1024)
-            except Exception as e:
-                broken_images.append((img, f'Error reading file: {str(e)}'))
-
-        # Print results
-        if broken_images:
-            self.stdout.write(self.style.ERROR(f'Found {len(broken_images)} broken images:'))
-            for img, reason in broken_images:
-                self.stdout.write(f'- {img} (ID: {img.id}): {reason}')
-                if img.destination:
-                    self.stdout.write(f'  Destination: {img.destination.place_name} (ID: {img.destination.id})')
-                if img.image:
-                    self.stdout.write(f'  Path: {img.image.path}')
+        self.verify = options['verify']
+        chunk_size = max(1, options['chunk_size'])
+        images = (
+            DestinationImage.objects.select_related('destination')
+            .only('id', 'image', 'thumbnail', 'thumbnail_status', 'destination__id', 'destination__place_name')
+            .order_by('id')
+        )
+
+        issues = []
+        scanned = 0
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=max(1, options['workers'])) as pool:
+            chunk = []
+            for img in images.iterator(chunk_size=chunk_size):
+                chunk.append(img)
+                if len(chunk) == chunk_size:
+                    issues += self.check_chunk(pool, chunk)
+                    scanned += len(chunk)
+                    chunk = []
+            if chunk:
+                issues += self.check_chunk(pool, chunk)
+                scanned += len(chunk)
+        elapsed = time.perf_counter() - start
+
+        fixed = self.fix(issues) if options['fix'] else 0
+
+        if options['report']:
+            self.write_report(options['report'], scanned, elapsed, issues, fixed)
+
+        # Keep stdout pure JSON when the report goes there
+        out = self.stderr if options['report'] == '-' else self.stdout
+        rate = scanned / elapsed if elapsed else 0
+        summary = f'Checked {scanned} images in {elapsed:.1f}s ({rate:.0f} images/s)'
+        if issues:
+            out.write(self.style.ERROR(f'{summary}: found {len(issues)} problems'))
+            for issue in issues:
+                out.write(
+                    f'- Image {issue["image_id"]} of {issue["destination"]} '
+                    f'(ID: {issue["destination_id"]}): {issue["problem"]} {issue["detail"]}'.rstrip()
+                )
         else:
-            self.stdout.write(self.style.SUCCESS('No broken images found!'))
\ No newline at end of file
+            out.write(self.style.SUCCESS(f'{summary}: no broken images found!'))
+        if fixed:
+            out.write(self.style.SUCCESS(f'Queued thumbnail generation for {fixed} images'))
+
+    def check_chunk(self, pool, chunk):
+        issues = []
+        for img, problems in zip(chunk, pool.map(self.check, chunk)):
+            for problem, detail in problems:
+                issues.append({
+                    'image_id': img.id,
+                    'destination_id': img.destination.id,
+                    'destination': img.destination.place_name,
+                    'image': img.image.name,
+                    'thumbnail': img.thumbnail.name if img.thumbnail else None,
+                    'problem': problem,
+                    'detail': detail,
+                })
+        return issues
+
+    def check(self, img):
+        """Storage-only checks for one image; runs in a worker thread."""
+        if not img.image:
+            return [(EMPTY_FIELD, '')]
+
+        storage = img.image.storage
+        try:
+            with storage.open(img.image.name) as f:
+                if self.verify:
+                    width, height = verify_image(f)
+                    if width <= 0 or height <= 0:
+                        return [(BAD_DIMENSIONS, f'{width}x{height}')]
+                else:
+                    f.read(1024)
+        except FileNotFoundError:
+            return [(MISSING_FILE, '')]
+        except OSError as e:
+            # PIL raises OSError subclasses for truncated/corrupt data
+            return [(UNDECODABLE if self.verify else UNREADABLE, str(e))]
+        except (SyntaxError, ValueError, Image.DecompressionBombError) as e:
+            return [(UNDECODABLE, str(e))]
+
+        if img.thumbnail_status == DestinationImage.THUMBNAIL_FAILED:
+            return [(FAILED_THUMBNAIL, '')]
+        if img.thumbnail_status == DestinationImage.THUMBNAIL_READY:
+            if not img.thumbnail or not img.thumbnail.storage.exists(img.thumbnail.name):
+                return [(MISSING_THUMBNAIL, img.thumbnail.name or '')]
+        return []
+
+    def fix(self, issues):
+        """Reset fixable images to pending and queue a job for each (in bulk)."""
+        ids = {issue['image_id'] for issue in issues if issue['problem'] in FIXABLE}
+        if not ids:
+            return 0
+        active = set(
+            ImageJob.objects.filter(image_id__in=ids, status__in=[ImageJob.PENDING, ImageJob.RUNNING])
+            .values_list('image_id', flat=True)
+        )
+        with transaction.atomic():
+            DestinationImage.objects.filter(pk__in=ids).update(thumbnail_status=DestinationImage.THUMBNAIL_PENDING)
+            # update() skips the signals that would refresh the cached pages
+            Destination.objects.filter(images__pk__in=ids).distinct().touch()
+            ImageJob.objects.bulk_create([ImageJob(image_id=image_id) for image_id in sorted(ids - active)])
+        for issue in issues:
+            issue['fixed'] = issue['image_id'] in ids
+        return len(ids)
+
+    def write_report(self, path, scanned, elapsed, issues, fixed):
+        counts = {}
+        for issue in issues:
+            counts[issue['problem']] = counts.get(issue['problem'], 0) + 1
+        report = {
+            'generated_at': timezone.now().isoformat(),
+            'scanned': scanned,
+            'seconds': round(elapsed, 3),
+            'verified': self.verify,
+            'counts': counts,
+            'fixed': fixed,
+            'issues': issues,
+        }
+        if path == '-':
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        self.stdout.write(f'Report written to {path}')
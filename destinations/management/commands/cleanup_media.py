@@ -1,37 +1,209 @@
 import os
-from django.core.management.base import BaseCommand
+import queue
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
 from django.conf import settings
-from django.db.models import Q
-from destinations.models import DestinationImage
+from django.core.management.base import BaseCommand
+from destinations.models import DestinationImage, ImageDerivative
+from destinations.storage import CONTENT_PREFIX
+
+# MEDIA_ROOT subdirectories written by this app. Anything else under
+# MEDIA_ROOT belongs to someone else and is never collected.
+MANAGED_DIRS = ('destinations', 'thumbnails', 'derivatives', CONTENT_PREFIX)
+
+# (model, file field) pairs that can reference a media file
+REFERENCES = (
+    (DestinationImage, 'image'),
+    (DestinationImage, 'thumbnail'),
+    (ImageDerivative, 'file'),
+)
+
+# Marks the end of one directory scan on the queue
+SCAN_DONE = object()
+
 
 class Command(BaseCommand):
-    help = 'Clean up unused media files'
+    help = 'Delete (or quarantine) media files that no image, thumbnail or derivative references'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Report unreferenced files without touching them'
+        )
+        parser.add_argument(
+            '--quarantine',
+            nargs='?',
+            const=os.path.join(settings.BASE_DIR, 'media_quarantine'),
+            metavar='DIR',
+            help='Move unreferenced files here instead of deleting them (default: media_quarantine/)'
+        )
+        parser.add_argument(
+            '--min-age',
+            type=float,
+            default=24,
+            metavar='HOURS',
+            help='Leave files modified more recently than this alone, so in-flight uploads survive (default: 24)'
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=8,
+            help='Threads scanning subdirectories in parallel (default: 8)'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Files checked against the database per query (default: 500)'
+        )
 
     def handle(self, *args, **options):
-        media_root = settings.MEDIA_ROOT
-        all_files = set()
-        used_files = set()
-
-        # Get all files in the media directory
-        for root, dirs, files in os.walk(media_root):
-            for file in files:
-                all_files.add(os.path.relpath(os.path.join(root, file), media_root))
-
-        # Get all files referenced in the database
-        for image in DestinationImage.objects.all():
-            if image.image:
-                used_files.add(image.image.name)
-
-        # Find unused files
-        unused_files = all_files - used_files
-
-        # Delete unused files
-        for file_path in unused_files:
-            full_path = os.path.join(media_root, file_path)
+        self.media_root = settings.MEDIA_ROOT
+        self.dry_run = options['dry_run']
+        self.quarantine = None
+        if options['quarantine'] and not self.dry_run:
+            self.quarantine = os.path.join(options['quarantine'], datetime.now().strftime('%Y%m%d_%H%M%S'))
+        self.verbosity = options['verbosity']
+        self.batch_size = max(1, options['batch_size'])
+        self.min_mtime = time.time() - options['min_age'] * 60 * 60
+        workers = max(1, options['workers'])
+
+        self.stats = {'scanned': 0, 'recent': 0, 'orphaned': 0, 'bytes': 0, 'errors': 0}
+        start = time.perf_counter()
+
+        # Scanner threads feed batches of (name, size) through a bounded
+        # queue, so memory holds a few batches no matter how many files there
+        # are. Database checks and deletes stay on this thread.
+        batches = queue.Queue(maxsize=workers * 4)
+        self.stop = threading.Event()
+        tasks = list(self.scan_tasks())
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(self.scan, path, recursive, batches) for path, recursive in tasks]
+            remaining = len(futures)
+            try:
+                while remaining:
+                    batch = batches.get()
+                    if batch is SCAN_DONE:
+                        remaining -= 1
+                    else:
+                        self.collect(batch)
+            except BaseException:
+                # Nothing reads the queue any more: stop the scanners, or
+                # leaving the with block waits forever on a blocked put()
+                self.stop.set()
+                raise
+        for future in futures:
+            if future.exception():
+                self.stats['errors'] += 1
+                self.stderr.write(f'Scan failed: {future.exception()}')
+
+        stats = self.stats
+        action = 'would be removed' if self.dry_run else ('quarantined' if self.quarantine else 'deleted')
+        self.stdout.write(
+            f'Scanned {stats["scanned"]} files in {time.perf_counter() - start:.1f}s: '
+            f'{stats["orphaned"]} unreferenced ({stats["bytes"] / (1024 * 1024):.1f} MB) {action}, '
+            f'{stats["recent"]} too recent to touch, {stats["errors"]} errors'
+        )
+        if self.quarantine and stats['orphaned']:
+            self.stdout.write(f'Quarantined files are in {self.quarantine}')
+        if self.dry_run:
+            self.stdout.write(self.style.SUCCESS('Dry run complete, no files were changed'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'Cleaned up {stats["orphaned"]} unused files'))
+
+    def scan_tasks(self):
+        """Split the managed directories into (path, recursive) units of parallel work."""
+        for name in MANAGED_DIRS:
+            top = os.path.join(self.media_root, name)
+            if not os.path.isdir(top):
+                continue
+            yield top, False
+            with os.scandir(top) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        yield entry.path, True
+
+    def scan(self, path, recursive, batches):
+        try:
+            batch = []
+            pending = [path]
+            while pending and not self.stop.is_set():
+                with os.scandir(pending.pop()) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False):
+                            if recursive:
+                                pending.append(entry.path)
+                            continue
+                        if not entry.is_file(follow_symlinks=False):
+                            continue
+                        stat = entry.stat(follow_symlinks=False)
+                        name = os.path.relpath(entry.path, self.media_root).replace(os.sep, '/')
+                        batch.append((name, stat.st_size, stat.st_mtime))
+                        if len(batch) == self.batch_size:
+                            if not self.put(batches, batch):
+                                return
+                            batch = []
+            if batch:
+                self.put(batches, batch)
+        finally:
+            self.put(batches, SCAN_DONE)
+
+    def put(self, batches, item):
+        """Queue ``item`` unless the run is stopping; returns whether it was queued."""
+        while not self.stop.is_set():
+            try:
+                batches.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def collect(self, batch):
+        """Remove the files of one batch that are old enough and unreferenced."""
+        self.stats['scanned'] += len(batch)
+        candidates = {}
+        for name, size, mtime in batch:
+            if mtime > self.min_mtime:
+                self.stats['recent'] += 1
+            else:
+                candidates[name] = size
+        if not candidates:
+            return
+
+        referenced = set()
+        for model, field in REFERENCES:
+            referenced.update(
+                model.objects.filter(**{f'{field}__in': list(candidates)}).values_list(field, flat=True)
+            )
+
+        for name, size in candidates.items():
+            if name in referenced:
+                continue
+            self.stats['orphaned'] += 1
+            self.stats['bytes'] += size
+            if self.dry_run:
+                if self.verbosity >= 2:
+                    self.stdout.write(f'Would remove: {name}')
+                continue
             try:
-                os.remove(full_path)
-                self.stdout.write(f'Deleted: {file_path}')
+                self.remove(name)
             except OSError as e:
-                self.stderr.write(f'Error deleting {file_path}: {e}')
+                self.stats['errors'] += 1
+                self.stderr.write(f'Error deleting {name}: {e}')
+            else:
+                if self.verbosity >= 2:
+                    self.stdout.write(f'Deleted: {name}')
 
-        self.stdout.write(self.style.SUCCESS(f'Cleaned up {len(unused_files)} unused files'))
\ No newline at end of file
+    def remove(self, name):
+        path = os.path.join(self.media_root, name)
+        if self.quarantine:
+            target = os.path.join(self.quarantine, name)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            shutil.move(path, target)
+        else:
+            os.remove(path)
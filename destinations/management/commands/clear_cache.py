@@ -1,6 +1,7 @@
 from django.core.management.base import BaseCommand
 from django.core.cache import cache
 from django.conf import settings
+from destinations import cache as destination_cache
 import os
 import shutil
 
@@ -13,8 +14,32 @@ class Command(BaseCommand):
             action='store_true',
             help='Clear all caches, including file-based caches'
         )
+        parser.add_argument(
+            '--destination',
+            action='append',
+            default=[],
+            metavar='SLUG',
+            help='Only purge cached pages and API payloads for this destination (repeatable)'
+        )
+        parser.add_argument(
+            '--namespace',
+            action='append',
+            default=[],
+            choices=destination_cache.NAMESPACES,
+            help='Only purge one destination cache namespace (repeatable)'
+        )
 
     def handle(self, *args, **options):
+        # Targeted purges leave the rest of the cache warm
+        if options['destination'] or options['namespace']:
+            for slug in options['destination']:
+                destination_cache.invalidate_destination(slug)
+                self.stdout.write(self.style.SUCCESS(f'Purged cache for destination: {slug}'))
+            for namespace in options['namespace']:
+                destination_cache.purge_namespace(namespace)
+                self.stdout.write(self.style.SUCCESS(f'Purged cache namespace: {namespace}'))
+            return
+
         # Clear default cache
         self.stdout.write('Clearing default cache...')
         cache.clear()
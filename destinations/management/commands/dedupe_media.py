@@ -0,0 +1,138 @@
+import os
+import shutil
+
+from django.core.files import File
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from destinations.models import Destination, DestinationImage, ImageDerivative
+from destinations.storage import (
+    CONTENT_PREFIX, content_hash, content_name, get_media_storage, is_enabled, is_referenced,
+)
+
+# (model, file field, how to reach the destination id from a row)
+FILE_FIELDS = (
+    (DestinationImage, 'image', 'destination_id'),
+    (DestinationImage, 'thumbnail', 'destination_id'),
+    (ImageDerivative, 'file', 'image__destination_id'),
+)
+
+
+class Command(BaseCommand):
+    help = 'Move existing media to content-addressed names, storing identical files once'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Rows updated per transaction (default: 500)'
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Report what would be deduplicated without changing anything'
+        )
+
+    def handle(self, *args, **options):
+        self.storage = get_media_storage()
+        self.dry_run = options['dry_run']
+        batch_size = max(1, options['batch_size'])
+        if not is_enabled():
+            self.stdout.write(self.style.WARNING(
+                'DESTINATION_CONTENT_ADDRESSED_MEDIA is off: existing files will be '
+                'deduplicated, but new uploads will not be until it is enabled'
+            ))
+
+        # old name -> content-addressed name, so each file is hashed once
+        self.renamed = {}
+        self.seen = set()
+        self.stats = {'files': 0, 'duplicates': 0, 'missing': 0, 'bytes': 0}
+        destination_ids = set()
+
+        for model, field, destination_field in FILE_FIELDS:
+            rows = (
+                model.objects.exclude(**{f'{field}__isnull': True})
+                .exclude(**{field: ''})
+                .exclude(**{f'{field}__startswith': f'{CONTENT_PREFIX}/'})
+                .order_by('pk')
+                .values_list('pk', field, destination_field)
+            )
+            batch = []
+            for row in rows.iterator(chunk_size=batch_size):
+                batch.append(row)
+                if len(batch) == batch_size:
+                    destination_ids |= self.process_batch(model, field, batch)
+                    batch = []
+            if batch:
+                destination_ids |= self.process_batch(model, field, batch)
+
+        # Page and API payloads embed the old URLs
+        if destination_ids and not self.dry_run:
+            Destination.objects.filter(pk__in=destination_ids).touch()
+
+        stats = self.stats
+        verb = 'would be' if self.dry_run else 'were'
+        self.stdout.write(
+            f'Scanned {stats["files"]} files: {stats["duplicates"]} duplicates {verb} removed, '
+            f'{stats["bytes"] / (1024 * 1024):.1f} MB {verb} reclaimed, {stats["missing"]} missing'
+        )
+        self.stdout.write(self.style.SUCCESS('Media deduplication complete'))
+
+    def process_batch(self, model, field, rows):
+        """Move one batch of files to their content names and repoint the rows."""
+        updates = {}
+        destination_ids = set()
+        for pk, name, destination_id in rows:
+            new_name = self.content_name_for(name)
+            if new_name:
+                updates[pk] = new_name
+                destination_ids.add(destination_id)
+        if self.dry_run or not updates:
+            return destination_ids
+
+        with transaction.atomic():
+            objs = [model(pk=pk, **{field: new_name}) for pk, new_name in updates.items()]
+            model.objects.bulk_update(objs, [field])
+
+        # Old names are only removed once no row points at them any more
+        old_names = {name for pk, name, _ in rows if pk in updates}
+        for name in old_names:
+            if not is_referenced(name):
+                self.storage.delete(name)
+        return destination_ids
+
+    def content_name_for(self, name):
+        if name in self.renamed:
+            return self.renamed[name]
+        if not self.storage.exists(name):
+            self.stats['missing'] += 1
+            self.stdout.write(self.style.WARNING(f'Missing file: {name}'))
+            self.renamed[name] = None
+            return None
+
+        self.stats['files'] += 1
+        with self.storage.open(name) as f:
+            new_name = content_name(content_hash(File(f)), name)
+        if new_name in self.seen or self.storage.exists(new_name):
+            self.stats['duplicates'] += 1
+            self.stats['bytes'] += self.storage.size(name)
+        elif not self.dry_run:
+            self.link(name, new_name)
+        self.seen.add(new_name)
+        self.renamed[name] = new_name
+        return new_name
+
+    def link(self, name, new_name):
+        """Give the file its content name without copying it when possible."""
+        if not self.storage.is_local():
+            # Remote backends copy; the old name stays valid until the rows are updated
+            with self.storage.open(name) as f:
+                self.storage.backend.save(new_name, File(f, new_name))
+            return
+        old_path, new_path = self.storage.path(name), self.storage.path(new_name)
+        os.makedirs(os.path.dirname(new_path), exist_ok=True)
+        try:
+            # A hard link keeps the old name valid until the rows are updated
+            os.link(old_path, new_path)
+        except OSError:
+            shutil.copyfile(old_path, new_path)
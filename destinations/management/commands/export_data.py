@@ -1,62 +1,162 @@
+import gzip
 import json
-from django.core.management.base import BaseCommand
-from django.core import serializers
-from destinations.models import Destination, DestinationImage
-from django.conf import settings
 import os
-from datetime import datetime
+import time
+from datetime import datetime, time as datetime_time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from destinations.models import Destination
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+EXTENSIONS = {'json': '.json', 'ndjson': '.ndjson'}
+COMPRESSED_EXTENSIONS = {'gzip': '.gz', 'zstd': '.zst'}
+
+
+def parse_since(value):
+    """Parse --since as an ISO datetime or date (midnight) in the current timezone."""
+    since = parse_datetime(value)
+    if since is None:
+        date = parse_date(value)
+        if date is None:
+            raise CommandError(f'Invalid --since value "{value}", expected YYYY-MM-DD or an ISO datetime')
+        since = datetime.combine(date, datetime_time.min)
+    if timezone.is_naive(since):
+        since = timezone.make_aware(since)
+    return since
+
+
+def open_output(path, compress):
+    """Open ``path`` for writing text, through a compressor when asked."""
+    if compress == 'gzip':
+        return gzip.open(path, 'wt', encoding='utf-8')
+    if compress == 'zstd':
+        if zstandard is None:
+            raise CommandError('--compress zstd requires the "zstandard" package')
+        return zstandard.open(path, 'wt', encoding='utf-8')
+    return open(path, 'w', encoding='utf-8')
+
+
+def destination_records(queryset):
+    """Yield one export record per destination, in the format import_data reads."""
+    for dest in queryset:
+        yield {
+            'model': 'destinations.destination',
+            'pk': dest.pk,
+            'fields': {
+                'place_name': dest.place_name,
+                'slug': dest.slug,
+                'weather': dest.weather,
+                'state': dest.state,
+                'district': dest.district,
+                'google_map_link': dest.google_map_link,
+                'latitude': dest.latitude,
+                'longitude': dest.longitude,
+                'description': dest.description,
+                'created_at': dest.created_at.isoformat(),
+                'updated_at': dest.updated_at.isoformat(),
+                'images': [
+                    {
+                        'image': img.image.url if img.image else None,
+                        'caption': img.caption,
+                        'created_at': img.created_at.isoformat(),
+                    }
+                    for img in dest.images.all()
+                ],
+            },
+        }
+
+
+def encode_ndjson(records):
+    for record in records:
+        yield json.dumps(record, ensure_ascii=False) + '\n'
+
+
+def encode_json(records):
+    """Encode records as one JSON array, one element at a time."""
+    yield '['
+    separator = '\n'
+    for record in records:
+        yield separator + json.dumps(record, indent=2, ensure_ascii=False)
+        separator = ',\n'
+    yield '\n]\n'
+
 
 class Command(BaseCommand):
-    help = 'Export destinations data to JSON file'
+    help = 'Export destinations data to a JSON or NDJSON file, streaming rows in chunks'
 
     def add_arguments(self, parser):
         parser.add_argument(
             '--output',
             type=str,
-            default=f'destinations_export_{datetime.now().strftime("%Y%m%d_%H%M%S")}.json',
-            help='Output file name'
+            help='Output file name, written to the exports directory unless it is an absolute path'
+        )
+        parser.add_argument(
+            '--format',
+            choices=sorted(EXTENSIONS),
+            default='json',
+            help='json writes one array, ndjson one record per line (default: json)'
+        )
+        parser.add_argument(
+            '--compress',
+            choices=sorted(COMPRESSED_EXTENSIONS),
+            help='Compress the output (zstd needs the "zstandard" package)'
+        )
+        parser.add_argument(
+            '--since',
+            type=str,
+            help='Only export destinations updated at or after this date/datetime'
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=500,
+            help='Destinations fetched (with their images) per query (default: 500)'
         )
 
     def handle(self, *args, **options):
-        output_file = options['output']
-        
+        fmt = options['format']
+        compress = options['compress']
+        chunk_size = max(1, options['chunk_size'])
+
+        output_file = options['output'] or (
+            f'destinations_export_{datetime.now().strftime("%Y%m%d_%H%M%S")}{EXTENSIONS[fmt]}'
+        )
+        if compress and not output_file.endswith(COMPRESSED_EXTENSIONS[compress]):
+            output_file += COMPRESSED_EXTENSIONS[compress]
+
         # Create export directory if it doesn't exist
         export_dir = os.path.join(settings.BASE_DIR, 'exports')
         os.makedirs(export_dir, exist_ok=True)
         output_path = os.path.join(export_dir, output_file)
-        
-        # Get all destinations with their images
-        destinations = []
-        for dest in Destination.objects.all():
-            dest_data = {
-                'model': 'destinations.destination',
-                'pk': dest.pk,
-                'fields': {
-                    'place_name': dest.place_name,
-                    'slug': dest.slug,
-                    'weather': dest.weather,
-                    'state': dest.state,
-                    'district': dest.district,
-                    'google_map_link': dest.google_map_link,
-                    'description': dest.description,
-                    'created_at': dest.created_at.isoformat(),
-                    'updated_at': dest.updated_at.isoformat(),
-                    'images': []
-                }
-            }
-            
-            # Add images for this destination
-            for img in dest.images.all():
-                dest_data['fields']['images'].append({
-                    'image': img.image.url if img.image else None,
-                    'caption': img.caption,
-                    'created_at': img.created_at.isoformat()
-                })
-            
-            destinations.append(dest_data)
-        
-        # Write to file
-        with open(output_path, 'w', encoding='utf-8') as f:
-            json.dump(destinations, f, indent=2, ensure_ascii=False)
-        
-        self.stdout.write(self.style.SUCCESS(f'Successfully exported data to {output_path}'))
\ No newline at end of file
+
+        destinations = Destination.objects.order_by('pk').with_images()
+        if options['since']:
+            destinations = destinations.filter(updated_at__gte=parse_since(options['since']))
+
+        # iterator() keeps only one chunk of destinations and their prefetched
+        # images in memory; the encoder and writer consume records as they come.
+        self.count = 0
+        records = self.counted(destination_records(destinations.iterator(chunk_size=chunk_size)))
+        encode = encode_ndjson if fmt == 'ndjson' else encode_json
+
+        start = time.perf_counter()
+        with open_output(output_path, compress) as f:
+            for chunk in encode(records):
+                f.write(chunk)
+        elapsed = time.perf_counter() - start
+
+        rate = self.count / elapsed if elapsed else 0
+        self.stdout.write(f'{self.count} destinations in {elapsed:.1f}s ({rate:.0f} rows/s)')
+        self.stdout.write(self.style.SUCCESS(f'Successfully exported data to {output_path}'))
+
+    def counted(self, records):
+        for record in records:
+            self.count += 1
+            yield record
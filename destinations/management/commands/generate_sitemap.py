@@ -1,65 +1,214 @@
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 from django.urls import reverse
 from django.conf import settings
-from django.contrib.sites.models import Site
-from django.utils import timezone
+from django.db.models import Count, F, Max
+from django.db.models.functions import Floor
 from destinations.models import Destination
+from xml.sax.saxutils import escape
+import gzip
+import json
 import os
-from datetime import datetime
+import time
+
+# URLs per sitemap file allowed by the sitemaps protocol
+MAX_URLS = 50000
+# Dot-prefixed so collectstatic doesn't publish it
+MANIFEST = '.sitemap-manifest.json'
+XMLNS = 'http://www.sitemaps.org/schemas/sitemap/0.9'
+SLUG_PLACEHOLDER = 'sitemap-slug'
+
+
+def url_tag(loc, lastmod=None, changefreq=None, priority=None):
+    """Create a URL entry for the sitemap."""
+    tag = f'  <url>\n    <loc>{escape(loc)}</loc>\n'
+    if lastmod:
+        tag += f'    <lastmod>{lastmod}</lastmod>\n'
+    if changefreq:
+        tag += f'    <changefreq>{changefreq}</changefreq>\n'
+    if priority:
+        tag += f'    <priority>{priority}</priority>\n'
+    return tag + '  </url>\n'
+
+
+def open_output(path, compress):
+    if compress:
+        return gzip.open(path, 'wt', encoding='utf-8')
+    return open(path, 'w', encoding='utf-8')
+
 
 class Command(BaseCommand):
-    help = 'Generate a sitemap.xml file for search engines'
+    help = (
+        'Generate sitemap.xml as an index of sitemap files of at most 50,000 destination URLs, '
+        'rewriting only the files whose destinations changed since the last run'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--base-url',
+            type=str,
+            help='Site address the URLs start with (default: DESTINATION_SITE_URL)'
+        )
+        parser.add_argument(
+            '--output-dir',
+            type=str,
+            default=os.path.join(settings.BASE_DIR, 'static'),
+            help='Directory for sitemap.xml; the sitemap files go in its "sitemaps" subdirectory'
+        )
+        parser.add_argument(
+            '--gzip',
+            action='store_true',
+            help='Compress the destination sitemap files'
+        )
+        parser.add_argument(
+            '--full',
+            action='store_true',
+            help='Rewrite every sitemap file, not just the changed ones'
+        )
+        parser.add_argument(
+            '--shard-size',
+            type=int,
+            default=MAX_URLS,
+            help=f'Range of destination ids per sitemap file (default and maximum: {MAX_URLS})'
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=2000,
+            help='Rows fetched per query while writing (default: 2000)'
+        )
 
     def handle(self, *args, **options):
-        current_site = Site.objects.get_current()
-        base_url = f'https://{current_site.domain}'
-        
-        # Create sitemap content
-        sitemap = ['<?xml version="1.0" encoding="UTF-8"?>']
-        sitemap.append('<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">')
-        
-        # Add static pages
-        static_pages = [
-            ('', '1.0', 'daily'),
-            ('destinations/', '0.8', 'weekly'),
-            ('about/', '0.5', 'monthly'),
-            ('contact/', '0.5', 'monthly'),
-        ]
-        
-        for page, priority, changefreq in static_pages:
-            sitemap.append(self.create_url_tag(
-                f'{base_url}/{page}',
-                timezone.now().strftime('%Y-%m-%d'),
-                changefreq,
-                priority
-            ))
-        
-        # Add destination pages
-        for dest in Destination.objects.all():
-            sitemap.append(self.create_url_tag(
-                f'{base_url}{dest.get_absolute_url()}',
-                dest.updated_at.strftime('%Y-%m-%d'),
-                'weekly',
-                '0.7'
-            ))
-        
-        sitemap.append('</urlset>')
-        
-        # Write to file
-        sitemap_dir = os.path.join(settings.BASE_DIR, 'static')
+        base_url = (options['base_url'] or getattr(settings, 'DESTINATION_SITE_URL', '')).rstrip('/')
+        if not base_url.startswith(('http://', 'https://')):
+            raise CommandError('--base-url (or DESTINATION_SITE_URL) must be an absolute http(s) URL')
+        shard_size = options['shard_size']
+        if not 1 <= shard_size <= MAX_URLS:
+            raise CommandError(f'--shard-size must be between 1 and {MAX_URLS}')
+        self.compress = options['gzip']
+        self.chunk_size = max(1, options['chunk_size'])
+        self.base_url = base_url
+
+        output_dir = options['output_dir']
+        sitemap_dir = os.path.join(output_dir, 'sitemaps')
         os.makedirs(sitemap_dir, exist_ok=True)
-        
-        sitemap_path = os.path.join(sitemap_dir, 'sitemap.xml')
-        with open(sitemap_path, 'w', encoding='utf-8') as f:
-            f.write('\n'.join(sitemap))
-        
-        self.stdout.write(self.style.SUCCESS(f'Sitemap generated at {sitemap_path}'))
-    
-    def create_url_tag(self, loc, lastmod, changefreq, priority):
-        """Create a URL entry for the sitemap."""
-        return f'''  <url>
-    <loc>{loc}</loc>
-    <lastmod>{lastmod}</lastmod>
-    <changefreq>{changefreq}</changefreq>
-    <priority>{priority}</priority>
-</url>'''
\ No newline at end of file
+        manifest_path = os.path.join(sitemap_dir, MANIFEST)
+        manifest = self.read_manifest(manifest_path)
+        config = {'base_url': base_url, 'gzip': self.compress, 'shard_size': shard_size}
+        # Files written under other options can't be reused
+        previous = manifest.get('shards', {}) if manifest.get('config') == config and not options['full'] else {}
+
+        start = time.perf_counter()
+        # Destinations are sharded by id range, so a shard keeps its rows
+        # between runs and its row count and newest updated_at tell whether
+        # anything in it was added, changed or deleted.
+        shards = {}
+        written = urls = 0
+        for key, count, last in self.shard_stats(shard_size):
+            extension = '.xml.gz' if self.compress else '.xml'
+            entry = {'count': count, 'lastmod': last.isoformat(), 'file': f'sitemap-destinations-{key}{extension}'}
+            shards[str(key)] = entry
+            if previous.get(str(key)) == entry:
+                continue
+            urls += self.write_shard(os.path.join(sitemap_dir, entry['file']), key, shard_size)
+            written += 1
+
+        # Drop files of shards that are now empty or were written under other options
+        current_files = {entry['file'] for entry in shards.values()}
+        for entry in manifest.get('shards', {}).values():
+            path = os.path.join(sitemap_dir, entry['file'])
+            if entry['file'] not in current_files and os.path.exists(path):
+                os.remove(path)
+
+        self.write_pages(os.path.join(sitemap_dir, 'sitemap-pages.xml'))
+        index_path = os.path.join(output_dir, 'sitemap.xml')
+        self.write_index(index_path, shards)
+        self.write_atomic(manifest_path, lambda f: json.dump({'config': config, 'shards': shards}, f), False)
+
+        elapsed = time.perf_counter() - start
+        self.stdout.write(
+            f'{written} of {len(shards)} destination sitemaps rewritten ({urls} URLs) in {elapsed:.1f}s'
+        )
+        self.stdout.write(self.style.SUCCESS(f'Sitemap generated at {index_path}'))
+
+    def read_manifest(self, path):
+        try:
+            with open(path, encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def shard_stats(self, shard_size):
+        """(shard, row count, newest updated_at) per non-empty shard, in one aggregate query."""
+        rows = (
+            Destination.objects.order_by()
+            .annotate(shard=Floor((F('pk') - 1) / shard_size))
+            .values('shard')
+            .annotate(count=Count('pk'), last=Max('updated_at'))
+            .order_by('shard')
+        )
+        for row in rows:
+            yield int(row['shard']), row['count'], row['last']
+
+    def write_atomic(self, path, write, compress):
+        """Write through a temporary file, so readers never see a half-written sitemap."""
+        temp_path = f'{path}.tmp'
+        with open_output(temp_path, compress) as f:
+            write(f)
+        os.replace(temp_path, path)
+
+    def write_shard(self, path, shard, shard_size):
+        """Stream the destinations of one id range into a sitemap file; returns the URL count."""
+        rows = (
+            Destination.objects.filter(pk__gt=shard * shard_size, pk__lte=(shard + 1) * shard_size)
+            .order_by('pk')
+            .values_list('slug', 'updated_at')
+        )
+        # Destination.get_absolute_url() with the slug filled in by string
+        # formatting: a reverse() per row would take most of the run.
+        prefix, suffix = Destination(slug=SLUG_PLACEHOLDER).get_absolute_url().split(SLUG_PLACEHOLDER)
+        prefix = self.base_url + prefix
+        count = 0
+
+        def write(f):
+            nonlocal count
+            f.write(f'<?xml version="1.0" encoding="UTF-8"?>\n<urlset xmlns="{XMLNS}">\n')
+            for slug, updated_at in rows.iterator(chunk_size=self.chunk_size):
+                f.write(url_tag(f'{prefix}{slug}{suffix}', updated_at.strftime('%Y-%m-%d'), 'weekly', '0.7'))
+                count += 1
+            f.write('</urlset>\n')
+
+        self.write_atomic(path, write, self.compress)
+        return count
+
+    def write_pages(self, path):
+        pages = [
+            (reverse('home'), 'daily', '1.0'),
+            (reverse('destinations:destination-list'), 'daily', '0.8'),
+        ]
+
+        def write(f):
+            f.write(f'<?xml version="1.0" encoding="UTF-8"?>\n<urlset xmlns="{XMLNS}">\n')
+            for page, changefreq, priority in pages:
+                f.write(url_tag(f'{self.base_url}{page}', changefreq=changefreq, priority=priority))
+            f.write('</urlset>\n')
+
+        self.write_atomic(path, write, False)
+
+    def write_index(self, path, shards):
+        static_url = settings.STATIC_URL
+        if not static_url.startswith(('http://', 'https://')):
+            static_url = self.base_url + static_url
+        location = f'{static_url.rstrip("/")}/sitemaps/'
+
+        def write(f):
+            f.write(f'<?xml version="1.0" encoding="UTF-8"?>\n<sitemapindex xmlns="{XMLNS}">\n')
+            f.write(f'  <sitemap>\n    <loc>{escape(location)}sitemap-pages.xml</loc>\n  </sitemap>\n')
+            for key in sorted(shards, key=int):
+                entry = shards[key]
+                f.write(
+                    f'  <sitemap>\n    <loc>{escape(location + entry["file"])}</loc>\n'
+                    f'    <lastmod>{entry["lastmod"]}</lastmod>\n  </sitemap>\n'
+                )
+            f.write('</sitemapindex>\n')
+
+        self.write_atomic(path, write, False)
@@ -1,25 +1,94 @@
-from django.core.management.base import BaseCommand
-from destinations.models import DestinationImage
-from PIL import Image
-from io import BytesIO
-from django.core.files.base import ContentFile
+import json
 import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from destinations.imaging import (
+    FORMATS, THUMBNAIL_SIZE, derivative_name, read_source, render_derivatives, responsive_specs,
+)
+from destinations.models import Destination, DestinationImage, ImageDerivative, delete_derivatives, delete_files
+from destinations.storage import is_content_name
+
+
+def render_task(task):
+    """Pool entry point: never raises, so one bad file can't stop a chunk."""
+    image_id, source, specs = task
+    try:
+        return image_id, render_derivatives(source, specs), None
+    except Exception as e:
+        return image_id, None, str(e)
+
+
+def parse_size(value):
+    try:
+        width, height = (int(part) for part in value.lower().split('x'))
+    except ValueError:
+        raise CommandError(f'Invalid size "{value}", expected WIDTHxHEIGHT (e.g. 300x200 or 640x0)')
+    return width, height
+
 
 class Command(BaseCommand):
-    help = 'Generate thumbnails for destination images'
+    help = (
+        'Rebuild image thumbnails (or, with --size/--format/--responsive, extra derivatives) '
+        'in bulk with a process pool, resuming from a checkpoint'
+    )
 
     def add_arguments(self, parser):
+        parser.add_argument(
+            '--size',
+            action='append',
+            default=[],
+            metavar='WxH',
+            help='Render a derivative with this bounding box, 0 for an unconstrained side (repeatable)'
+        )
         parser.add_argument(
             '--width',
             type=int,
-            default=300,
-            help='Thumbnail width (default: 300)'
+            help='Deprecated: derivative width, same as --size WIDTHx200'
         )
         parser.add_argument(
             '--height',
             type=int,
-            default=200,
-            help='Thumbnail height (default: 200)'
+            help='Deprecated: derivative height, same as --size 300xHEIGHT'
+        )
+        parser.add_argument(
+            '--format',
+            action='append',
+            default=[],
+            choices=sorted(FORMATS),
+            help='Derivative format (repeatable, default: jpeg)'
+        )
+        parser.add_argument(
+            '--responsive',
+            action='store_true',
+            help='Also render the srcset widths in every responsive format (WebP, plus AVIF when available)'
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=os.cpu_count() or 1,
+            help='Worker processes (default: number of CPUs)'
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=500,
+            help='Images fetched, rendered and saved per chunk (default: 500)'
+        )
+        parser.add_argument(
+            '--checkpoint',
+            type=str,
+            default=os.path.join(settings.BASE_DIR, '.generate_thumbnails.json'),
+            help='File recording progress so an interrupted run can resume'
+        )
+        parser.add_argument(
+            '--restart',
+            action='store_true',
+            help='Ignore any existing checkpoint and start from the first image'
         )
         parser.add_argument(
             '--force',
@@ -28,71 +97,246 @@ class Command(BaseCommand):
         )
 
     def handle(self, *args, **options):
-        width = options['width']
-        height = options['height']
-        force = options['force']
+        sizes = [parse_size(size) for size in options['size']]
+        if options['width'] is not None or options['height'] is not None:
+            self.stdout.write(self.style.WARNING('--width and --height are deprecated, use --size WIDTHxHEIGHT'))
+            sizes.append((
+                300 if options['width'] is None else options['width'],
+                200 if options['height'] is None else options['height'],
+            ))
+        # Without any derivative options, rebuild the thumbnails that pages
+        # show, as the process_image_jobs worker does.
+        self.thumbnails = not (sizes or options['format'] or options['responsive'])
+        if self.thumbnails:
+            specs = [(*THUMBNAIL_SIZE, 'jpeg')] + responsive_specs()
+        else:
+            if not sizes and not options['responsive']:
+                sizes = [(300, 200)]
+            formats = options['format'] or ['jpeg']
+            specs = [(width, height, fmt) for width, height in sizes for fmt in formats]
+            if options['responsive']:
+                specs += [spec for spec in responsive_specs() if spec not in specs]
+        chunk_size = max(1, options['chunk_size'])
+        checkpoint_path = options['checkpoint']
+        self.force = options['force']
 
-        for img in DestinationImage.objects.all():
-            if not img.image:
-                continue
+        last_id = 0 if options['restart'] else self.read_checkpoint(checkpoint_path, specs)
+        if last_id:
+            self.stdout.write(f'Resuming after image {last_id}')
+
+        images = (
+            DestinationImage.objects.filter(pk__gt=last_id)
+            .exclude(image='')
+            .order_by('pk')
+            .only('id', 'image', 'thumbnail', 'thumbnail_status', 'destination_id')
+        )
+        if self.thumbnails and not self.force:
+            images = images.exclude(thumbnail_status=DestinationImage.THUMBNAIL_READY)
+        process_chunk = self.rebuild_thumbnails if self.thumbnails else self.process_chunk
+
+        # created, skipped, errors
+        totals = [0, 0, 0]
+        # The checkpoint never moves past a failed image, so a resumed run retries it
+        first_failed = None
+        start = time.perf_counter()
+        chunk = []
+
+        with ProcessPoolExecutor(max_workers=max(1, options['workers'])) as pool:
+            for image in images.iterator(chunk_size=chunk_size):
+                chunk.append(image)
+                if len(chunk) < chunk_size:
+                    continue
+                *counts, failed = process_chunk(pool, chunk, specs)
+                for i, count in enumerate(counts):
+                    totals[i] += count
+                if failed and first_failed is None:
+                    first_failed = min(failed)
+                last_id = chunk[-1].pk if first_failed is None else first_failed - 1
+                self.write_checkpoint(checkpoint_path, specs, last_id)
+                self.report(*totals, start)
+                chunk = []
+
+            if chunk:
+                *counts, failed = process_chunk(pool, chunk, specs)
+                for i, count in enumerate(counts):
+                    totals[i] += count
 
-            # Skip if thumbnail already exists and not forcing
-            thumbnail_field = f'thumbnail_{width}x{height}'
-            if hasattr(img, thumbnail_field) and getattr(img, thumbnail_field) and not force:
-                self.stdout.write(f'Skipping {img} - thumbnail exists')
+        # A finished run doesn't need to resume
+        if os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+
+        self.report(*totals, start)
+        self.stdout.write(self.style.SUCCESS('Thumbnail generation complete'))
+
+    def rebuild_thumbnails(self, pool, chunk, specs):
+        """
+        Render the thumbnail and srcset renditions of one chunk, store them
+        through the model like the image worker does, and set each image's
+        thumbnail_status.
+        """
+        tasks = []
+        # Images sharing a content-addressed source are rendered once and the
+        # others copy its renditions
+        duplicates = {}
+        failed = []
+        for image in chunk:
+            if is_content_name(image.image.name) and image.image.name in duplicates:
+                duplicates[image.image.name].append(image)
+                continue
+            try:
+                tasks.append((image.pk, read_source(image.image), specs))
+            except Exception as e:
+                failed.append(image.pk)
+                self.stdout.write(self.style.ERROR(f'Error processing image {image.pk}: {e}'))
                 continue
+            duplicates[image.image.name] = []
 
+        images = {image.pk: image for image in chunk}
+        created = 0
+        for image_id, results, error in pool.map(render_task, tasks, chunksize=8):
+            image = images[image_id]
+            copies = duplicates[image.image.name]
             try:
-                # Open the original image
-                image = Image.open(img.image.path)
-                
-                # Convert to RGB if necessary
-                if image.mode not in ('L', 'RGB'):
-                    image = image.convert('RGB')
-
-                # Create thumbnail
-                image.thumbnail((width, height), Image.Resampling.LANCZOS)
-
-                # Save the thumbnail
-                thumb_name, thumb_extension = os.path.splitext(img.image.name)
-                thumb_extension = thumb_extension.lower()
-                thumb_filename = f'{thumb_name}_thumb{thumb_extension}'
-
-                if thumb_extension in ['.jpg', '.jpeg']:
-                    format = 'JPEG'
-                elif thumb_extension == '.gif':
-                    format = 'GIF'
-                elif thumb_extension == '.png':
-                    format = 'PNG'
-                else:
-                    format = 'JPEG'
+                if error:
+                    raise ValueError(error)
+                thumbnail, *derivatives = results
+                image.store_derivatives(derivatives)
+                image.store_thumbnail(thumbnail[1])
+                for copy in copies:
+                    copy.reuse_derivatives()
+            except Exception as e:
+                failed += [image.pk] + [copy.pk for copy in copies]
+                self.stdout.write(self.style.ERROR(f'Error processing image {image_id}: {e}'))
+                continue
+            created += 1 + len(copies)
 
-                # Save to memory
-                temp_thumb = BytesIO()
-                image.save(temp_thumb, format)
-                temp_thumb.seek(0)
+        if failed:
+            DestinationImage.objects.filter(pk__in=failed).update(thumbnail_status=DestinationImage.THUMBNAIL_FAILED)
+        # Thumbnails are written with update(), so refresh validators and
+        # cached pages for the affected destinations in one go.
+        Destination.objects.filter(pk__in={image.destination_id for image in chunk}).touch()
+        return created, 0, len(failed), failed
 
-                # Save to model
-                if not hasattr(img, thumbnail_field):
-                    self.stdout.write(self.style.ERROR(f'Thumbnail field {thumbnail_field} does not exist on the model'))
-                    continue
+    def process_chunk(self, pool, chunk, specs):
+        """Render the missing derivatives of one chunk and save them in bulk."""
+        existing = {}
+        for derivative in ImageDerivative.objects.filter(image__in=chunk).only(
+            'id', 'image_id', 'max_width', 'max_height', 'format', 'file'
+        ):
+            existing[(derivative.image_id, derivative.max_width, derivative.max_height, derivative.format)] = derivative
+
+        if self.force and existing:
+            delete_files(delete_derivatives(ImageDerivative.objects.filter(pk__in=[d.pk for d in existing.values()])))
+            existing = {}
 
-                # Delete old thumbnail if it exists
-                old_thumb = getattr(img, thumbnail_field)
-                if old_thumb:
-                    old_thumb.delete(save=False)
+        donors = self.find_donors(chunk, specs)
+        tasks = []
+        # Images sharing a content-addressed source are rendered once
+        duplicates = {}
+        derivatives = []
+        skipped = 0
+        for image in chunk:
+            missing = []
+            for spec in specs:
+                if (image.pk, *spec) in existing:
+                    skipped += 1
+                elif (image.image.name, *spec) in donors:
+                    file, width, height = donors[(image.image.name, *spec)]
+                    derivatives.append(ImageDerivative(
+                        image=image, max_width=spec[0], max_height=spec[1], format=spec[2],
+                        file=file, width=width, height=height,
+                    ))
+                else:
+                    missing.append(spec)
+            if not missing:
+                continue
+            key = (image.image.name, tuple(missing))
+            if is_content_name(image.image.name) and key in duplicates:
+                duplicates[key].append(image)
+                continue
+            duplicates[key] = []
+            tasks.append((image.pk, read_source(image.image), missing))
 
-                # Save new thumbnail
-                getattr(img, thumbnail_field).save(
-                    os.path.basename(thumb_filename),
-                    ContentFile(temp_thumb.read()),
-                    save=False
+        images = {image.pk: image for image in chunk}
+        failed = []
+        for (image_id, _, missing), (_, results, error) in zip(tasks, pool.map(render_task, tasks, chunksize=8)):
+            image = images[image_id]
+            copies = duplicates[(image.image.name, tuple(missing))]
+            if error:
+                failed += [image_id] + [copy.pk for copy in copies]
+                self.stdout.write(self.style.ERROR(f'Error processing image {image_id}: {error}'))
+                continue
+            for (max_width, max_height, fmt), data, width, height in results:
+                name = derivative_name(image.image.name, image_id, max_width, max_height, fmt)
+                derivative = ImageDerivative(
+                    image=image, max_width=max_width, max_height=max_height,
+                    format=fmt, width=width, height=height,
                 )
-                img.save()
+                storage = derivative.file.storage
+                # Overwrite leftovers of an interrupted run instead of piling
+                # up renamed copies. derivative_name() is always a per-image
+                # path, never a shared content-addressed one, so this is safe.
+                if storage.exists(name):
+                    storage.delete(name)
+                derivative.file.name = storage.save(name, ContentFile(data))
+                derivatives.append(derivative)
+                for copy in copies:
+                    derivatives.append(ImageDerivative(
+                        image=copy, max_width=max_width, max_height=max_height,
+                        format=fmt, file=derivative.file.name, width=width, height=height,
+                    ))
 
-                self.stdout.write(self.style.SUCCESS(f'Created thumbnail for {img}'))
+        with transaction.atomic():
+            ImageDerivative.objects.bulk_create(derivatives)
+            if derivatives:
+                Destination.objects.filter(pk__in={image.destination_id for image in chunk}).touch()
+        return len(derivatives), skipped, len(failed), failed
 
-            except Exception as e:
-                self.stdout.write(self.style.ERROR(f'Error processing {img}: {str(e)}'))
+    def find_donors(self, chunk, specs):
+        """
+        Existing derivatives of other images with the same content-addressed
+        source, keyed by (source name, max_width, max_height, format).
+        """
+        names = {image.image.name for image in chunk if is_content_name(image.image.name)}
+        if not names:
+            return {}
+        donors = {}
+        rows = (
+            ImageDerivative.objects.filter(image__image__in=names)
+            .exclude(image__in=chunk)
+            .values_list('image__image', 'max_width', 'max_height', 'format', 'file', 'width', 'height')
+        )
+        for name, max_width, max_height, fmt, file, width, height in rows:
+            if (max_width, max_height, fmt) in specs:
+                donors[(name, max_width, max_height, fmt)] = (file, width, height)
+        return donors
 
-        self.stdout.write(self.style.SUCCESS('Thumbnail generation complete'))
\ No newline at end of file
+    def read_checkpoint(self, path, specs):
+        if not os.path.exists(path):
+            return 0
+        with open(path, encoding='utf-8') as f:
+            checkpoint = json.load(f)
+        if (
+            checkpoint.get('specs') != [list(spec) for spec in specs]
+            or checkpoint.get('thumbnails', False) != self.thumbnails
+        ):
+            self.stdout.write(self.style.WARNING('Checkpoint is for different sizes/formats, starting over'))
+            return 0
+        return checkpoint['last_id']
+
+    def write_checkpoint(self, path, specs, last_id):
+        # Written to a temporary file and renamed, so a crash never leaves a
+        # truncated checkpoint behind.
+        temp_path = f'{path}.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump({'specs': [list(spec) for spec in specs], 'thumbnails': self.thumbnails, 'last_id': last_id}, f)
+        os.replace(temp_path, path)
+
+    def report(self, created, skipped, errors, start):
+        elapsed = time.perf_counter() - start
+        rate = created / elapsed if elapsed else 0
+        unit = 'thumbnails' if self.thumbnails else 'derivatives'
+        self.stdout.write(
+            f'{created} created, {skipped} skipped, {errors} errors '
+            f'({rate:.1f} {unit}/s)'
+        )
@@ -1,84 +1,417 @@
+import gzip
 import json
 import os
-from django.core.management.base import BaseCommand
-from django.core.files.base import ContentFile
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote, urljoin, urlparse
+
 from django.conf import settings
-from destinations.models import Destination, DestinationImage
-import requests
-from urllib.parse import urlparse
 from django.core.files import File
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Exists, OuterRef, Q
+from destinations import cache, facets, geo
+from destinations.models import Destination, DestinationImage, ImageJob
+from destinations.slugs import assign_slugs
+import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Fields copied from each record; everything else is managed by the database.
+IMPORT_FIELDS = ('place_name', 'slug', 'weather', 'state', 'district', 'google_map_link', 'description')
+
+READ_SIZE = 1 << 16
+
+
+def open_input(path):
+    """Open an export file for reading text, decompressing .gz/.zst files."""
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8')
+    if path.endswith('.zst'):
+        if zstandard is None:
+            raise CommandError('Reading .zst files requires the "zstandard" package')
+        return zstandard.open(path, 'rt', encoding='utf-8')
+    return open(path, 'r', encoding='utf-8')
+
+
+def iter_records(f):
+    """
+    Yield records from a JSON array or an NDJSON file without loading the
+    whole file, telling the two apart by the first non-blank character.
+    """
+    first = f.read(1)
+    while first and first.isspace():
+        first = f.read(1)
+    if not first:
+        return
+    if first == '[':
+        yield from iter_json_array(f)
+        return
+    yield json.loads(first + f.readline())
+    for line in f:
+        if line.strip():
+            yield json.loads(line)
+
+
+def iter_json_array(f):
+    """Decode the elements of a JSON array one at a time (the '[' is already consumed)."""
+    decoder = json.JSONDecoder()
+    buffer = ''
+    eof = False
+    while True:
+        buffer = buffer.lstrip()
+        if buffer.startswith(','):
+            buffer = buffer[1:]
+            continue
+        if buffer.startswith(']'):
+            return
+        if buffer:
+            try:
+                record, end = decoder.raw_decode(buffer)
+            except json.JSONDecodeError:
+                # Most likely a record split across reads; fetch more first
+                if eof:
+                    raise
+            else:
+                yield record
+                buffer = buffer[end:]
+                continue
+        if eof:
+            raise json.JSONDecodeError('Unterminated array', buffer, len(buffer))
+        data = f.read(READ_SIZE)
+        eof = not data
+        buffer += data
+
+
+def batched(items, size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class ImageFetcher:
+    """
+    Copies image sources into storage from worker threads. Each thread keeps
+    its own pooled requests.Session; downloads are streamed to a temporary
+    file and handed to storage in chunks, never held in memory whole.
+    """
+
+    def __init__(self, workers, timeout, image_root=None, base_url=None):
+        self.timeout = timeout
+        self.image_root = image_root
+        self.base_url = base_url
+        self.workers = workers
+        self.local = threading.local()
+
+    def session(self):
+        session = getattr(self.local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=self.workers, pool_maxsize=self.workers, max_retries=2)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            self.local.session = session
+        return session
+
+    def local_path(self, url):
+        """Filesystem path for file:// URLs and, with --image-root, relative paths."""
+        parsed = urlparse(url)
+        if parsed.scheme == 'file':
+            return unquote(parsed.path)
+        if not parsed.scheme and self.image_root:
+            path = unquote(parsed.path)
+            if path.startswith(settings.MEDIA_URL):
+                path = path[len(settings.MEDIA_URL):]
+            return os.path.join(self.image_root, path.lstrip('/'))
+        return None
+
+    def store(self, field, name, url):
+        """Copy ``url`` into ``field``'s storage under ``name`` and return the stored name."""
+        filename = os.path.basename(name)
+        path = self.local_path(url)
+        if path is not None:
+            with open(path, 'rb') as f:
+                return field.storage.save(name, File(f, name=filename))
+
+        if self.base_url and not urlparse(url).scheme:
+            url = urljoin(self.base_url, url)
+        with self.session().get(url, stream=True, timeout=self.timeout) as response:
+            response.raise_for_status()
+            with tempfile.TemporaryFile() as temp:
+                for chunk in response.iter_content(READ_SIZE):
+                    temp.write(chunk)
+                temp.seek(0)
+                return field.storage.save(name, File(temp, name=filename))
+
 
 class Command(BaseCommand):
-    help = 'Import destinations data from JSON file'
+    help = 'Import destinations data from a JSON or NDJSON file using batched bulk upserts'
 
     def add_arguments(self, parser):
-        parser.add_argument('file', type=str, help='Path to the JSON file to import')
+        parser.add_argument('file', type=str, help='Path to the JSON/NDJSON file to import (.gz/.zst accepted)')
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Destinations upserted per transaction (default: 500)'
+        )
+        parser.add_argument(
+            '--image-workers',
+            type=int,
+            default=8,
+            help='Concurrent image downloads (default: 8)'
+        )
+        parser.add_argument(
+            '--timeout',
+            type=float,
+            default=10.0,
+            help='Seconds before an image download is abandoned (default: 10)'
+        )
+        parser.add_argument(
+            '--image-root',
+            type=str,
+            help='Local directory that relative image paths (e.g. /media/...) are read from'
+        )
+        parser.add_argument(
+            '--base-url',
+            type=str,
+            help='Site URL that relative image paths are downloaded from'
+        )
+        parser.add_argument(
+            '--skip-images',
+            action='store_true',
+            help='Import destination rows only'
+        )
 
     def handle(self, *args, **options):
         file_path = options['file']
-        
+
         if not os.path.exists(file_path):
             self.stdout.write(self.style.ERROR(f'File not found: {file_path}'))
             return
 
+        self.fetcher = ImageFetcher(
+            max(1, options['image_workers']), options['timeout'],
+            image_root=options['image_root'], base_url=options['base_url'],
+        )
+        self.skip_images = options['skip_images']
+        # created, updated, images, errors
+        self.totals = [0, 0, 0, 0]
+        start = time.perf_counter()
+
+        try:
+            with open_input(file_path) as f, ThreadPoolExecutor(max_workers=self.fetcher.workers) as pool:
+                records = (
+                    item for item in iter_records(f)
+                    if item.get('model') == 'destinations.destination'
+                )
+                for batch in batched(records, max(1, options['batch_size'])):
+                    self.import_batch(pool, batch)
+                    self.report(start)
+        except json.JSONDecodeError as e:
+            self.stdout.write(self.style.ERROR(f'Invalid JSON file: {e}'))
+            return
+
+        self.reset_sequences()
+        self.report(start)
+        self.stdout.write(self.style.SUCCESS('Import completed'))
+
+    def import_batch(self, pool, batch):
+        rows = []
+        for item in batch:
+            fields = item['fields']
+            row = Destination(pk=item.get('pk'), **{name: fields.get(name) or '' for name in IMPORT_FIELDS})
+            row.google_map_link = fields.get('google_map_link') or None
+            row.latitude, row.longitude = fields.get('latitude'), fields.get('longitude')
+            if row.latitude is None or row.longitude is None:
+                row.latitude, row.longitude = geo.parse_map_link(row.google_map_link) or (None, None)
+            rows.append((row, fields.get('images') or []))
+        self.match_natural_keys([row for row, _ in rows if row.pk is None and not row.slug])
+        # One query for the whole batch; explicit slugs in the feed are
+        # upsert keys, so generated ones must not take them.
+        assign_slugs([row for row, _ in rows], reserved={row.slug for row, _ in rows if row.slug})
+
+        # Current slugs, to resolve slug-keyed rows to their pk, tell creates
+        # from updates and drop cached pages of destinations whose slug changes.
+        pks = [row.pk for row, _ in rows if row.pk is not None]
+        slugs = [row.slug for row, _ in rows]
+        before = dict(Destination.objects.filter(Q(pk__in=pks) | Q(slug__in=slugs)).values_list('pk', 'slug'))
+        rows = self.resolve_keys(rows, {slug: pk for pk, slug in before.items()})
+
+        try:
+            with transaction.atomic():
+                self.upsert([row for row, _ in rows])
+        except IntegrityError as e:
+            # A slug clash somewhere in the batch: fall back to row-by-row so
+            # only the offending records are lost.
+            self.stdout.write(self.style.WARNING(f'Batch conflict ({e}), retrying row by row'))
+            rows = [(row, images) for row, images in rows if self.upsert_one(row)]
+
+        for row, _ in rows:
+            self.totals[0 if row.pk is None or row.pk not in before else 1] += 1
+        cache.invalidate_destination(*before.values(), *slugs)
+        # Upserts don't say what each row held before, so recount
+        facets.invalidate()
+
+        if not self.skip_images:
+            self.import_images(pool, rows)
+
+    def match_natural_keys(self, rows):
+        """
+        Give records with neither a pk nor a slug the pk and slug of the
+        destination with the same name, state and district, so importing a
+        feed again updates them instead of adding copies.
+        """
+        if not rows:
+            return
+        existing = {}
+        matches = (
+            Destination.objects.filter(place_name__in={row.place_name for row in rows})
+            .order_by('pk')
+            .values_list('place_name', 'state', 'district', 'pk', 'slug')
+        )
+        for name, state, district, pk, slug in matches:
+            existing.setdefault((name, state, district), (pk, slug))
+        for row in rows:
+            row.pk, row.slug = existing.get((row.place_name, row.state, row.district), (None, ''))
+
+    def resolve_keys(self, rows, slug_pks):
+        """
+        Point slug-keyed records at the pk of the destination holding that
+        slug, and drop records whose slug belongs to another destination or
+        repeats earlier in the batch, so every upsert conflicts on the pk alone.
+        """
+        resolved = []
+        seen = set()
+        for row, images in rows:
+            owner = slug_pks.get(row.slug)
+            if row.pk is None:
+                row.pk = owner
+            if (owner is not None and owner != row.pk) or row.slug in seen or (row.pk is not None and row.pk in seen):
+                self.totals[3] += 1
+                self.stdout.write(self.style.ERROR(
+                    f'Error processing destination {row.pk or row.slug}: slug "{row.slug}" is already in use'
+                ))
+                continue
+            seen.update({row.slug, row.pk} - {None})
+            resolved.append((row, images))
+        return resolved
+
+    def upsert(self, rows):
+        update_fields = IMPORT_FIELDS + ('latitude', 'longitude', 'updated_at')
+        existing = [row for row in rows if row.pk is not None]
+        new = [row for row in rows if row.pk is None]
+        if existing:
+            # Slug clashes were dropped by resolve_keys(), so databases that
+            # can't name the conflict target (MySQL) can only hit the pk.
+            target = connection.features.supports_update_conflicts_with_target
+            Destination.objects.bulk_create(
+                existing, update_conflicts=True, update_fields=update_fields,
+                unique_fields=['id'] if target else None,
+            )
+        if new:
+            Destination.objects.bulk_create(new)
+
+    def upsert_one(self, row):
         try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-        except json.JSONDecodeError:
-            self.stdout.write(self.style.ERROR('Invalid JSON file'))
+            with transaction.atomic():
+                self.upsert([row])
+        except IntegrityError as e:
+            self.totals[3] += 1
+            self.stdout.write(self.style.ERROR(f'Error processing destination {row.pk or row.slug}: {e}'))
+            return False
+        return True
+
+    def import_images(self, pool, rows):
+        """
+        Fetch images for destinations that don't have any yet (so re-running
+        a feed doesn't duplicate them) and save the rows in bulk.
+        """
+        has_images = DestinationImage.objects.filter(destination=OuterRef('pk'))
+        destinations = {
+            slug: (pk, populated)
+            for slug, pk, populated in Destination.objects.filter(
+                slug__in=[row.slug for row, _ in rows]
+            ).annotate(populated=Exists(has_images)).values_list('slug', 'pk', 'populated')
+        }
+
+        field = DestinationImage._meta.get_field('image')
+        futures = []
+        for row, images in rows:
+            row.pk, populated = destinations.get(row.slug, (None, True))
+            if populated:
+                continue
+            for img_data in images:
+                url = img_data.get('image')
+                if url:
+                    image = DestinationImage(destination=row, caption=img_data.get('caption') or '')
+                    # Named here: upload_to reads the destination, and worker
+                    # threads must not touch the database.
+                    name = field.generate_filename(image, os.path.basename(unquote(urlparse(url).path)))
+                    futures.append((image, url, pool.submit(self.fetcher.store, field, name, url)))
+
+        images = []
+        for image, url, future in futures:
+            try:
+                image.image.name = future.result()
+            except Exception as e:
+                self.totals[3] += 1
+                self.stdout.write(self.style.ERROR(f'  - Error processing image {url}: {e}'))
+                continue
+            images.append(image)
+        if not images:
             return
 
-        for item in data:
-            if item['model'] == 'destinations.destination':
-                try:
-                    # Create or update destination
-                    dest, created = Destination.objects.update_or_create(
-                        pk=item['pk'],
-                        defaults={
-                            'place_name': item['fields']['place_name'],
-                            'slug': item['fields']['slug'],
-                            'weather': item['fields']['weather'],
-                            'state': item['fields']['state'],
-                            'district': item['fields']['district'],
-                            'google_map_link': item['fields']['google_map_link'],
-                            'description': item['fields']['description'],
-                        }
-                    )
-
-                    if created:
-                        self.stdout.write(self.style.SUCCESS(f'Created destination: {dest.place_name}'))
-                    else:
-                        self.stdout.write(f'Updated destination: {dest.place_name}')
-
-                    # Handle images
-                    for img_data in item['fields'].get('images', []):
-                        if img_data['image']:
-                            try:
-                                # Download the image
-                                response = requests.get(img_data['image'], stream=True)
-                                if response.status_code == 200:
-                                    # Get the filename from the URL
-                                    filename = os.path.basename(urlparse(img_data['image']).path)
-                                    
-                                    # Create the destination image
-                                    dest_img = DestinationImage(
-                                        destination=dest,
-                                        caption=img_data.get('caption', '')
-                                    )
-                                    
-                                    # Save the image
-                                    dest_img.image.save(
-                                        filename,
-                                        ContentFile(response.content),
-                                        save=True
-                                    )
-                                    self.stdout.write(f'  - Added image: {filename}')
-                                else:
-                                    self.stdout.write(self.style.WARNING(f'  - Failed to download image: {img_data["image"]}'))
-                            except Exception as e:
-                                self.stdout.write(self.style.ERROR(f'  - Error processing image {img_data["image"]}: {str(e)}'))
-
-                except Exception as e:
-                    self.stdout.write(self.style.ERROR(f'Error processing destination {item.get("pk")}: {str(e)}'))
-
-        self.stdout.write(self.style.SUCCESS('Import completed'))
\ No newline at end of file
+        with transaction.atomic():
+            DestinationImage.objects.bulk_create(images)
+            if not connection.features.can_return_rows_from_bulk_insert:
+                self.fetch_image_pks(images)
+            ImageJob.objects.bulk_create([ImageJob(image=image) for image in images])
+            Destination.objects.filter(pk__in={image.destination_id for image in images}).touch()
+        self.totals[2] += len(images)
+
+    def fetch_image_pks(self, images):
+        """
+        Set the pks of just-inserted images on databases whose bulk inserts
+        don't return them (MySQL). Their destinations had no images before,
+        so the rows in insertion order are exactly these.
+        """
+        inserted = {}
+        for destination_id, pk in (
+            DestinationImage.objects.filter(destination_id__in={image.destination_id for image in images})
+            .order_by('pk')
+            .values_list('destination_id', 'pk')
+        ):
+            inserted.setdefault(destination_id, []).append(pk)
+        for image in images:
+            image.pk = inserted[image.destination_id].pop(0)
+
+    def reset_sequences(self):
+        # Rows were inserted with explicit ids; move PostgreSQL/Oracle
+        # sequences past them so the next normal insert doesn't collide.
+        statements = connection.ops.sequence_reset_sql(no_style(), [Destination])
+        if statements:
+            with connection.cursor() as cursor:
+                for sql in statements:
+                    cursor.execute(sql)
+
+    def report(self, start):
+        created, updated, images, errors = self.totals
+        elapsed = time.perf_counter() - start
+        rate = (created + updated) / elapsed if elapsed else 0
+        self.stdout.write(
+            f'{created} created, {updated} updated, {images} images, {errors} errors '
+            f'({rate:.0f} destinations/s)'
+        )
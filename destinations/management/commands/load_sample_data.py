@@ -1,12 +1,54 @@
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 from destinations.models import Destination, DestinationImage
+from destinations import synthetic
 import os
+import time
 from django.core.files import File
 
 class Command(BaseCommand):
-    help = 'Load sample data for the application'
+    help = 'Load sample data for the application, or --count synthetic destinations for load testing'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--count',
+            type=int,
+            help='Generate this many synthetic destinations with bulk_create instead of the three samples'
+        )
+        parser.add_argument(
+            '--images',
+            type=int,
+            default=0,
+            help='Generated images per synthetic destination (default: 0)'
+        )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            default=42,
+            help='Random seed; the same seed generates the same rows (default: 42)'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=5000,
+            help='Destinations inserted per transaction (default: 5000)'
+        )
+        parser.add_argument(
+            '--image-size',
+            type=str,
+            default='320x240',
+            help='Generated image size as WIDTHxHEIGHT (default: 320x240)'
+        )
+        parser.add_argument(
+            '--image-format',
+            choices=['jpeg', 'png'],
+            default='jpeg',
+            help='Generated image format (default: jpeg)'
+        )
 
     def handle(self, *args, **options):
+        if options['count'] is not None:
+            return self.load_synthetic(options)
+
         self.stdout.write('Loading sample data...')
         
         # Create sample destinations
@@ -45,4 +87,31 @@ class Command(BaseCommand):
             if created:
                 self.stdout.write(f'Created destination: {destination.place_name}')
 
-        self.stdout.write(self.style.SUCCESS('Successfully loaded sample data'))
\ No newline at end of file
+        self.stdout.write(self.style.SUCCESS('Successfully loaded sample data'))
+
+    def load_synthetic(self, options):
+        try:
+            width, height = (int(part) for part in options['image_size'].lower().split('x'))
+        except ValueError:
+            raise CommandError(f'Invalid image size "{options["image_size"]}", expected WIDTHxHEIGHT')
+        count = max(0, options['count'])
+        start = time.perf_counter()
+
+        def progress(created):
+            elapsed = time.perf_counter() - start
+            rate = created / elapsed if elapsed else 0
+            self.stdout.write(f'{created}/{count} destinations ({rate:.0f} rows/s)')
+
+        created = synthetic.create_destinations(
+            count,
+            images=max(0, options['images']),
+            seed=options['seed'],
+            batch_size=max(1, options['batch_size']),
+            image_size=(width, height),
+            image_format=options['image_format'].upper(),
+            progress=progress,
+        )
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            f'Created {created} synthetic destinations in {elapsed:.1f}s'
+        ))
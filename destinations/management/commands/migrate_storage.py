@@ -1,24 +1,92 @@
-from django.core.management.base import BaseCommand
-from django.core.files.storage import default_storage, get_storage_class
-from django.conf import settings
-from destinations.models import DestinationImage
+import hashlib
+import json
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import InvalidStorageError, storages
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Case, F, Value, When
+from destinations.models import Destination, DestinationImage, ImageDerivative
+
+# (model, file field, how to reach the destination id from a row)
+FILE_FIELDS = (
+    (DestinationImage, 'image', 'destination_id'),
+    (DestinationImage, 'thumbnail', 'destination_id'),
+    (ImageDerivative, 'file', 'image__destination_id'),
+)
+
+CHUNK_SIZE = 1 << 20
+
+MISSING = 'missing from source storage'
+
+
+class HashingFile(File):
+    """A File whose chunks() feed a running SHA-256 as the storage reads them."""
+
+    def __init__(self, file, name):
+        super().__init__(file, name)
+        self.digest = hashlib.sha256()
+        self.bytes_read = 0
+
+    def chunks(self, chunk_size=None):
+        for chunk in super().chunks(chunk_size or CHUNK_SIZE):
+            self.digest.update(chunk)
+            self.bytes_read += len(chunk)
+            yield chunk
+
+
+def file_checksum(storage, name):
+    digest = hashlib.sha256()
+    with storage.open(name, 'rb') as f:
+        for chunk in File(f).chunks(CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
 
 class Command(BaseCommand):
-    help = 'Migrate files between different storage backends'
+    help = 'Copy media between storage backends in parallel, verifying checksums and resuming from a manifest'
 
     def add_arguments(self, parser):
         parser.add_argument(
             '--source',
             type=str,
-            help='Source storage (default: current storage)',
+            help='Source storage alias from settings.STORAGES (default: default)',
             default='default'
         )
         parser.add_argument(
             '--destination',
             type=str,
-            help='Destination storage (default: current storage)',
-            default='default'
+            required=True,
+            help='Destination storage alias from settings.STORAGES'
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=8,
+            help='Files copied in parallel (default: 8)'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Files read from the database and queued per batch (default: 1000)'
+        )
+        parser.add_argument(
+            '--manifest',
+            type=str,
+            help=(
+                'JSONL file recording verified copies, so an interrupted run can resume '
+                '(default: .migrate_storage-<source>-<destination>.jsonl in the project directory)'
+            )
+        )
+        parser.add_argument(
+            '--restart',
+            action='store_true',
+            help='Ignore the manifest and check every file again'
         )
         parser.add_argument(
             '--dry-run',
@@ -27,83 +95,192 @@ class Command(BaseCommand):
         )
 
     def handle(self, *args, **options):
-        source_storage = self.get_storage(options['source'])
-        dest_storage = self.get_storage(options['destination'])
-        dry_run = options['dry_run']
+        if options['source'] == options['destination']:
+            raise CommandError('Source and destination storage must differ')
+        self.source = self.get_storage(options['source'])
+        self.target = self.get_storage(options['destination'])
+        self.dry_run = options['dry_run']
+        self.aliases = {'source': options['source'], 'destination': options['destination']}
+        batch_size = self.batch_size = max(1, options['batch_size'])
+        manifest_path = options['manifest'] or os.path.join(
+            settings.BASE_DIR, f'.migrate_storage-{options["source"]}-{options["destination"]}.jsonl'
+        )
 
-        if dry_run:
+        if self.dry_run:
             self.stdout.write(self.style.WARNING('Running in dry-run mode. No changes will be made.'))
 
-        # Get all image fields from the model
-        image_fields = [field for field in DestinationImage._meta.fields 
-                      if field.get_internal_type() == 'FileField' or 
-                         field.get_internal_type() == 'ImageField']
-
-        migrated = 0
-        skipped = 0
-        errors = 0
-
-        for img in DestinationImage.objects.all():
-            try:
-                changed = False
-                
-                for field in image_fields:
-                    field_name = field.name
-                    field_value = getattr(img, field_name)
-                    
-                    if not field_value:
-                        continue
-                        
-                    source_path = field_value.name
-                    
-                    # Check if the file exists in the source storage
-                    if not source_storage.exists(source_path):
-                        self.stdout.write(self.style.WARNING(f'Skipping non-existent file: {source_path}'))
-                        skipped += 1
-                        continue
-                        
-                    # Check if the file already exists in the destination storage
-                    if dest_storage.exists(source_path):
-                        self.stdout.write(f'Skipping existing file: {source_path}')
-                        skipped += 1
+        # source name -> name in the destination storage
+        self.done = {} if options['restart'] else self.read_manifest(manifest_path)
+        if self.done:
+            self.stdout.write(f'Resuming: {len(self.done)} files already copied')
+        # migrated, skipped, errors, bytes
+        self.totals = [0, 0, 0, 0]
+        self.renamed = {name: stored for name, stored in self.done.items() if stored != name}
+        start = time.perf_counter()
+
+        manifest = None if self.dry_run else open(manifest_path, 'a', encoding='utf-8')
+        try:
+            with ThreadPoolExecutor(max_workers=max(1, options['workers'])) as pool:
+                batch = {}
+                for name in self.file_names():
+                    # Content-addressed files are shared, so names repeat
+                    if name in self.done or name in batch:
                         continue
-                        
-                    # Copy the file
-                    if not dry_run:
-                        with source_storage.open(source_path, 'rb') as source_file:
-                            dest_storage.save(source_path, source_file)
-                            
-                    self.stdout.write(self.style.SUCCESS(f'Migrated: {source_path}'))
-                    changed = True
-                
-                if changed:
-                    migrated += 1
-                    if not dry_run:
-                        img.save()  # This will update the file fields if needed
-                        
-            except Exception as e:
-                errors += 1
-                self.stdout.write(self.style.ERROR(f'Error processing {img}: {str(e)}'))
-
-        # Print summary
+                    batch[name] = None
+                    if len(batch) == batch_size:
+                        self.copy_batch(pool, batch, manifest)
+                        self.report(start)
+                        batch = {}
+                if batch:
+                    self.copy_batch(pool, batch, manifest)
+        finally:
+            if manifest:
+                manifest.close()
+
+        updated = 0 if self.dry_run else self.update_references()
+
+        migrated, skipped, errors, size = self.totals
+        elapsed = time.perf_counter() - start
         self.stdout.write('\n' + '=' * 50)
         self.stdout.write(self.style.SUCCESS('Migration complete!'))
-        self.stdout.write(f'Migrated: {migrated} images')
+        self.stdout.write(f'Migrated: {migrated} files ({size / (1024 * 1024):.1f} MB in {elapsed:.1f}s)')
         self.stdout.write(f'Skipped: {skipped} files')
+        self.stdout.write(f'Renamed on the destination: {len(self.renamed)} files ({updated} rows updated)')
         self.stdout.write(f'Errors: {errors}')
 
-        if dry_run:
+        if self.dry_run:
             self.stdout.write(self.style.WARNING('Dry run completed. No changes were made.'))
+        elif options['destination'] != 'default':
+            # Media fields read through STORAGES['default']
+            self.stdout.write(
+                f'Point STORAGES["default"] at the "{options["destination"]}" backend to serve the copied files'
+            )
+
+    def get_storage(self, alias):
+        try:
+            return storages[alias]
+        except InvalidStorageError:
+            raise CommandError(f'Storage "{alias}" not found in settings.STORAGES')
+
+    def file_names(self):
+        """Every media name referenced in the database, streamed."""
+        for model, field, _ in FILE_FIELDS:
+            names = (
+                model.objects.exclude(**{f'{field}__isnull': True})
+                .exclude(**{field: ''})
+                .order_by('pk')
+                .values_list(field, flat=True)
+            )
+            yield from names.iterator(chunk_size=2000)
+
+    def copy_batch(self, pool, batch, manifest):
+        for name, result, error in pool.map(self.copy, batch):
+            if error == MISSING:
+                self.totals[1] += 1
+                self.stdout.write(self.style.WARNING(f'Skipping non-existent file: {name}'))
+                continue
+            if error:
+                self.totals[2] += 1
+                self.stdout.write(self.style.ERROR(f'Error copying {name}: {error}'))
+                continue
+            stored, checksum, size, copied = result
+            self.done[name] = stored
+            if stored != name:
+                self.renamed[name] = stored
+            if copied:
+                self.totals[0] += 1
+                self.totals[3] += size
+            else:
+                self.totals[1] += 1
+            if manifest:
+                manifest.write(json.dumps({
+                    **self.aliases, 'name': name, 'stored': stored, 'sha256': checksum, 'size': size,
+                }) + '\n')
+        if manifest:
+            manifest.flush()
+
+    def copy(self, name):
+        """
+        Copy one file, then read it back from the destination and compare
+        checksums. Runs in a worker thread and returns (name, result, error).
+        A file missing from the source shows up as FileNotFoundError on first
+        use, saving an exists() round trip per file.
+        """
+        try:
+            if self.dry_run:
+                return name, (name, '', self.source.size(name), True), None
+
+            if self.target.exists(name):
+                # Left by an earlier run that died before recording it
+                checksum = file_checksum(self.source, name)
+                if file_checksum(self.target, name) == checksum:
+                    return name, (name, checksum, self.source.size(name), False), None
+
+            with self.source.open(name, 'rb') as f:
+                content = HashingFile(f, name)
+                stored = self.target.save(name, content)
+            if content.bytes_read:
+                checksum, size = content.digest.hexdigest(), content.bytes_read
+            else:
+                # The backend read the file without chunks(); hash the source again
+                checksum, size = file_checksum(self.source, name), self.source.size(name)
+            if file_checksum(self.target, stored) != checksum:
+                self.target.delete(stored)
+                return name, None, 'checksum mismatch after copy'
+            return name, (stored, checksum, size, True), None
+        except FileNotFoundError:
+            return name, None, MISSING
+        except Exception as e:
+            return name, None, str(e)
+
+    def update_references(self):
+        """
+        Point rows at files the destination stored under a different name,
+        without save(): one CASE update per field and chunk of names, each
+        chunk in its own transaction.
+        """
+        renamed = list(self.renamed.items())
+        updated = 0
+        for start in range(0, len(renamed), self.batch_size):
+            chunk = dict(renamed[start:start + self.batch_size])
+            destination_ids = set()
+            with transaction.atomic():
+                for model, field, destination_field in FILE_FIELDS:
+                    rows = model.objects.filter(**{f'{field}__in': list(chunk)})
+                    destination_ids.update(rows.values_list(destination_field, flat=True))
+                    updated += rows.update(**{field: Case(
+                        *[When(**{field: old}, then=Value(new)) for old, new in chunk.items()],
+                        default=F(field),
+                        output_field=model._meta.get_field(field),
+                    )})
+                Destination.objects.filter(pk__in=destination_ids).touch()
+        return updated
+
+    def read_manifest(self, path):
+        done = {}
+        ignored = 0
+        if not os.path.exists(path):
+            return done
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # A torn last line from an interrupted run
+                    continue
+                # Copies to another backend (or unlabelled ones) prove nothing here
+                if all(entry.get(key) == alias for key, alias in self.aliases.items()):
+                    done[entry['name']] = entry['stored']
+                else:
+                    ignored += 1
+        if ignored:
+            self.stdout.write(self.style.WARNING(
+                f'Ignoring {ignored} manifest entries recorded for other storages'
+            ))
+        return done
 
-    def get_storage(self, storage_name):
-        """Get a storage instance by name."""
-        if storage_name == 'default':
-            return default_storage
-            
-        storage_settings = settings.STORAGES.get(storage_name)
-        if not storage_settings:
-            raise ValueError(f'Storage "{storage_name}" not found in settings.STORAGES')
-            
-        return get_storage_class(storage_settings['BACKEND'])(
-            **storage_settings.get('OPTIONS', {})
-        )
\ No newline at end of file
+    def report(self, start):
+        migrated, skipped, errors, size = self.totals
+        elapsed = time.perf_counter() - start
+        rate = size / (1024 * 1024) / elapsed if elapsed else 0
+        self.stdout.write(f'{migrated} migrated, {skipped} skipped, {errors} errors ({rate:.1f} MB/s)')
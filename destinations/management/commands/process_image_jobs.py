@@ -0,0 +1,157 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+from destinations.imaging import THUMBNAIL_SIZE, read_source, render_derivatives, responsive_specs
+from destinations.models import Destination, DestinationImage, ImageJob
+
+
+class Command(BaseCommand):
+    help = 'Generate image derivatives for queued upload jobs using a process pool'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=os.cpu_count() or 1,
+            help='Worker processes (default: number of CPUs)'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=50,
+            help='Jobs claimed per batch (default: 50)'
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Exit when the queue is empty instead of polling for new jobs'
+        )
+        parser.add_argument(
+            '--sleep',
+            type=float,
+            default=2.0,
+            help='Seconds to wait between polls of an empty queue (default: 2)'
+        )
+        parser.add_argument(
+            '--max-attempts',
+            type=int,
+            default=3,
+            help='Give up on a job after this many failures (default: 3)'
+        )
+        parser.add_argument(
+            '--requeue-stale',
+            type=int,
+            default=30,
+            metavar='MINUTES',
+            help='Return jobs stuck in "running" for this long to the queue (default: 30)'
+        )
+
+    def handle(self, *args, **options):
+        workers = max(1, options['workers'])
+        batch_size = max(1, options['batch_size'])
+        self.max_attempts = max(1, options['max_attempts'])
+
+        requeued = self.requeue_stale(options['requeue_stale'])
+        if requeued:
+            self.stdout.write(self.style.WARNING(f'Requeued {requeued} stale jobs'))
+
+        processed = failed = 0
+        start = time.perf_counter()
+
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            while True:
+                jobs = self.claim_jobs(batch_size)
+                if not jobs:
+                    if options['once']:
+                        break
+                    time.sleep(options['sleep'])
+                    continue
+
+                done, errors = self.process_batch(pool, jobs)
+                processed += done
+                failed += errors
+
+        elapsed = time.perf_counter() - start
+        rate = processed / elapsed if elapsed else 0
+        self.stdout.write(self.style.SUCCESS(
+            f'Processed {processed} images ({failed} failed) in {elapsed:.1f}s '
+            f'- {rate:.1f} images/s with {workers} workers'
+        ))
+
+    def requeue_stale(self, minutes):
+        cutoff = timezone.now() - timedelta(minutes=minutes)
+        return ImageJob.objects.filter(status=ImageJob.RUNNING, updated_at__lt=cutoff).update(
+            status=ImageJob.PENDING, updated_at=timezone.now()
+        )
+
+    def claim_jobs(self, batch_size):
+        """Mark the oldest pending jobs as running and return them."""
+        with transaction.atomic():
+            pending = ImageJob.objects.filter(status=ImageJob.PENDING).order_by('id')
+            if connection.features.has_select_for_update_skip_locked:
+                # Lets several workers drain the same queue without overlap
+                pending = pending.select_for_update(skip_locked=True)
+            ids = list(pending.values_list('id', flat=True)[:batch_size])
+            ImageJob.objects.filter(id__in=ids).update(
+                status=ImageJob.RUNNING, attempts=F('attempts') + 1, updated_at=timezone.now()
+            )
+        return list(ImageJob.objects.filter(id__in=ids).select_related('image'))
+
+    def process_batch(self, pool, jobs):
+        """Render in the pool, store results from this process, and settle each job."""
+        # One decode per image renders the thumbnail and the srcset renditions
+        specs = [(*THUMBNAIL_SIZE, 'jpeg')] + responsive_specs()
+        futures = {}
+        reused = []
+        for job in jobs:
+            try:
+                # Content-addressed duplicates copy another image's renditions
+                if job.image.reuse_derivatives():
+                    reused.append(job)
+                else:
+                    futures[pool.submit(render_derivatives, read_source(job.image.image), specs)] = job
+            except Exception as e:
+                self.fail_job(job, e)
+
+        errors = len(jobs) - len(futures) - len(reused)
+        done = len(reused)
+        touched = {job.image.destination_id for job in reused}
+        ImageJob.objects.filter(pk__in=[job.pk for job in reused]).update(
+            status=ImageJob.DONE, error='', updated_at=timezone.now()
+        )
+        for future in as_completed(futures):
+            job = futures[future]
+            try:
+                thumbnail, *derivatives = future.result()
+                job.image.store_derivatives(derivatives)
+                job.image.store_thumbnail(thumbnail[1])
+            except Exception as e:
+                self.fail_job(job, e)
+                errors += 1
+                continue
+            ImageJob.objects.filter(pk=job.pk).update(status=ImageJob.DONE, error='', updated_at=timezone.now())
+            touched.add(job.image.destination_id)
+            done += 1
+
+        # Thumbnails are written with update(), so refresh validators and
+        # cached pages for the affected destinations in one go.
+        if touched:
+            Destination.objects.filter(pk__in=touched).touch()
+        return done, errors
+
+    def fail_job(self, job, error):
+        gave_up = job.attempts >= self.max_attempts
+        ImageJob.objects.filter(pk=job.pk).update(
+            status=ImageJob.FAILED if gave_up else ImageJob.PENDING,
+            error=str(error),
+            updated_at=timezone.now(),
+        )
+        if gave_up:
+            DestinationImage.objects.filter(pk=job.image_id).update(thumbnail_status=DestinationImage.THUMBNAIL_FAILED)
+        self.stdout.write(self.style.ERROR(f'Error processing {job}: {error}'))
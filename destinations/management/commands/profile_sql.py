@@ -0,0 +1,54 @@
+import argparse
+import json
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from destinations.profiling import SQLProfiler
+
+
+class Command(BaseCommand):
+    help = 'Run another management command and report its SQL, flagging N+1 query patterns'
+
+    def add_arguments(self, parser):
+        parser.add_argument('command_name', help='Command to profile, e.g. export_data')
+        parser.add_argument('args', nargs=argparse.REMAINDER, help='Arguments for that command')
+        parser.add_argument(
+            '--threshold',
+            type=int,
+            default=None,
+            help='Repeats of one query shape that count as N+1 (default: DESTINATION_SQL_PROFILE_THRESHOLD)'
+        )
+        parser.add_argument(
+            '--json',
+            action='store_true',
+            help='Print the report as JSON'
+        )
+
+    def handle(self, *args, **options):
+        profiler = SQLProfiler(options['threshold'])
+        # The profiled command writes where this one does; with --json its
+        # output goes to stderr so stdout stays parseable.
+        inner_stdout = self.stderr if options['json'] else self.stdout
+        with profiler.capture():
+            call_command(options['command_name'], *args, stdout=inner_stdout, stderr=self.stderr)
+        report = profiler.report(' '.join([options['command_name'], *args]))
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+
+        self.stdout.write('\n' + '=' * 50)
+        self.stdout.write(
+            f'{report["queries"]} queries in {report["duration_ms"]:.1f} ms, '
+            f'{report["fingerprints"]} distinct'
+        )
+        if not report['n_plus_one']:
+            self.stdout.write(self.style.SUCCESS('No repeated query patterns above the threshold'))
+        for entry in report['n_plus_one']:
+            self.stdout.write(self.style.WARNING(
+                f'\nN+1: {entry["count"]} queries, {entry["duration_ms"]:.1f} ms\n  {entry["sql"]}'
+            ))
+            if entry['template']:
+                self.stdout.write(f'  template: {entry["template"]}')
+            for frame in entry['stack'] or []:
+                self.stdout.write(f'  at {frame}')
@@ -0,0 +1,136 @@
+import os
+import shutil
+import subprocess
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from destinations import backup, cache, geo
+from destinations.backup import BACKUP_MODELS, DATA_DIR, MEDIA_DIR, PG_DUMP_DIR
+
+
+class Command(BaseCommand):
+    help = 'Verify a backup made by backup_database, or restore it'
+
+    def add_arguments(self, parser):
+        parser.add_argument('backup', type=str, help='Backup directory (backups/backup_<timestamp>)')
+        parser.add_argument(
+            '--verify',
+            action='store_true',
+            help='Only check the backup (checksums, row counts, pg_restore --list) without restoring'
+        )
+        parser.add_argument(
+            '--media',
+            action='store_true',
+            help='Also copy the media snapshot back into MEDIA_ROOT'
+        )
+        parser.add_argument(
+            '--jobs',
+            type=int,
+            default=os.cpu_count() or 1,
+            help='Parallel pg_restore jobs (default: number of CPUs)'
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=2000,
+            help='Rows inserted per query by the logical restore (default: 2000)'
+        )
+        parser.add_argument(
+            '--noinput', '--no-input',
+            action='store_false',
+            dest='interactive',
+            help='Do not prompt before replacing the current data'
+        )
+
+    def handle(self, *args, **options):
+        backup_dir = options['backup']
+        try:
+            manifest = backup.read_manifest(backup_dir)
+        except (OSError, ValueError) as e:
+            raise CommandError(f'Not a complete backup ({e})')
+
+        problems = self.verify(backup_dir, manifest)
+        if problems:
+            for problem in problems:
+                self.stdout.write(self.style.ERROR(f'- {problem}'))
+            raise CommandError(f'Backup failed verification with {len(problems)} problems')
+        self.stdout.write(self.style.SUCCESS(f'Backup verified ({manifest["format"]}, {manifest["created_at"]})'))
+        if options['verify']:
+            return
+
+        if options['interactive']:
+            answer = input(
+                f'This will replace all destination data in the "{connection.settings_dict["NAME"]}" '
+                "database. Type 'yes' to continue: "
+            )
+            if answer != 'yes':
+                self.stdout.write('Restore cancelled.')
+                return
+
+        if manifest['format'] == 'pg_dump':
+            self.pg_restore(backup_dir, options['jobs'])
+        else:
+            self.logical_restore(backup_dir, manifest, max(1, options['chunk_size']))
+
+        if options['media'] and manifest.get('media'):
+            self.restore_media(os.path.join(backup_dir, MEDIA_DIR))
+
+        # Cached pages describe the data that was just replaced
+        for namespace in cache.NAMESPACES:
+            cache.purge_namespace(namespace)
+        # As are the spatial indexes of running processes
+        geo.forget_deletions()
+        self.stdout.write(self.style.SUCCESS('Restore completed successfully!'))
+
+    def verify(self, backup_dir, manifest):
+        if manifest['format'] == 'pg_dump':
+            problems = []
+            try:
+                subprocess.run(
+                    ['pg_restore', '--list', os.path.join(backup_dir, PG_DUMP_DIR)],
+                    check=True, stdout=subprocess.DEVNULL,
+                )
+            except FileNotFoundError:
+                raise CommandError('pg_restore not found; install the PostgreSQL client tools')
+            except subprocess.CalledProcessError as e:
+                problems.append(f'pg_restore could not read the dump: {e}')
+        elif manifest['format'] == 'logical':
+            problems = backup.verify_logical(backup_dir, manifest)
+        else:
+            raise CommandError(f'Unknown backup format "{manifest["format"]}"')
+        return problems + backup.verify_media(backup_dir, manifest)
+
+    def pg_restore(self, backup_dir, jobs):
+        if connection.vendor != 'postgresql':
+            raise CommandError('pg_dump backups can only be restored into PostgreSQL')
+        db = settings.DATABASES['default']
+        cmd = ['pg_restore', *backup.pg_connection_args(db), '-j', str(max(1, jobs)),
+               '--clean', '--if-exists', '--no-owner', '-d', db['NAME'], os.path.join(backup_dir, PG_DUMP_DIR)]
+        self.stdout.write('Running pg_restore...')
+        subprocess.run(cmd, check=True, env=backup.pg_env(db))
+
+    def logical_restore(self, backup_dir, manifest, chunk_size):
+        data_dir = os.path.join(backup_dir, DATA_DIR)
+        tables = [model._meta.db_table for model in BACKUP_MODELS]
+        with transaction.atomic():
+            # Plain SQL deletes: model deletes would fire django-cleanup and
+            # remove the media files the restored rows point at.
+            connection.ops.execute_sql_flush(connection.ops.sql_flush(no_style(), tables))
+            with backup.preserved_timestamps(BACKUP_MODELS):
+                for model in BACKUP_MODELS:
+                    entry = manifest['tables'][backup.model_label(model)]
+                    rows = backup.load_model(model, os.path.join(data_dir, entry['file']), chunk_size)
+                    self.stdout.write(f'  {backup.model_label(model)}: {rows} rows')
+            backup.reset_sequences()
+
+    def restore_media(self, snapshot):
+        restored = 0
+        for dirpath, _, filenames in os.walk(snapshot):
+            target_dir = os.path.join(settings.MEDIA_ROOT, os.path.relpath(dirpath, snapshot))
+            os.makedirs(target_dir, exist_ok=True)
+            for filename in filenames:
+                shutil.copy2(os.path.join(dirpath, filename), os.path.join(target_dir, filename))
+                restored += 1
+        self.stdout.write(f'Restored {restored} media files')
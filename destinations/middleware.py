@@ -1,32 +1,107 @@
-import time
-from django.utils.deprecation import MiddlewareMixin
+import json
 import logging
+import random
+from contextvars import ContextVar
+from time import perf_counter_ns
+
+from django.conf import settings
+
+from .metrics import registry
 
 logger = logging.getLogger(__name__)
 
-class RequestLoggingMiddleware(MiddlewareMixin):
-    def process_request(self, request):
-        request.start_time = time.time()
-        return None
 
-    def process_response(self, request, response):
-        # Calculate request processing time
-        total_time = time.time() - request.start_time
+class QueryCounter:
+    __slots__ = ('count', 'ns')
+
+    def __init__(self):
+        self.count = 0
+        self.ns = 0
+
+
+# The counter of the request being handled in this thread/task, if any
+current_queries = ContextVar('current_queries', default=None)
+
+
+def count_queries(execute, sql, params, many, context):
+    """
+    Execute wrapper installed once on every connection (see
+    install_query_counter), so a request only pays for setting a context
+    variable rather than for looking up the thread's connection twice.
+    """
+    counter = current_queries.get()
+    if counter is None:
+        return execute(sql, params, many, context)
+    start = perf_counter_ns()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        counter.ns += perf_counter_ns() - start
+        counter.count += 1
 
-        # Log the request details
-        log_data = {
-            'method': request.method,
-            'path': request.path,
-            'status_code': response.status_code,
-            'processing_time': total_time,
-            'user_agent': request.META.get('HTTP_USER_AGENT', ''),
-            'user': str(getattr(request, 'user', 'AnonymousUser')),
-            'ip': request.META.get('REMOTE_ADDR', ''),
-        }
 
-        logger.info(
-            f"{request.method} {request.path} {response.status_code} "
-            f"in {total_time:.2f}s - User: {log_data['user']}"
+def install_query_counter(sender, connection, **kwargs):
+    """connection_created receiver; runs again on every reconnect."""
+    if count_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(count_queries)
+
+
+def route_name(request):
+    """The URL name (or pattern) that matched, so metrics don't fan out per slug."""
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return '<unresolved>'
+    return match.view_name or match.route
+
+
+class RequestLoggingMiddleware:
+    """
+    Records every request into the in-process metrics registry (latency,
+    status, database queries and time, per route) and writes a sampled
+    JSON log line. Slow and failed requests are always logged.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.sample_rate = getattr(settings, 'DESTINATION_METRICS_LOG_SAMPLE_RATE', 0.01)
+        self.slow_ns = int(getattr(settings, 'DESTINATION_METRICS_SLOW_MS', 1000) * 1_000_000)
+
+    def __call__(self, request):
+        start = perf_counter_ns()
+        queries = QueryCounter()
+        token = current_queries.set(queries)
+        try:
+            view_start = perf_counter_ns()
+            response = self.get_response(request)
+            view_end = perf_counter_ns()
+        finally:
+            current_queries.reset(token)
+
+        duration = view_end - start
+        status = response.status_code
+        route = route_name(request)
+        if status >= 500 or duration >= self.slow_ns or random.random() < self.sample_rate:
+            self.log(request, route, status, duration, queries)
+        registry.record(
+            route, request.method, status, duration, queries.count, queries.ns,
+            (view_start - start) + (perf_counter_ns() - view_end),
         )
+        return response
 
-        return response
\ No newline at end of file
+    def log(self, request, route, status, duration, queries):
+        if not logger.isEnabledFor(logging.INFO):
+            return
+        # Only report a user AuthenticationMiddleware already loaded;
+        # touching request.user here would cost a session and user query.
+        user = getattr(request, '_cached_user', None)
+        logger.info(json.dumps({
+            'method': request.method,
+            'route': route,
+            'path': request.path,
+            'status': status,
+            'duration_ms': round(duration / 1_000_000, 3),
+            'db_queries': queries.count,
+            'db_ms': round(queries.ns / 1_000_000, 3),
+            'user_id': user.pk if user is not None else None,
+            'ip': request.META.get('REMOTE_ADDR', ''),
+        }))
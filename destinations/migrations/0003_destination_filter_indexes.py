@@ -0,0 +1,28 @@
+# Generated by Django 4.2.7 on 2026-10-18 10:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('destinations', '0002_alter_destination_options_and_more'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='destination',
+            name='district',
+            field=models.CharField(db_index=True, max_length=100),
+        ),
+        migrations.AlterField(
+            model_name='destination',
+            name='state',
+            field=models.CharField(db_index=True, max_length=100),
+        ),
+        migrations.AlterField(
+            model_name='destination',
+            name='weather',
+            field=models.CharField(db_index=True, max_length=100),
+        ),
+    ]
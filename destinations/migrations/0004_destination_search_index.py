@@ -0,0 +1,22 @@
+from django.db import migrations
+
+from destinations.search import install_search_index, remove_search_index
+
+
+def create_index(apps, schema_editor):
+    install_search_index(schema_editor)
+
+
+def drop_index(apps, schema_editor):
+    remove_search_index(schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('destinations', '0003_destination_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
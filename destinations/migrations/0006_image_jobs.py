@@ -0,0 +1,48 @@
+# Generated by Django 4.2.7 on 2026-10-18 10:51
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def backfill_thumbnail_status(apps, schema_editor):
+    DestinationImage = apps.get_model('destinations', 'DestinationImage')
+    ImageJob = apps.get_model('destinations', 'ImageJob')
+
+    # Existing thumbnails are ready; everything else goes to the worker.
+    DestinationImage.objects.exclude(thumbnail='').exclude(thumbnail__isnull=True).update(thumbnail_status='ready')
+    pending = DestinationImage.objects.filter(thumbnail_status='pending').values_list('id', flat=True)
+    ImageJob.objects.bulk_create(
+        (ImageJob(image_id=image_id) for image_id in pending.iterator()),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('destinations', '0005_destination_updated_at_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='destinationimage',
+            name='thumbnail_status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('ready', 'Ready'), ('failed', 'Failed')], default='pending', max_length=20),
+        ),
+        migrations.CreateModel(
+            name='ImageJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=20)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('image', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='jobs', to='destinations.destinationimage')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'id'], name='imagejob_status_id_idx')],
+            },
+        ),
+        migrations.RunPython(backfill_thumbnail_status, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 4.2.7 on 2026-10-18 10:59
+
+import destinations.models
+import destinations.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('destinations', '0007_image_derivatives'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='destinationimage',
+            name='image',
+            field=models.ImageField(storage=destinations.storage.get_media_storage, upload_to=destinations.models.destination_image_path),
+        ),
+        migrations.AlterField(
+            model_name='destinationimage',
+            name='thumbnail',
+            field=models.ImageField(blank=True, null=True, storage=destinations.storage.get_media_storage, upload_to='thumbnails/'),
+        ),
+        migrations.AlterField(
+            model_name='imagederivative',
+            name='file',
+            field=models.ImageField(max_length=255, storage=destinations.storage.get_media_storage, upload_to='derivatives/'),
+        ),
+    ]
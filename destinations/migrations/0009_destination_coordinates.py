@@ -0,0 +1,49 @@
+# Generated by Django 4.2.7 on 2026-10-18 11:10
+
+from django.db import migrations, models
+from django.utils import timezone
+
+from destinations.geo import parse_map_link
+
+
+def parse_existing_links(apps, schema_editor):
+    Destination = apps.get_model('destinations', 'Destination')
+    manager = Destination.objects.using(schema_editor.connection.alias)
+    rows = manager.exclude(google_map_link__isnull=True)
+    now = timezone.now()
+    batch = []
+    for destination in rows.only('id', 'google_map_link').iterator(chunk_size=2000):
+        coordinates = parse_map_link(destination.google_map_link)
+        if coordinates:
+            destination.latitude, destination.longitude = coordinates
+            # The API output changes, so cached pages must not validate
+            destination.updated_at = now
+            batch.append(destination)
+        if len(batch) == 2000:
+            manager.bulk_update(batch, ['latitude', 'longitude', 'updated_at'])
+            batch = []
+    if batch:
+        manager.bulk_update(batch, ['latitude', 'longitude', 'updated_at'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('destinations', '0008_content_addressed_media'),
+    ]
+
+    operations = [
+        # Nullable without a default, so SQLite adds the columns in place
+        # rather than rebuilding the table (which would drop the FTS triggers).
+        migrations.AddField(
+            model_name='destination',
+            name='latitude',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='destination',
+            name='longitude',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.RunPython(parse_existing_links, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 4.2.7 on 2026-10-18 11:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('destinations', '0009_destination_coordinates'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='destinationimage',
+            index=models.Index(fields=['image'], name='destinationimage_image_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='destinationimage',
+            index=models.Index(fields=['thumbnail'], name='destinationimage_thumb_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='imagederivative',
+            index=models.Index(fields=['file'], name='imagederivative_file_idx'),
+        ),
+    ]
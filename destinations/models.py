@@ -1,12 +1,12 @@
 # In destinations/models.py
 from django.db import models
 from django.urls import reverse
-from django.utils.text import slugify
+from django.utils import timezone
 import os
-from django.core.files.storage import default_storage
-from PIL import Image
-from io import BytesIO
 from django.core.files.base import ContentFile
+from . import cache, geo, slugs
+from .imaging import derivative_name, read_source, render_thumbnail, thumbnail_name
+from .storage import get_media_storage, is_content_name
 
 def destination_image_path(instance, filename):
     # file will be uploaded to MEDIA_ROOT/destinations/<destination_id>/<filename>
@@ -14,71 +14,286 @@ def destination_image_path(instance, filename):
     filename = f"{instance.id}_{instance.destination.id}.{ext}"
     return os.path.join('destinations', str(instance.destination.id), filename)
 
+def delete_derivatives(queryset):
+    """Delete derivative rows and return their file names for delete_files()."""
+    derivatives = list(queryset.only('id', 'file'))
+    ImageDerivative.objects.filter(pk__in=[d.pk for d in derivatives]).delete()
+    return {d.file.name for d in derivatives if d.file}
+
+def delete_files(names):
+    """Delete media files after the rows pointing at them are gone."""
+    for name in names:
+        if name:
+            get_media_storage().delete(name)
+
+class DestinationQuerySet(models.QuerySet):
+    def with_images(self, derivatives=False):
+        """
+        Prefetch images in upload order so templates don't query per row,
+        optionally with their derivatives for srcset rendering.
+        """
+        images = DestinationImage.objects.order_by('id')
+        if derivatives:
+            images = images.prefetch_related('derivatives')
+        return self.prefetch_related(models.Prefetch('images', queryset=images))
+
+    def touch(self):
+        """
+        Bump updated_at and drop cached pages for these destinations, for
+        writes that bypass save() and the model signals.
+        """
+        slugs = list(self.values_list('slug', flat=True))
+        self.update(updated_at=timezone.now())
+        cache.invalidate_destination(*slugs)
+
 class Destination(models.Model):
     place_name = models.CharField(max_length=200)
     slug = models.SlugField(max_length=200, unique=True, blank=True)
-    weather = models.CharField(max_length=100)
-    state = models.CharField(max_length=100)
-    district = models.CharField(max_length=100)
+    weather = models.CharField(max_length=100, db_index=True)
+    state = models.CharField(max_length=100, db_index=True)
+    district = models.CharField(max_length=100, db_index=True)
     google_map_link = models.URLField(blank=True, null=True)
+    # Parsed from google_map_link when it carries coordinates
+    latitude = models.FloatField(blank=True, null=True)
+    longitude = models.FloatField(blank=True, null=True)
     description = models.TextField(blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = DestinationQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # MAX(updated_at) for the conditional-GET validators
+            models.Index(fields=['updated_at'], name='destination_updated_at_idx'),
+        ]
+
     def __str__(self):
         return self.place_name
 
+    def get_absolute_url(self):
+        return reverse('destinations:destination-detail', args=[self.slug])
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the stored values so signal handlers can tell what changed.
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
     def save(self, *args, **kwargs):
         if not self.slug:
-            self.slug = slugify(self.place_name)
+            # Same allocation as the bulk paths: "name", "name-2", ...
+            slugs.assign_slugs([self])
+        if geo.update_coordinates(self) and kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = {*kwargs['update_fields'], 'latitude', 'longitude'}
         super().save(*args, **kwargs)
+        # Signal handlers diff against _loaded_values, so keep it in step
+        # with what is now stored for the next save of this instance.
+        update_fields = kwargs.get('update_fields')
+        deferred = self.get_deferred_fields()
+        self._loaded_values = {
+            **getattr(self, '_loaded_values', {}),
+            **{
+                field.attname: getattr(self, field.attname)
+                for field in self._meta.concrete_fields
+                if field.attname not in deferred
+                and (update_fields is None or field.name in update_fields or field.attname in update_fields)
+            },
+        }
 
 class DestinationImage(models.Model):
+    THUMBNAIL_PENDING = 'pending'
+    THUMBNAIL_READY = 'ready'
+    THUMBNAIL_FAILED = 'failed'
+    THUMBNAIL_STATUS_CHOICES = [
+        (THUMBNAIL_PENDING, 'Pending'),
+        (THUMBNAIL_READY, 'Ready'),
+        (THUMBNAIL_FAILED, 'Failed'),
+    ]
+
     destination = models.ForeignKey(Destination, related_name='images', on_delete=models.CASCADE)
-    image = models.ImageField(upload_to=destination_image_path)
-    thumbnail = models.ImageField(upload_to='thumbnails/', blank=True, null=True)
+    image = models.ImageField(upload_to=destination_image_path, storage=get_media_storage)
+    thumbnail = models.ImageField(upload_to='thumbnails/', storage=get_media_storage, blank=True, null=True)
+    thumbnail_status = models.CharField(max_length=20, choices=THUMBNAIL_STATUS_CHOICES, default=THUMBNAIL_PENDING)
     caption = models.CharField(max_length=200, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # Reference lookups by file name: shared content-addressed files,
+            # derivative reuse and the media GC
+            models.Index(fields=['image'], name='destinationimage_image_idx'),
+            models.Index(fields=['thumbnail'], name='destinationimage_thumb_idx'),
+        ]
+
     def __str__(self):
         return f"Image for {self.destination.place_name}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+    @property
+    def display_url(self):
+        """URL of the thumbnail once it is ready, otherwise of the original upload."""
+        if self.thumbnail_status == self.THUMBNAIL_READY and self.thumbnail:
+            return self.thumbnail.url
+        return self.image.url
+
     def save(self, *args, **kwargs):
-        # Save the main image first
+        # A replaced upload needs its derivatives generated again
+        loaded_image = getattr(self, '_loaded_values', {}).get('image')
+        if loaded_image is not None and loaded_image != self.image.name:
+            self.thumbnail_status = self.THUMBNAIL_PENDING
+
         super().save(*args, **kwargs)
+        self._loaded_values = {'image': self.image.name}
+
+        # Thumbnails are rendered by the process_image_jobs worker, off the
+        # request path.
+        if self.image and self.thumbnail_status == self.THUMBNAIL_PENDING:
+            self.enqueue_derivatives()
+
+    def enqueue_derivatives(self):
+        """Queue a job to (re)generate this image's derivatives, unless one is already queued."""
+        active = ImageJob.objects.filter(image=self, status__in=[ImageJob.PENDING, ImageJob.RUNNING])
+        if not active.exists():
+            ImageJob.objects.create(image=self)
+
+    def store_thumbnail(self, data):
+        """Save rendered thumbnail bytes and mark the image ready without calling save()."""
+        old_name = self.thumbnail.name
+        name = self.thumbnail.storage.save(thumbnail_name(self.image.name), ContentFile(data))
 
-        # Create thumbnail if it doesn't exist
-        if self.image and not self.thumbnail:
-            self.create_thumbnail()
+        self.thumbnail.name = name
+        self.thumbnail_status = self.THUMBNAIL_READY
+        DestinationImage.objects.filter(pk=self.pk).update(thumbnail=name, thumbnail_status=self.THUMBNAIL_READY)
+        if old_name and old_name != name:
+            delete_files([old_name])
+
+    def store_derivatives(self, results):
+        """Save ``render_derivatives()`` output, replacing older renditions of the same specs."""
+        if not results:
+            return
+        stale = models.Q()
+        for (max_width, max_height, fmt), _, _, _ in results:
+            stale |= models.Q(max_width=max_width, max_height=max_height, format=fmt)
+        stale_files = delete_derivatives(self.derivatives.filter(stale))
+
+        derivatives = []
+        for (max_width, max_height, fmt), data, width, height in results:
+            derivative = ImageDerivative(
+                image=self, max_width=max_width, max_height=max_height,
+                format=fmt, width=width, height=height,
+            )
+            name = derivative_name(self.image.name, self.pk, max_width, max_height, fmt)
+            derivative.file.name = derivative.file.storage.save(name, ContentFile(data))
+            derivatives.append(derivative)
+        ImageDerivative.objects.bulk_create(derivatives)
+        delete_files(stale_files - {d.file.name for d in derivatives})
+
+    def reuse_derivatives(self):
+        """
+        Copy the thumbnail and derivatives of another image with the same
+        content-addressed file instead of rendering them again. Returns
+        whether such an image was found.
+        """
+        if not is_content_name(self.image.name):
+            return False
+        donor = (
+            DestinationImage.objects.filter(image=self.image.name, thumbnail_status=self.THUMBNAIL_READY)
+            .exclude(pk=self.pk)
+            .prefetch_related('derivatives')
+            .first()
+        )
+        if donor is None:
+            return False
+
+        stale_files = delete_derivatives(self.derivatives.all())
+        ImageDerivative.objects.bulk_create([
+            ImageDerivative(
+                image=self, max_width=d.max_width, max_height=d.max_height, format=d.format,
+                file=d.file.name, width=d.width, height=d.height,
+            )
+            for d in donor.derivatives.all()
+        ])
+        if self.thumbnail.name and self.thumbnail.name != donor.thumbnail.name:
+            stale_files.add(self.thumbnail.name)
+        self.thumbnail.name = donor.thumbnail.name
+        self.thumbnail_status = self.THUMBNAIL_READY
+        DestinationImage.objects.filter(pk=self.pk).update(thumbnail=donor.thumbnail.name, thumbnail_status=self.THUMBNAIL_READY)
+        delete_files(stale_files)
+        return True
 
     def create_thumbnail(self):
-        try:
-            img = Image.open(self.image.path)
-            output_size = (300, 200)
-            img.thumbnail(output_size)
-            
-            thumb_name = f"thumb_{self.image.name.split('/')[-1]}"
-            thumb_path = os.path.join('thumbnails', thumb_name)
-            
-            # Save to media directory
-            thumb_io = BytesIO()
-            if img.mode in ('RGBA', 'LA'):
-                background = Image.new('RGB', img.size, (255, 255, 255))
-                background.paste(img, mask=img.split()[-1])
-                img = background
-            
-            img.save(thumb_io, format='JPEG', quality=85)
-            self.thumbnail.save(thumb_name, ContentFile(thumb_io.getvalue()), save=False)
-            self.save()
-        except Exception as e:
-            print(f"Error creating thumbnail: {e}")
+        """Render the thumbnail synchronously (the worker is the normal path)."""
+        self.store_thumbnail(render_thumbnail(read_source(self.image)))
+        Destination.objects.filter(pk=self.destination_id).touch()
 
     def delete(self, *args, **kwargs):
-        # Delete the image files when the model instance is deleted
-        if self.image:
-            if os.path.isfile(self.image.path):
-                os.remove(self.image.path)
-        if self.thumbnail:
-            if os.path.isfile(self.thumbnail.path):
-                os.remove(self.thumbnail.path)
-        super().delete(*args, **kwargs)
\ No newline at end of file
+        # Delete the image files once the row is gone, so content-addressed
+        # files shared with other images see an accurate reference count.
+        files = {f.name for f in (self.image, self.thumbnail) if f}
+        result = super().delete(*args, **kwargs)
+        delete_files(files)
+        return result
+
+class ImageDerivative(models.Model):
+    """A resized rendition of a DestinationImage."""
+    image = models.ForeignKey(DestinationImage, related_name='derivatives', on_delete=models.CASCADE)
+    # Requested bounding box; 0 leaves that side unconstrained
+    max_width = models.PositiveIntegerField()
+    max_height = models.PositiveIntegerField()
+    format = models.CharField(max_length=10)
+    file = models.ImageField(upload_to='derivatives/', storage=get_media_storage, max_length=255)
+    # Actual pixel size of the rendered file
+    width = models.PositiveIntegerField()
+    height = models.PositiveIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['image', 'max_width', 'max_height', 'format'],
+                name='unique_image_derivative',
+            ),
+        ]
+        indexes = [
+            # Reference lookups by file name, as on DestinationImage
+            models.Index(fields=['file'], name='imagederivative_file_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.max_width}x{self.max_height} {self.format} of image {self.image_id}"
+
+class ImageJob(models.Model):
+    """A queued request to generate the derivatives of one DestinationImage."""
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+
+    image = models.ForeignKey(DestinationImage, related_name='jobs', on_delete=models.CASCADE)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            # The worker claims the oldest pending jobs first
+            models.Index(fields=['status', 'id'], name='imagejob_status_id_idx'),
+        ]
+
+    def __str__(self):
+        return f"Job {self.pk} for image {self.image_id} ({self.status})"
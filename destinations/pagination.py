@@ -0,0 +1,18 @@
+from rest_framework.pagination import CursorPagination
+
+
+class DestinationCursorPagination(CursorPagination):
+    """
+    Keyset pagination over the primary key: each page is an indexed range
+    scan, and rows inserted while a client pages through don't shift it.
+    """
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    ordering = '-id'
+
+    def get_ordering(self, request, queryset, view):
+        # Search results are paged by relevance, with the id breaking ties.
+        if request.query_params.get('q', '').strip():
+            return ('-search_rank', '-id')
+        return (self.ordering,)
@@ -0,0 +1,189 @@
+"""
+Opt-in SQL profiling: groups the queries of one request (or management
+command) by a normalized fingerprint and flags fingerprints repeated
+``threshold`` times or more as likely N+1 patterns, with the Python and
+template location that issued them.
+
+Enabled for every request by DESTINATION_SQL_PROFILE, or per request by
+sending ``X-SQL-Profile: <DESTINATION_SQL_PROFILE_TOKEN>``. Reports are
+logged and kept in a small in-process buffer served to staff by the
+``sql-profiles`` debug view; ``manage.py profile_sql <command>`` profiles a
+command.
+"""
+import hmac
+import itertools
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+# Reports kept for the debug view
+REPORT_BUFFER = 50
+# Project frames shown per stack
+STACK_DEPTH = 8
+
+STRING_PATTERN = re.compile(r"'(?:[^']|'')*'")
+NUMBER_PATTERN = re.compile(r'\b\d+(?:\.\d+)?\b')
+# IN (%s, %s, ...) of any length, after literals became %s
+IN_LIST_PATTERN = re.compile(r'\(\s*%s(?:\s*,\s*%s)*\s*\)')
+SPACE_PATTERN = re.compile(r'\s+')
+
+_reports = deque(maxlen=REPORT_BUFFER)
+_ids = itertools.count(1)
+_lock = threading.Lock()
+
+
+def fingerprint(sql):
+    """SQL with literals and IN-list lengths normalized away."""
+    sql = STRING_PATTERN.sub('%s', sql)
+    sql = NUMBER_PATTERN.sub('%s', sql)
+    sql = IN_LIST_PATTERN.sub('(...)', sql)
+    return SPACE_PATTERN.sub(' ', sql).strip()
+
+
+def project_stack():
+    """The innermost project frames (file:line function), skipping Django and libraries."""
+    root = str(settings.BASE_DIR)
+    here = os.path.abspath(__file__)
+    frames = []
+    frame = sys._getframe(2)
+    while frame is not None and len(frames) < STACK_DEPTH:
+        filename = frame.f_code.co_filename
+        if (filename.startswith(root) and filename != here
+                and 'site-packages' not in filename and '/migrations/' not in filename):
+            frames.append(f'{os.path.relpath(filename, root)}:{frame.f_lineno} {frame.f_code.co_name}')
+        frame = frame.f_back
+    return frames
+
+
+def template_location():
+    """``name:line`` of the innermost template node being rendered, if any."""
+    frame = sys._getframe(2)
+    while frame is not None:
+        if frame.f_code.co_name == 'render_annotated':
+            node = frame.f_locals.get('self')
+            origin = getattr(node, 'origin', None)
+            token = getattr(node, 'token', None)
+            if origin is not None and token is not None:
+                return f'{origin.template_name or origin.name}:{token.lineno}'
+        frame = frame.f_back
+    return None
+
+
+class SQLProfiler:
+    """An execute wrapper collecting per-fingerprint counts, time and call sites."""
+
+    def __init__(self, threshold=None):
+        if threshold is None:
+            threshold = getattr(settings, 'DESTINATION_SQL_PROFILE_THRESHOLD', 5)
+        self.threshold = threshold
+        self.groups = {}
+        self.count = 0
+        self.ns = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter_ns()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter_ns() - start
+            self.count += 1
+            self.ns += elapsed
+            key = fingerprint(sql)
+            group = self.groups.get(key)
+            if group is None:
+                group = self.groups[key] = {'count': 0, 'ns': 0, 'stack': None, 'template': None}
+            group['count'] += 1
+            group['ns'] += elapsed
+            # Stacks are costly: take one for the first query of a
+            # fingerprint, then replace it when the repeats cross the
+            # threshold, which is normally the loop doing the damage.
+            if group['count'] in (1, self.threshold):
+                group['stack'] = project_stack()
+                group['template'] = template_location()
+
+    @contextmanager
+    def capture(self):
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(self))
+            yield self
+
+    def report(self, label):
+        groups = sorted(self.groups.items(), key=lambda item: (-item[1]['count'], -item[1]['ns']))
+        return {
+            'label': label,
+            'queries': self.count,
+            'duration_ms': round(self.ns / 1_000_000, 3),
+            'fingerprints': len(groups),
+            'n_plus_one': [
+                {
+                    'sql': sql,
+                    'count': group['count'],
+                    'duration_ms': round(group['ns'] / 1_000_000, 3),
+                    'template': group['template'],
+                    'stack': group['stack'],
+                }
+                for sql, group in groups if group['count'] >= self.threshold
+            ],
+            'top': [
+                {'sql': sql, 'count': group['count'], 'duration_ms': round(group['ns'] / 1_000_000, 3)}
+                for sql, group in groups[:10]
+            ],
+        }
+
+
+def save_report(report):
+    """Log a report and keep it for the debug view; returns its id."""
+    with _lock:
+        report['id'] = next(_ids)
+        _reports.append(report)
+    level = logging.WARNING if report['n_plus_one'] else logging.INFO
+    if logger.isEnabledFor(level):
+        summary = ', '.join(f'{entry["count"]}x {entry["sql"][:80]}' for entry in report['n_plus_one'])
+        logger.log(
+            level, 'SQL profile #%s %s: %s queries in %.1f ms%s', report['id'], report['label'],
+            report['queries'], report['duration_ms'], f'; N+1: {summary}' if summary else '',
+        )
+    return report['id']
+
+
+def recent_reports():
+    with _lock:
+        return list(reversed(_reports))
+
+
+def is_requested(request):
+    if getattr(settings, 'DESTINATION_SQL_PROFILE', False):
+        return True
+    token = getattr(settings, 'DESTINATION_SQL_PROFILE_TOKEN', '')
+    # Constant time, so response timing doesn't leak the token. Bytes, since
+    # compare_digest() rejects non-ASCII strings.
+    sent = request.headers.get('X-SQL-Profile', '')
+    return bool(token) and hmac.compare_digest(sent.encode(), token.encode())
+
+
+class SQLProfilingMiddleware:
+    """Profiles requests that ask for it; adds an X-SQL-Profile-Id response header."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not is_requested(request):
+            return self.get_response(request)
+        profiler = SQLProfiler()
+        with profiler.capture():
+            response = self.get_response(request)
+        report_id = save_report(profiler.report(f'{request.method} {request.get_full_path()}'))
+        response['X-SQL-Profile-Id'] = str(report_id)
+        return response
@@ -0,0 +1,218 @@
+import re
+
+from django.core import checks
+from django.db import connections
+from django.db.models import Case, FloatField, IntegerField, Q, Value, When
+from django.db.models.expressions import RawSQL
+
+# Columns covered by the full-text index, in index order.
+SEARCH_FIELDS = ('place_name', 'state', 'district', 'description')
+
+# Name shared by the MySQL FULLTEXT index, the PostgreSQL GIN index and the
+# SQLite FTS5 virtual table.
+FTS_NAME = 'destinations_destination_fts'
+
+TABLE = 'destinations_destination'
+
+# SQLite triggers keeping the FTS5 table in step with TABLE
+SQLITE_TRIGGERS = tuple(f'{FTS_NAME}_{suffix}' for suffix in ('ai', 'ad', 'au'))
+
+# Upper bound on the number of words taken from a user query.
+MAX_TERMS = 8
+
+# Weights for the icontains fallback: a name match beats a location match,
+# which beats a description match.
+ICONTAINS_WEIGHTS = {'place_name': 3, 'state': 2, 'district': 2, 'description': 1}
+
+POSTGRES_VECTOR = (
+    "to_tsvector('english', "
+    + " || ' ' || ".join(f"coalesce({TABLE}.{field}, '')" for field in SEARCH_FIELDS)
+    + ")"
+)
+
+
+def tokenize(query):
+    """Split a user query into lowercase word tokens safe for any engine."""
+    return re.findall(r'\w+', query.lower())[:MAX_TERMS]
+
+
+def search_destinations(queryset, query):
+    """
+    Return ``queryset`` narrowed to rows matching ``query``, annotated with
+    ``search_rank`` and ordered by it (best match first).
+
+    Uses the engine's full-text index when one exists and falls back to
+    ``icontains_search`` otherwise.
+    """
+    terms = tokenize(query)
+    if not terms:
+        return queryset.none()
+
+    connection = connections[queryset.db]
+    if connection.vendor == 'mysql':
+        return _mysql_search(queryset, terms)
+    if connection.vendor == 'postgresql':
+        return _postgres_search(queryset, terms)
+    if connection.vendor == 'sqlite' and has_sqlite_fts(connection):
+        return _sqlite_search(queryset, terms)
+    return icontains_search(queryset, query)
+
+
+def icontains_search(queryset, query):
+    """Unindexed ``icontains`` search over SEARCH_FIELDS, ranked by field weight."""
+    query = query.strip()
+    condition = Q()
+    for field in SEARCH_FIELDS:
+        condition |= Q(**{f'{field}__icontains': query})
+
+    rank = Value(0)
+    for field, weight in ICONTAINS_WEIGHTS.items():
+        rank += Case(
+            When(**{f'{field}__icontains': query}, then=Value(weight)),
+            default=Value(0),
+            output_field=IntegerField(),
+        )
+    return queryset.filter(condition).annotate(search_rank=rank).order_by('-search_rank', '-id')
+
+
+def _mysql_search(queryset, terms):
+    columns = ', '.join(f'{TABLE}.{field}' for field in SEARCH_FIELDS)
+    against = ' '.join(f'+{term}*' for term in terms)
+    match = RawSQL(
+        f'MATCH ({columns}) AGAINST (%s IN BOOLEAN MODE)',
+        [against],
+        output_field=FloatField(),
+    )
+    return (
+        queryset.annotate(search_rank=match)
+        .filter(search_rank__gt=0)
+        .order_by('-search_rank', '-id')
+    )
+
+
+def _postgres_search(queryset, terms):
+    tsquery = ' & '.join(f'{term}:*' for term in terms)
+    return (
+        queryset.extra(where=[f"{POSTGRES_VECTOR} @@ to_tsquery('english', %s)"], params=[tsquery])
+        .annotate(search_rank=RawSQL(
+            f"ts_rank({POSTGRES_VECTOR}, to_tsquery('english', %s))",
+            [tsquery],
+            output_field=FloatField(),
+        ))
+        .order_by('-search_rank', '-id')
+    )
+
+
+def _sqlite_search(queryset, terms):
+    match = ' '.join(f'"{term}"*' for term in terms)
+    # FTS5's ``rank`` is bm25(), where lower means more relevant. It is an
+    # annotation rather than an extra() select so callers can filter on it.
+    return (
+        queryset.extra(
+            tables=[FTS_NAME],
+            where=[f'{FTS_NAME}.rowid = {TABLE}.id', f'{FTS_NAME} MATCH %s'],
+            params=[match],
+        )
+        .annotate(search_rank=RawSQL(f'-{FTS_NAME}.rank', [], output_field=FloatField()))
+        .order_by('-search_rank', '-id')
+    )
+
+
+def has_sqlite_fts(connection):
+    """Whether the FTS5 table exists on this SQLite connection (cached per connection)."""
+    cached = getattr(connection, '_destinations_has_fts', None)
+    if cached is None:
+        cached = FTS_NAME in connection.introspection.table_names()
+        connection._destinations_has_fts = cached
+    return cached
+
+
+def sqlite_supports_fts5(connection):
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA compile_options')
+        return any(row[0] == 'ENABLE_FTS5' for row in cursor.fetchall())
+
+
+def install_search_index(schema_editor):
+    """Create the full-text index for the current engine (used by migrations)."""
+    connection = schema_editor.connection
+    columns = ', '.join(SEARCH_FIELDS)
+
+    if connection.vendor == 'mysql':
+        schema_editor.execute(f'CREATE FULLTEXT INDEX {FTS_NAME} ON {TABLE} ({columns})')
+    elif connection.vendor == 'postgresql':
+        schema_editor.execute(f'CREATE INDEX {FTS_NAME} ON {TABLE} USING GIN ({POSTGRES_VECTOR})')
+    elif connection.vendor == 'sqlite' and sqlite_supports_fts5(connection):
+        new_values = ', '.join(f'new.{field}' for field in SEARCH_FIELDS)
+        old_values = ', '.join(f'old.{field}' for field in SEARCH_FIELDS)
+        schema_editor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_NAME} USING fts5({columns}, "
+            f"content='{TABLE}', content_rowid='id')"
+        )
+        # Triggers keep the external-content table in sync, including for
+        # bulk_create() and queryset.update(), which bypass model signals.
+        # SQLite drops them whenever Django rebuilds the table, so migrations
+        # that alter destinations_destination must call this again;
+        # check_search_triggers() reports it when one didn't.
+        schema_editor.execute(
+            f'CREATE TRIGGER IF NOT EXISTS {FTS_NAME}_ai AFTER INSERT ON {TABLE} BEGIN '
+            f'INSERT INTO {FTS_NAME}(rowid, {columns}) VALUES (new.id, {new_values}); END'
+        )
+        schema_editor.execute(
+            f'CREATE TRIGGER IF NOT EXISTS {FTS_NAME}_ad AFTER DELETE ON {TABLE} BEGIN '
+            f"INSERT INTO {FTS_NAME}({FTS_NAME}, rowid, {columns}) VALUES ('delete', old.id, {old_values}); END"
+        )
+        schema_editor.execute(
+            f'CREATE TRIGGER IF NOT EXISTS {FTS_NAME}_au AFTER UPDATE ON {TABLE} BEGIN '
+            f"INSERT INTO {FTS_NAME}({FTS_NAME}, rowid, {columns}) VALUES ('delete', old.id, {old_values}); "
+            f'INSERT INTO {FTS_NAME}(rowid, {columns}) VALUES (new.id, {new_values}); END'
+        )
+        schema_editor.execute(f"INSERT INTO {FTS_NAME}({FTS_NAME}) VALUES ('rebuild')")
+        connection._destinations_has_fts = True
+
+
+def remove_search_index(schema_editor):
+    connection = schema_editor.connection
+
+    if connection.vendor == 'mysql':
+        schema_editor.execute(f'DROP INDEX {FTS_NAME} ON {TABLE}')
+    elif connection.vendor == 'postgresql':
+        schema_editor.execute(f'DROP INDEX IF EXISTS {FTS_NAME}')
+    elif connection.vendor == 'sqlite':
+        for trigger in SQLITE_TRIGGERS:
+            schema_editor.execute(f'DROP TRIGGER IF EXISTS {trigger}')
+        schema_editor.execute(f'DROP TABLE IF EXISTS {FTS_NAME}')
+        connection._destinations_has_fts = False
+
+
+def missing_sqlite_triggers(connection):
+    """Sync triggers absent from a SQLite database that has the FTS5 table."""
+    if FTS_NAME not in connection.introspection.table_names():
+        return []
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'trigger' AND tbl_name = %s", [TABLE])
+        present = {row[0] for row in cursor.fetchall()}
+    return [trigger for trigger in SQLITE_TRIGGERS if trigger not in present]
+
+
+def check_search_triggers(app_configs=None, databases=None, **kwargs):
+    """
+    Database system check (run by migrate and ``check --database``): without
+    its triggers the FTS5 table silently stops seeing new and changed rows.
+    """
+    errors = []
+    for alias in databases or ():
+        connection = connections[alias]
+        if connection.vendor != 'sqlite':
+            continue
+        missing = missing_sqlite_triggers(connection)
+        if missing:
+            errors.append(checks.Error(
+                f'The full-text search triggers {", ".join(missing)} are missing from database "{alias}".',
+                hint=(
+                    f'A migration probably rebuilt {TABLE}. Add a RunPython operation after it that '
+                    'calls destinations.search.install_search_index(schema_editor).'
+                ),
+                id='destinations.E001',
+            ))
+    return errors
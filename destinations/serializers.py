@@ -12,4 +12,92 @@ class DestinationSerializer(serializers.ModelSerializer):
     class Meta:
         model = Destination
         fields = ['id', 'place_name', 'slug', 'weather', 'state', 'district', 
-                 'google_map_link', 'description', 'images', 'created_at', 'updated_at']
\ No newline at end of file
+                 'google_map_link', 'latitude', 'longitude', 'description', 'images', 'created_at', 'updated_at']
+        extra_kwargs = {
+            'latitude': {'min_value': -90, 'max_value': 90},
+            'longitude': {'min_value': -180, 'max_value': 180},
+        }
+
+class DestinationListSerializer(serializers.ModelSerializer):
+    """Summary representation for list responses: no nested images."""
+    cover_thumbnail = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Destination
+        fields = ['id', 'place_name', 'slug', 'weather', 'state', 'district',
+                 'cover_thumbnail', 'updated_at']
+
+    def get_cover_thumbnail(self, obj):
+        # Reads the prefetched images, so this costs no extra query.
+        images = obj.images.all()
+        if not images:
+            return None
+        url = images[0].display_url
+        request = self.context.get('request')
+        return request.build_absolute_uri(url) if request else url
+
+# Most results the nearby action returns
+NEARBY_MAX_RESULTS = 100
+
+class NearbyQuerySerializer(serializers.Serializer):
+    """
+    Query parameters of the nearby action: a point (``lat``, ``lng``) with
+    an optional ``radius_km``, or a ``bbox`` of south,west,north,east.
+    """
+    lat = serializers.FloatField(min_value=-90, max_value=90, required=False)
+    lng = serializers.FloatField(min_value=-180, max_value=180, required=False)
+    radius_km = serializers.FloatField(min_value=0, required=False)
+    bbox = serializers.CharField(required=False)
+    k = serializers.IntegerField(min_value=1, max_value=NEARBY_MAX_RESULTS, default=10)
+
+    def validate_bbox(self, value):
+        try:
+            south, west, north, east = (float(part) for part in value.split(','))
+        except ValueError:
+            raise serializers.ValidationError('Expected south,west,north,east.')
+        if not (-90 <= south <= north <= 90 and -180 <= west <= 180 and -180 <= east <= 180):
+            raise serializers.ValidationError('Coordinates out of range.')
+        return south, west, north, east
+
+    def validate(self, attrs):
+        if 'bbox' not in attrs and ('lat' not in attrs or 'lng' not in attrs):
+            raise serializers.ValidationError('Give lat and lng, or bbox.')
+        return attrs
+
+# Largest batch accepted by the bulk endpoint
+BULK_MAX_ITEMS = 1000
+
+class DestinationBulkListSerializer(serializers.ListSerializer):
+    """
+    Validates every item on its own, so one bad row doesn't reject the
+    whole batch. ``validated_data`` holds ``(index, attrs)`` pairs for the
+    valid items and ``item_errors`` maps the index of each invalid one to
+    its errors.
+    """
+
+    def to_internal_value(self, data):
+        if not isinstance(data, list):
+            raise serializers.ValidationError({'non_field_errors': ['Expected a list of items.']})
+        if not data:
+            raise serializers.ValidationError({'non_field_errors': ['Expected at least one item.']})
+        if len(data) > BULK_MAX_ITEMS:
+            raise serializers.ValidationError({'non_field_errors': [f'At most {BULK_MAX_ITEMS} items per request.']})
+
+        self.item_errors = {}
+        valid = []
+        for index, item in enumerate(data):
+            try:
+                valid.append((index, self.child.run_validation(item)))
+            except serializers.ValidationError as exc:
+                self.item_errors[index] = exc.detail
+        return valid
+
+class DestinationBulkSerializer(DestinationSerializer):
+    """
+    DestinationSerializer without the per-row slug uniqueness query: the
+    bulk endpoint checks and allocates slugs for the whole batch at once.
+    """
+    slug = serializers.SlugField(max_length=200, required=False, allow_blank=True)
+
+    class Meta(DestinationSerializer.Meta):
+        list_serializer_class = DestinationBulkListSerializer
@@ -0,0 +1,51 @@
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import cache, facets, geo
+from .middleware import install_query_counter
+from .models import Destination, DestinationImage
+
+
+@receiver(post_save, sender=Destination)
+@receiver(post_delete, sender=Destination)
+def invalidate_destination_cache(sender, instance, **kwargs):
+    # A rename also clears whatever is still cached under the old slug.
+    loaded_slug = getattr(instance, '_loaded_values', {}).get('slug')
+    cache.invalidate_destination(instance.slug, loaded_slug)
+
+
+@receiver(post_save, sender=Destination)
+def update_facets_on_save(sender, instance, created, update_fields=None, **kwargs):
+    if update_fields is not None and not set(update_fields) & set(facets.FACET_FIELDS):
+        return
+    if created:
+        facets.record_changes([(None, facets.facet_values(instance))])
+        return
+    old = facets.facet_values(instance, loaded=True)
+    if old is None:
+        # Saved without being loaded first, so the old values are unknown
+        facets.invalidate()
+    else:
+        facets.record_changes([(old, facets.facet_values(instance))])
+
+
+@receiver(post_delete, sender=Destination)
+def update_facets_on_delete(sender, instance, **kwargs):
+    old = facets.facet_values(instance, loaded=True) or facets.facet_values(instance)
+    facets.record_changes([(old, None)])
+
+
+@receiver(post_delete, sender=Destination)
+def record_geo_deletion(sender, instance, **kwargs):
+    geo.record_deletions([instance.pk])
+
+
+@receiver(post_save, sender=DestinationImage)
+@receiver(post_delete, sender=DestinationImage)
+def touch_destination(sender, instance, **kwargs):
+    """Bump the parent's updated_at so its validators cover image changes too."""
+    Destination.objects.filter(pk=instance.destination_id).touch()
+
+
+connection_created.connect(install_query_counter, dispatch_uid='destinations_query_counter')
@@ -0,0 +1,123 @@
+"""
+Unique slug allocation for destinations.
+
+Slugs are allocated for a whole batch of rows at once: one query finds
+every existing slug that starts with one of the batch's bases, and
+clashes are resolved in memory by appending ``-2``, ``-3``, ... Both
+``Destination.save()`` and the bulk paths (importer, bulk API) go through
+here, so rows created with ``bulk_create`` get the same slugs a ``save()``
+would have given them.
+"""
+from django.apps import apps
+from django.conf import settings
+from django.db.models import Q
+from django.utils.text import slugify
+
+try:
+    from unidecode import unidecode
+except ImportError:
+    unidecode = None
+
+SLUG_MAX_LENGTH = 200
+# Room left after the base for a "-<n>" suffix
+SUFFIX_RESERVE = 10
+# Used when a name has nothing slugify() can keep
+FALLBACK_SLUG = 'destination'
+# Bases looked up per query; keeps the OR'd prefix filter well inside
+# SQLite's expression depth limit on very large batches.
+LOOKUP_BATCH = 250
+
+SLUG_TAKEN = 'destination with this slug already exists.'
+
+
+def transliteration_enabled():
+    return getattr(settings, 'DESTINATION_SLUG_TRANSLITERATE', True)
+
+
+def slug_base(text):
+    """
+    The slug a name would get if it were free. Non-ASCII names are
+    transliterated first when ``unidecode`` is installed, so "Ōmihachiman"
+    and "தஞ்சாவூர்" get readable ASCII slugs instead of losing characters.
+    """
+    text = text or ''
+    if unidecode is not None and transliteration_enabled() and not text.isascii():
+        text = unidecode(text)
+    return slugify(text)[:SLUG_MAX_LENGTH - SUFFIX_RESERVE].strip('-') or FALLBACK_SLUG
+
+
+def existing_slugs(bases, explicit=(), queryset=None):
+    """slug -> pk for every stored slug equal to or suffixed from one of ``bases``."""
+    if queryset is None:
+        queryset = apps.get_model('destinations', 'Destination')._base_manager.all()
+    taken = {}
+    bases = sorted(set(bases))
+    explicit = sorted(set(explicit))
+    for start in range(0, max(len(bases), 1), LOOKUP_BATCH):
+        query = Q()
+        chunk = bases[start:start + LOOKUP_BATCH]
+        exact = chunk + (explicit if start == 0 else [])
+        if exact:
+            query |= Q(slug__in=exact)
+        for base in chunk:
+            query |= Q(slug__startswith=f'{base}-')
+        if query:
+            taken.update(queryset.filter(query).values_list('slug', 'pk'))
+    return taken
+
+
+def allocate_slugs(rows, reserved=(), queryset=None):
+    """
+    Pick a unique slug for each ``(key, pk, slug, name)`` row.
+
+    Rows with an explicit slug keep it if it is free or already belongs to
+    ``pk``; otherwise they get an error. Rows with a blank slug get
+    ``slug_base(name)``, suffixed with the lowest free number when taken.
+    ``reserved`` slugs are treated as taken (e.g. explicit slugs elsewhere
+    in the same import). Returns ``(slugs, errors)`` dicts keyed like the
+    rows.
+    """
+    rows = list(rows)
+    bases = {key: slug_base(name) for key, _, slug, name in rows if not slug}
+    taken = existing_slugs(bases.values(), [slug for _, _, slug, _ in rows if slug], queryset)
+
+    slugs, errors = {}, {}
+    claimed = set(reserved)
+    # Explicit slugs first, so generated ones never steal them
+    for key, pk, slug, _ in rows:
+        if not slug:
+            continue
+        if slug in claimed or taken.get(slug, pk) != pk:
+            errors[key] = {'slug': [SLUG_TAKEN]}
+        else:
+            slugs[key] = slug
+            claimed.add(slug)
+
+    next_suffix = {}
+    for key, pk, slug, _ in rows:
+        if slug:
+            continue
+        base = bases[key]
+        candidate = base
+        suffix = next_suffix.get(base, 2)
+        while candidate in claimed or taken.get(candidate, pk) != pk:
+            candidate = f'{base}-{suffix}'
+            suffix += 1
+        if candidate != base:
+            # Later rows with the same base carry on from here
+            next_suffix[base] = suffix
+        slugs[key] = candidate
+        claimed.add(candidate)
+    return slugs, errors
+
+
+def assign_slugs(destinations, reserved=(), queryset=None):
+    """Fill in the blank slugs of unsaved/loaded Destination instances, in place."""
+    pending = [obj for obj in destinations if not obj.slug]
+    if not pending:
+        return
+    slugs, _ = allocate_slugs(
+        ((i, obj.pk, '', obj.place_name) for i, obj in enumerate(pending)), reserved, queryset
+    )
+    for i, obj in enumerate(pending):
+        obj.slug = slugs[i]
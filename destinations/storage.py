@@ -0,0 +1,125 @@
+import hashlib
+import os
+
+from django.apps import apps
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage, Storage, storages
+from django.db.models import Q
+
+# Content-addressed files live under cas/<first two hex digits>/<sha256>.<ext>
+CONTENT_PREFIX = 'cas'
+
+
+def is_enabled():
+    return getattr(settings, 'DESTINATION_CONTENT_ADDRESSED_MEDIA', False)
+
+
+def content_hash(content):
+    """SHA-256 hex digest of a File, read in chunks."""
+    digest = hashlib.sha256()
+    for chunk in content.chunks():
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def content_name(digest, filename):
+    ext = os.path.splitext(filename)[1].lower()
+    return f'{CONTENT_PREFIX}/{digest[:2]}/{digest}{ext}'
+
+
+def is_content_name(name):
+    return bool(name) and name.startswith(f'{CONTENT_PREFIX}/')
+
+
+def is_referenced(name):
+    """Whether any image, thumbnail or derivative row still points at ``name``."""
+    DestinationImage = apps.get_model('destinations', 'DestinationImage')
+    ImageDerivative = apps.get_model('destinations', 'ImageDerivative')
+    return (
+        DestinationImage.objects.filter(Q(image=name) | Q(thumbnail=name)).exists()
+        or ImageDerivative.objects.filter(file=name).exists()
+    )
+
+
+class ContentAddressedStorage(Storage):
+    """
+    Media storage that, when DESTINATION_CONTENT_ADDRESSED_MEDIA is on, names
+    files by the hash of their bytes. Identical uploads share one file, which
+    is written once and only deleted when no row references it any more.
+
+    Files are kept by STORAGES['default'], whatever backend that is; with the
+    setting off this storage behaves exactly like it.
+    """
+
+    @property
+    def backend(self):
+        return storages['default']
+
+    def is_local(self):
+        """Whether the backend keeps files on this machine's filesystem."""
+        return isinstance(self.backend, FileSystemStorage)
+
+    def save(self, name, content, max_length=None):
+        if not is_enabled():
+            return self.backend.save(name, content, max_length)
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        name = content_name(content_hash(content), name)
+        if self.exists(name):
+            return name
+        return self.backend.save(name, content, max_length)
+
+    def delete(self, name):
+        # Shared files are reference-counted by the rows that point at them.
+        # Callers delete rows before their files, so any remaining reference
+        # belongs to someone else.
+        if is_content_name(name) and is_referenced(name):
+            return
+        self.backend.delete(name)
+
+    def open(self, name, mode='rb'):
+        return self.backend.open(name, mode)
+
+    def exists(self, name):
+        return self.backend.exists(name)
+
+    def listdir(self, path):
+        return self.backend.listdir(path)
+
+    def size(self, name):
+        return self.backend.size(name)
+
+    def url(self, name):
+        return self.backend.url(name)
+
+    def path(self, name):
+        return self.backend.path(name)
+
+    def get_valid_name(self, name):
+        return self.backend.get_valid_name(name)
+
+    def get_alternative_name(self, file_root, file_ext):
+        return self.backend.get_alternative_name(file_root, file_ext)
+
+    def get_available_name(self, name, max_length=None):
+        return self.backend.get_available_name(name, max_length)
+
+    def generate_filename(self, filename):
+        return self.backend.generate_filename(filename)
+
+    def get_accessed_time(self, name):
+        return self.backend.get_accessed_time(name)
+
+    def get_created_time(self, name):
+        return self.backend.get_created_time(name)
+
+    def get_modified_time(self, name):
+        return self.backend.get_modified_time(name)
+
+
+media_storage = ContentAddressedStorage()
+
+
+def get_media_storage():
+    return media_storage
@@ -0,0 +1,192 @@
+"""
+Deterministic synthetic destinations (and image files) for benchmarks and
+load testing.
+
+Rows are built in memory and written with bulk_create in batches, one
+transaction per batch, so millions of destinations take minutes rather
+than the hours a save() per row would. The same seed always produces the
+same rows.
+"""
+import random
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.db.models import Max
+from PIL import Image, ImageDraw
+
+from . import cache, facets
+from .models import Destination, DestinationImage, ImageJob
+from .slugs import allocate_slugs, slug_base
+
+# State -> districts with a rough (latitude, longitude) centre
+STATES = {
+    'Kerala': {'Idukki': (9.85, 76.97), 'Alappuzha': (9.50, 76.34), 'Wayanad': (11.69, 76.13), 'Ernakulam': (9.98, 76.30)},
+    'Goa': {'North Goa': (15.53, 73.83), 'South Goa': (15.20, 74.05)},
+    'Rajasthan': {'Jaipur': (26.91, 75.79), 'Udaipur': (24.59, 73.71), 'Jaisalmer': (26.92, 70.91), 'Jodhpur': (26.24, 73.02)},
+    'Tamil Nadu': {'Nilgiris': (11.41, 76.70), 'Madurai': (9.93, 78.12), 'Kanyakumari': (8.08, 77.55), 'Thanjavur': (10.79, 79.14)},
+    'Himachal Pradesh': {'Kullu': (31.96, 77.11), 'Shimla': (31.10, 77.17), 'Kangra': (32.10, 76.27), 'Lahaul and Spiti': (32.57, 77.03)},
+    'Meghalaya': {'East Khasi Hills': (25.57, 91.88), 'West Jaintia Hills': (25.45, 92.20)},
+    'Uttar Pradesh': {'Agra': (27.18, 78.04), 'Varanasi': (25.32, 82.97), 'Lucknow': (26.85, 80.95)},
+    'Karnataka': {'Mysuru': (12.30, 76.64), 'Kodagu': (12.34, 75.81), 'Vijayanagara': (15.34, 76.46)},
+    'Maharashtra': {'Aurangabad': (19.88, 75.34), 'Raigad': (18.52, 73.18), 'Satara': (17.68, 74.02)},
+    'West Bengal': {'Darjeeling': (27.04, 88.26), 'South 24 Parganas': (21.95, 88.72)},
+    'Uttarakhand': {'Dehradun': (30.32, 78.03), 'Nainital': (29.38, 79.46), 'Chamoli': (30.41, 79.32)},
+    'Ladakh': {'Leh': (34.15, 77.58), 'Kargil': (34.56, 76.13)},
+    'Punjab': {'Amritsar': (31.63, 74.87)},
+    'Odisha': {'Puri': (19.81, 85.83), 'Khordha': (20.18, 85.62)},
+    'Sikkim': {'Gangtok': (27.33, 88.61)},
+    'Assam': {'Golaghat': (26.52, 93.96), 'Kamrup': (26.14, 91.77)},
+}
+WEATHER = ['Sunny', 'Pleasant', 'Humid', 'Rainy', 'Cloudy', 'Cool', 'Cold', 'Snowy']
+ADJECTIVES = ['Old', 'Royal', 'Hidden', 'Golden', 'Misty', 'Silver', 'Sacred', 'Green', 'Blue', 'Sunset', 'Lotus', 'Marble']
+FEATURES = [
+    'Fort', 'Palace', 'Temple', 'Beach', 'Lake', 'Falls', 'Hills', 'Valley', 'Caves', 'Gardens',
+    'Sanctuary', 'Backwaters', 'Monastery', 'Step Well', 'Ghats', 'Market', 'Dunes', 'Viewpoint',
+]
+SENTENCES = [
+    'Best visited between October and March.',
+    'A short drive from the district headquarters.',
+    'Known for its {adjective} {feature_lower} and local cuisine.',
+    'Popular with photographers at sunrise.',
+    'Guided tours run through the day.',
+    'Home to a festival that draws visitors from across {state}.',
+    'Trekking trails lead to panoramic views of the {district} region.',
+    'Boating is available on weekends.',
+    'The site has been restored and is well maintained.',
+    'Local guides share stories of its history.',
+]
+
+
+def make_image(rng, size=(320, 240), fmt='JPEG'):
+    """A small procedurally drawn picture: a two-colour gradient with a few shapes."""
+    width, height = size
+    top = tuple(rng.randrange(256) for _ in range(3))
+    bottom = tuple(rng.randrange(256) for _ in range(3))
+    gradient = Image.linear_gradient('L').resize(size)
+    image = Image.composite(Image.new('RGB', size, bottom), Image.new('RGB', size, top), gradient)
+    draw = ImageDraw.Draw(image)
+    for _ in range(rng.randint(2, 6)):
+        x, y = rng.randrange(width), rng.randrange(height)
+        w, h = rng.randint(10, width // 2), rng.randint(10, height // 2)
+        colour = tuple(rng.randrange(256) for _ in range(3))
+        shape = draw.ellipse if rng.random() < 0.5 else draw.rectangle
+        shape((x, y, x + w, y + h), fill=colour)
+    buffer = BytesIO()
+    options = {'quality': 80} if fmt == 'JPEG' else {}
+    image.save(buffer, format=fmt, **options)
+    return buffer.getvalue()
+
+
+class Generator:
+    """Builds unsaved Destination instances from a seeded random stream."""
+
+    def __init__(self, seed=42):
+        self.rng = random.Random(seed)
+        self.states = sorted(STATES)
+        self.districts = {state: sorted(districts) for state, districts in STATES.items()}
+        # Names repeat a lot (a few thousand combinations), so slugify each once
+        self.slug_bases = {}
+
+    def destination(self, number):
+        rng = self.rng
+        state = rng.choice(self.states)
+        district = rng.choice(self.districts[state])
+        lat, lng = STATES[state][district]
+        lat, lng = round(lat + rng.uniform(-0.3, 0.3), 5), round(lng + rng.uniform(-0.3, 0.3), 5)
+        adjective, feature = rng.choice(ADJECTIVES), rng.choice(FEATURES)
+        place_name = f'{adjective} {feature} of {district}' if rng.random() < 0.3 else f'{district} {adjective} {feature}'
+        context = {
+            'adjective': adjective.lower(), 'feature_lower': feature.lower(),
+            'state': state, 'district': district,
+        }
+        base = self.slug_bases.get(place_name)
+        if base is None:
+            base = self.slug_bases[place_name] = slug_base(place_name)
+        description = ' '.join(sentence.format(**context) for sentence in rng.sample(SENTENCES, rng.randint(2, 5)))
+        return Destination(
+            place_name=place_name,
+            # Numbered so that allocate_batch_slugs() rarely has to pick another
+            slug=f'{base}-{number}',
+            weather=rng.choice(WEATHER),
+            state=state,
+            district=district,
+            latitude=lat,
+            longitude=lng,
+            google_map_link=f'https://www.google.com/maps/@{lat},{lng},14z',
+            description=description,
+        )
+
+
+def allocate_batch_slugs(batch):
+    """
+    Run a batch's numbered slugs through allocate_slugs(): free ones are kept,
+    and any already taken (by rows from elsewhere) get the name's next free
+    suffix instead. Two queries at most per batch.
+    """
+    slugs, taken = allocate_slugs((i, None, destination.slug, destination.place_name) for i, destination in enumerate(batch))
+    if taken:
+        retried, _ = allocate_slugs(
+            ((i, None, '', batch[i].place_name) for i in taken), reserved=set(slugs.values())
+        )
+        slugs.update(retried)
+    for i, destination in enumerate(batch):
+        destination.slug = slugs[i]
+
+
+def create_destinations(count, images=0, seed=42, batch_size=5000, image_pool=16, image_size=(320, 240),
+                        image_format='JPEG', progress=None):
+    """
+    Insert ``count`` synthetic destinations with ``images`` image rows each.
+
+    Image files are drawn once into a pool of ``image_pool`` pictures and
+    written per row through the field's storage, so content-addressed
+    storage stores each picture once. Each image gets a pending ImageJob,
+    as an upload would. ``progress(created)`` is called after each batch.
+    Returns the number of destinations created.
+    """
+    generator = Generator(seed)
+    # Numbered past every existing id, so reruns seldom collide
+    start = (Destination.objects.aggregate(last=Max('pk'))['last'] or 0) + 1
+    extension = 'jpg' if image_format == 'JPEG' else image_format.lower()
+    # A separate stream, so the rows for a seed don't depend on --images
+    image_rng = random.Random(f'{seed}-images')
+    pool = [make_image(image_rng, image_size, image_format) for _ in range(image_pool if images else 0)]
+    storage = DestinationImage._meta.get_field('image').storage
+
+    created = 0
+    while created < count:
+        size = min(batch_size, count - created)
+        batch = [generator.destination(start + created + i) for i in range(size)]
+        allocate_batch_slugs(batch)
+        with transaction.atomic():
+            Destination.objects.bulk_create(batch)
+            if images:
+                if any(destination.pk is None for destination in batch):
+                    # Backends that can't return ids from a bulk insert (MySQL)
+                    ids = dict(Destination.objects.filter(
+                        slug__in=[destination.slug for destination in batch]
+                    ).values_list('slug', 'pk'))
+                    for destination in batch:
+                        destination.pk = ids[destination.slug]
+                rows = []
+                for destination in batch:
+                    for n in range(images):
+                        data = pool[image_rng.randrange(len(pool))]
+                        name = storage.save(
+                            f'destinations/{destination.pk}/synthetic_{n}.{extension}', ContentFile(data)
+                        )
+                        rows.append(DestinationImage(destination=destination, image=name, caption=f'Photo {n + 1}'))
+                DestinationImage.objects.bulk_create(rows, batch_size=batch_size)
+                image_ids = [image.pk for image in rows]
+                if None in image_ids:
+                    image_ids = DestinationImage.objects.filter(destination__in=batch).values_list('pk', flat=True)
+                ImageJob.objects.bulk_create([ImageJob(image_id=pk) for pk in image_ids], batch_size=batch_size)
+        created += size
+        if progress:
+            progress(created)
+
+    # bulk_create skips the signals that normally keep these current
+    cache.invalidate_destination()
+    facets.invalidate()
+    return created
@@ -1,13 +1,57 @@
 from django import template
+from django.utils.html import format_html, format_html_join
+
+from ..imaging import FORMATS, RESPONSIVE_FORMATS
 
 register = template.Library()
 
+# Both filters go through ``images.all()`` so they are served from the
+# ``prefetch_related('images')`` cache set up by the views instead of issuing
+# one query per call.
+
 @register.filter
 def first_image(destination):
     """Return the first image of a destination or None."""
-    return destination.images.first()
+    images = destination.images.all()
+    return images[0] if images else None
 
 @register.filter
 def remaining_images(destination):
     """Return all images except the first one."""
-    return destination.images.all()[1:]
\ No newline at end of file
+    return list(destination.images.all())[1:]
+
+@register.simple_tag
+def responsive_image(image, sizes='100vw', fallback='display_url', **attrs):
+    """
+    Render ``image`` as a <picture> with one srcset <source> per responsive
+    format (AVIF/WebP) and a plain <img> fallback.
+
+    Reads ``image.derivatives.all()``, so views should fetch images with
+    ``with_images(derivatives=True)``. ``fallback`` names the attribute used
+    for the <img> src: ``display_url`` (the thumbnail) or ``original``.
+    """
+    widths = {}
+    for derivative in image.derivatives.all():
+        # Only width-constrained renditions belong in a w-descriptor srcset;
+        # small originals yield the same width for several specs.
+        if derivative.max_height == 0:
+            widths.setdefault(derivative.format, {}).setdefault(derivative.width, derivative.file.url)
+
+    sources = format_html_join(
+        '',
+        '<source type="{}" srcset="{}" sizes="{}">',
+        (
+            (
+                FORMATS[fmt]['mime_type'],
+                ', '.join(f'{url} {width}w' for width, url in sorted(widths[fmt].items())),
+                sizes,
+            )
+            for fmt in RESPONSIVE_FORMATS if fmt in widths
+        ),
+    )
+    src = image.image.url if fallback == 'original' else image.display_url
+    attrs.setdefault('loading', 'lazy')
+    img = format_html('<img src="{}"{}>', src, format_html_join('', ' {}="{}"', sorted(attrs.items())))
+    # display: contents keeps the existing CSS (h-100, object-fit) applying to
+    # the <img> as if the <picture> wrapper wasn't there.
+    return format_html('<picture style="display: contents;">{}{}</picture>', sources, img)
@@ -1,3 +1,1258 @@
-from django.test import TestCase
+import gzip
+import json
+import os
+import shutil
+import tempfile
+from io import BytesIO, StringIO
 
-# Create your tests here.
+from unittest import mock, skipUnless
+
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.db.models import Q
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from PIL import Image
+
+from . import facets, geo, metrics, profiling, search
+from .imaging import responsive_specs
+from .models import Destination, DestinationImage, ImageDerivative, ImageJob
+from .search import icontains_search, search_destinations
+from .serializers import DestinationListSerializer, DestinationSerializer
+from .slugs import allocate_slugs, slug_base
+
+MEDIA_ROOT = tempfile.mkdtemp()
+
+
+def make_image_file(name='photo.png', size=(40, 30)):
+    buffer = BytesIO()
+    Image.new('RGB', size, (30, 120, 200)).save(buffer, format='PNG')
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/png')
+
+
+def make_destination(name, images=0, **fields):
+    defaults = {'weather': 'Sunny', 'state': 'Kerala', 'district': 'Idukki'}
+    defaults.update(fields)
+    destination = Destination.objects.create(place_name=name, **defaults)
+    for i in range(images):
+        DestinationImage.objects.create(destination=destination, image=make_image_file(f'{i}.png'))
+    return destination
+
+
+class FilterTests(TestCase):
+    def setUp(self):
+        for i in range(12):
+            make_destination(f'Goa Beach {i}', state='Goa', district='North Goa', weather='Sunny')
+        self.rainy = make_destination('Panaji', state='Goa', district='North Goa', weather='Rainy')
+        self.kerala = make_destination('Munnar', state='Kerala', district='Idukki', weather='Sunny')
+
+    def test_list_view_filters_and_keeps_filters_in_page_links(self):
+        response = self.client.get('/destinations/', {'state': 'Goa', 'weather': 'Sunny'})
+        page = response.context['page_obj']
+        self.assertEqual(page.paginator.count, 12)
+        self.assertTrue(all(d.state == 'Goa' and d.weather == 'Sunny' for d in page.object_list))
+        self.assertEqual(response.context['filter_querystring'], 'state=Goa&weather=Sunny')
+        self.assertContains(response, 'href="?state=Goa&amp;weather=Sunny&page=2"')
+
+        response = self.client.get('/destinations/', {'district': 'Idukki'})
+        self.assertEqual(list(response.context['object_list']), [self.kerala])
+        response = self.client.get('/destinations/', {'state': 'Atlantis'})
+        self.assertEqual(response.context['page_obj'].paginator.count, 0)
+
+    def test_api_filters_and_keeps_filters_in_cursor_links(self):
+        page = self.client.get('/destinations/api/destinations/', {'weather': 'Rainy'}).json()
+        self.assertEqual([item['slug'] for item in page['results']], [self.rainy.slug])
+        page = self.client.get('/destinations/api/destinations/', {'weather': 'Snowy'}).json()
+        self.assertEqual(page['results'], [])
+
+        page = self.client.get('/destinations/api/destinations/', {'state': 'Goa', 'page_size': 5}).json()
+        self.assertIn('state=Goa', page['next'])
+        slugs = [item['slug'] for item in page['results']]
+        while page['next']:
+            page = self.client.get(page['next']).json()
+            slugs += [item['slug'] for item in page['results']]
+        self.assertEqual(len(slugs), 13)
+        self.assertNotIn(self.kerala.slug, slugs)
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        self.fort = make_destination('Bekal Fort', description='A seaside fort.')
+        self.beach = make_destination(
+            'Bekal Beach', description='Sand below the old fort walls, busy with fishing boats at dawn.'
+        )
+        self.tea = make_destination('Munnar', description='Tea gardens in the hills.')
+
+    @skipUnless(connection.vendor == 'sqlite', 'SQLite FTS5 search')
+    def test_sqlite_fts_ranks_and_matches_prefixes(self):
+        self.assertTrue(search.has_sqlite_fts(connection))
+        results = list(search_destinations(Destination.objects.all(), 'fort'))
+        self.assertEqual(results, [self.fort, self.beach])
+        self.assertGreater(results[0].search_rank, results[1].search_rank)
+
+        self.assertEqual(set(search_destinations(Destination.objects.all(), 'bek fo')), {self.fort, self.beach})
+        self.assertEqual(list(search_destinations(Destination.objects.all(), 'gard')), [self.tea])
+        self.assertFalse(search_destinations(Destination.objects.all(), '!!!').exists())
+
+        # queryset.update() skips signals; the triggers keep the index current
+        Destination.objects.filter(pk=self.tea.pk).update(description='An old hill fort.')
+        self.assertIn(self.tea, search_destinations(Destination.objects.all(), 'fort'))
+
+    def test_icontains_fallback_ranks_by_field_weight(self):
+        with mock.patch('destinations.search.has_sqlite_fts', return_value=False):
+            results = list(search_destinations(Destination.objects.all(), 'fort'))
+        # Name and description (3 + 1) beat description only
+        self.assertEqual(results, [self.fort, self.beach])
+        self.assertEqual([r.search_rank for r in results], [4, 1])
+        # Equal weights fall back to the newest first
+        self.assertEqual(list(icontains_search(Destination.objects.all(), 'bekal')), [self.beach, self.fort])
+
+    def test_admin_list_view_and_api_use_ranked_search(self):
+        from django.contrib.auth.models import User
+        User.objects.create_superuser('admin', password='pw')
+        self.client.login(username='admin', password='pw')
+        response = self.client.get(reverse('admin:destinations_destination_changelist'), {'q': 'fort'})
+        self.assertEqual(list(response.context['cl'].result_list), [self.fort, self.beach])
+        self.client.logout()
+
+        response = self.client.get('/destinations/', {'q': 'fort'})
+        self.assertEqual(list(response.context['object_list']), [self.fort, self.beach])
+
+        # Cursor pages follow search_rank, then id
+        slugs = []
+        url = '/destinations/api/destinations/?q=fort&page_size=1'
+        while url:
+            page = self.client.get(url).json()
+            slugs += [item['slug'] for item in page['results']]
+            url = page['next']
+        self.assertEqual(slugs, [self.fort.slug, self.beach.slug])
+
+    @skipUnless(connection.vendor == 'sqlite', 'SQLite FTS5 triggers')
+    def test_check_reports_missing_sync_triggers(self):
+        self.assertEqual(search.check_search_triggers(databases=['default']), [])
+        with connection.cursor() as cursor:
+            cursor.execute(f'DROP TRIGGER {search.FTS_NAME}_au')
+        (error,) = search.check_search_triggers(databases=['default'])
+        self.assertEqual(error.id, 'destinations.E001')
+        self.assertIn(f'{search.FTS_NAME}_au', error.msg)
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class QueryCountTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries)
+
+    def test_list_query_count_is_constant(self):
+        for i in range(2):
+            make_destination(f'Place {i}', images=1)
+        url = reverse('destinations:destination-list')
+        self.count_queries(url)
+        # Facet counts are kept current by the signals rather than recounted
+        make_destination('Place 2', images=1)
+        few = self.count_queries(url)
+
+        for i in range(3, 8):
+            make_destination(f'Place {i}', images=4)
+        self.assertEqual(self.count_queries(url), few)
+
+        # validators, count, page of destinations, prefetched images and
+        # derivatives, one grouped count per facet
+        cache.clear()
+        with self.assertNumQueries(8):
+            self.client.get(url)
+
+    def test_detail_query_count_is_constant(self):
+        destination = make_destination('Munnar', images=1)
+        url = reverse('destinations:destination-detail', args=[destination.slug])
+        few = self.count_queries(url)
+
+        for i in range(5):
+            DestinationImage.objects.create(destination=destination, image=make_image_file(f'x{i}.png'))
+        self.assertEqual(self.count_queries(url), few)
+
+        # validators, destination, prefetched images and derivatives
+        cache.clear()
+        with self.assertNumQueries(4):
+            response = self.client.get(url)
+        self.assertContains(response, 'More Images')
+
+    def test_api_list_query_count_is_constant(self):
+        for i in range(3):
+            make_destination(f'Place {i}', images=3)
+        url = '/destinations/api/destinations/'
+
+        # validators, page of destinations, prefetched images
+        with self.assertNumQueries(3):
+            response = self.client.get(url)
+        result = response.json()['results'][0]
+        self.assertNotIn('images', result)
+        self.assertTrue(result['cover_thumbnail'].startswith('http://testserver/media/'))
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.destination = make_destination('Varkala')
+
+    def test_api_retrieve_304_skips_serialization(self):
+        url = f'/destinations/api/destinations/{self.destination.slug}/'
+        etag = self.client.get(url, HTTP_ACCEPT='application/json').headers['ETag']
+
+        with mock.patch.object(DestinationSerializer, 'to_representation') as to_representation:
+            response = self.client.get(url, HTTP_ACCEPT='application/json', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        to_representation.assert_not_called()
+
+    def test_api_list_304_skips_serialization(self):
+        url = '/destinations/api/destinations/?state=Kerala'
+        etag = self.client.get(url, HTTP_ACCEPT='application/json').headers['ETag']
+
+        with mock.patch.object(DestinationListSerializer, 'to_representation') as to_representation:
+            with self.assertNumQueries(0):
+                response = self.client.get(url, HTTP_ACCEPT='application/json', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        to_representation.assert_not_called()
+
+    def test_image_change_invalidates_detail_etag(self):
+        url = reverse('destinations:destination-detail', args=[self.destination.slug])
+        response = self.client.get(url)
+        self.assertTrue(response.has_header('Last-Modified'))
+        etag = response.headers['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        DestinationImage.objects.create(destination=self.destination, image=make_image_file())
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_list_etag_changes_on_delete(self):
+        make_destination('Kovalam')
+        url = reverse('destinations:destination-list')
+        etag = self.client.get(url).headers['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        self.destination.delete()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class CacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.destination = make_destination('Alleppey', images=1)
+        self.detail_url = reverse('destinations:destination-detail', args=[self.destination.slug])
+        self.list_url = reverse('destinations:destination-list')
+
+    def test_warm_anonymous_pages_skip_the_database(self):
+        for url in (self.list_url, self.detail_url, '/destinations/api/destinations/'):
+            first = self.client.get(url)
+            with self.assertNumQueries(0):
+                second = self.client.get(url)
+            self.assertEqual(second.content, first.content)
+            self.assertEqual(second.headers['ETag'], first.headers['ETag'])
+
+    def test_logged_in_pages_are_not_cached(self):
+        from django.contrib.auth.models import User
+        User.objects.create_user('editor', password='pw')
+        self.client.login(username='editor', password='pw')
+        self.client.get(self.detail_url)
+        with CaptureQueriesContext(connection) as context:
+            self.client.get(self.detail_url)
+        self.assertTrue(context.captured_queries)
+
+    def test_save_invalidates_detail_and_lists(self):
+        self.client.get(self.list_url)
+        self.client.get(self.detail_url)
+
+        self.destination.place_name = 'Alappuzha Backwaters'
+        self.destination.save()
+        self.assertContains(self.client.get(self.detail_url), 'Alappuzha Backwaters')
+        make_destination('Kumarakom')
+        self.assertContains(self.client.get(self.list_url), 'Kumarakom')
+
+    def test_clear_cache_namespace(self):
+        self.client.get(self.detail_url)
+        call_command('clear_cache', namespace=['detail'], stdout=StringIO())
+        with CaptureQueriesContext(connection) as context:
+            self.client.get(self.detail_url)
+        self.assertTrue(context.captured_queries)
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class ImageJobTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_upload_queues_a_job_instead_of_rendering(self):
+        destination = make_destination('Hampi', images=1)
+        image = destination.images.get()
+        self.assertEqual(image.thumbnail_status, DestinationImage.THUMBNAIL_PENDING)
+        self.assertFalse(image.thumbnail)
+        self.assertEqual(image.display_url, image.image.url)
+        self.assertEqual(ImageJob.objects.filter(image=image, status=ImageJob.PENDING).count(), 1)
+
+        # Saving again (e.g. a caption edit) doesn't queue a duplicate
+        image.caption = 'Virupaksha Temple'
+        image.save()
+        self.assertEqual(ImageJob.objects.filter(image=image).count(), 1)
+
+    def test_worker_generates_thumbnails(self):
+        destination = make_destination('Badami', images=2)
+        call_command('process_image_jobs', once=True, workers=1, stdout=StringIO())
+
+        for image in destination.images.all():
+            self.assertEqual(image.thumbnail_status, DestinationImage.THUMBNAIL_READY)
+            self.assertEqual(image.display_url, image.thumbnail.url)
+            with Image.open(image.thumbnail.path) as thumbnail:
+                self.assertEqual(thumbnail.format, 'JPEG')
+        self.assertFalse(ImageJob.objects.exclude(status=ImageJob.DONE).exists())
+
+    def test_worker_renders_responsive_derivatives(self):
+        destination = Destination.objects.create(place_name='Gokarna', weather='Sunny', state='Karnataka', district='Uttara Kannada')
+        DestinationImage.objects.create(destination=destination, image=make_image_file('beach.png', size=(1000, 750)))
+        call_command('process_image_jobs', once=True, workers=1, stdout=StringIO())
+
+        widths = set(ImageDerivative.objects.filter(format='webp').values_list('width', flat=True))
+        # 1280 and 1920 would upscale, so they collapse onto the original width
+        self.assertEqual(widths, {320, 640, 960, 1000})
+
+        response = self.client.get(reverse('destinations:destination-detail', args=[destination.slug]))
+        self.assertContains(response, '<source type="image/webp" srcset="')
+        self.assertContains(response, ' 320w, ')
+        self.assertContains(response, ' 1000w"')
+
+    def test_worker_marks_unreadable_images_failed(self):
+        destination = make_destination('Aihole')
+        image = DestinationImage.objects.create(
+            destination=destination,
+            image=SimpleUploadedFile('broken.png', b'not an image', content_type='image/png'),
+        )
+        call_command('process_image_jobs', once=True, workers=1, max_attempts=2, stdout=StringIO())
+
+        image.refresh_from_db()
+        self.assertEqual(image.thumbnail_status, DestinationImage.THUMBNAIL_FAILED)
+        job = image.jobs.get()
+        self.assertEqual((job.status, job.attempts), (ImageJob.FAILED, 2))
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class GenerateThumbnailsTests(TestCase):
+    def setUp(self):
+        self.checkpoint = f'{MEDIA_ROOT}/thumbnails-checkpoint.json'
+        destination = make_destination('Coorg')
+        self.images = [
+            DestinationImage.objects.create(destination=destination, image=make_image_file(f'{i}.png', size=(800, 600)))
+            for i in range(3)
+        ]
+
+    def generate(self, *sizes, **options):
+        call_command(
+            'generate_thumbnails', *[f'--size={size}' for size in sizes],
+            workers=1, chunk_size=2, checkpoint=self.checkpoint, stdout=StringIO(), **options
+        )
+
+    def test_generates_each_size_once(self):
+        self.generate('300x200', '640x0')
+
+        self.assertEqual(ImageDerivative.objects.count(), 6)
+        sizes = set(ImageDerivative.objects.values_list('max_width', 'width', 'height'))
+        self.assertEqual(sizes, {(300, 267, 200), (640, 640, 480)})
+        self.assertFalse(os.path.exists(self.checkpoint))
+
+        self.generate('300x200', '640x0')
+        self.assertEqual(ImageDerivative.objects.count(), 6)
+
+    def test_default_run_rebuilds_display_thumbnails(self):
+        DestinationImage.objects.filter(pk=self.images[0].pk).update(thumbnail_status=DestinationImage.THUMBNAIL_FAILED)
+        self.generate()
+
+        for image in DestinationImage.objects.all():
+            self.assertEqual(image.thumbnail_status, DestinationImage.THUMBNAIL_READY)
+            self.assertEqual(image.display_url, image.thumbnail.url)
+            self.assertEqual(image.derivatives.count(), len(responsive_specs()))
+        self.assertFalse(ImageDerivative.objects.filter(max_width=300, max_height=200).exists())
+
+        # Ready thumbnails are left alone unless forced
+        with CaptureQueriesContext(connection) as context:
+            self.generate()
+        self.assertFalse(any('UPDATE' in query['sql'] for query in context.captured_queries))
+
+    def test_width_and_height_are_aliases_for_size(self):
+        self.generate(width=640, height=0)
+        self.assertEqual(set(ImageDerivative.objects.values_list('max_width', 'max_height', 'format')), {(640, 0, 'jpeg')})
+
+    def test_checkpoint_stops_before_failed_images(self):
+        with open(self.images[0].image.path, 'wb') as f:
+            f.write(b'not an image')
+        from .management.commands.generate_thumbnails import Command
+        with mock.patch.object(Command, 'write_checkpoint', autospec=True) as write_checkpoint:
+            self.generate()
+        self.assertEqual(write_checkpoint.call_args.args[3], self.images[0].pk - 1)
+        statuses = dict(DestinationImage.objects.values_list('pk', 'thumbnail_status'))
+        self.assertEqual(statuses[self.images[0].pk], DestinationImage.THUMBNAIL_FAILED)
+        self.assertEqual(statuses[self.images[1].pk], DestinationImage.THUMBNAIL_READY)
+
+    def test_resumes_from_checkpoint(self):
+        with open(self.checkpoint, 'w') as f:
+            json.dump({'specs': [[300, 200, 'jpeg']], 'last_id': self.images[0].pk}, f)
+
+        self.generate('300x200')
+        self.assertEqual(
+            set(ImageDerivative.objects.values_list('image_id', flat=True)),
+            {image.pk for image in self.images[1:]},
+        )
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class ExportDataTests(TestCase):
+    def test_streams_ndjson_gzip_since(self):
+        old = make_destination('Ooty', images=2)
+        Destination.objects.filter(pk=old.pk).update(updated_at='2020-01-01T00:00:00Z')
+        make_destination('Kodaikanal', images=1)
+        output = f'{MEDIA_ROOT}/export.ndjson'
+
+        call_command(
+            'export_data', output=output, format='ndjson', compress='gzip',
+            since='2021-01-01', chunk_size=1, stdout=StringIO(),
+        )
+        with gzip.open(f'{output}.gz', 'rt', encoding='utf-8') as f:
+            records = [json.loads(line) for line in f]
+        self.assertEqual([r['fields']['place_name'] for r in records], ['Kodaikanal'])
+        self.assertEqual(len(records[0]['fields']['images']), 1)
+
+    def test_json_array_matches_record_count(self):
+        for i in range(3):
+            make_destination(f'Place {i}', images=1)
+        output = f'{MEDIA_ROOT}/export.json'
+        # one streamed query for the destinations, one for the images of each chunk
+        with self.assertNumQueries(3):
+            call_command('export_data', output=output, chunk_size=2, stdout=StringIO())
+        with open(output, encoding='utf-8') as f:
+            self.assertEqual(len(json.load(f)), 3)
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class ImportDataTests(TestCase):
+    def write_feed(self, records, ndjson=False):
+        path = f'{MEDIA_ROOT}/feed.{"ndjson" if ndjson else "json"}'
+        with open(path, 'w', encoding='utf-8') as f:
+            if ndjson:
+                f.writelines(json.dumps(record) + '\n' for record in records)
+            else:
+                json.dump(records, f, indent=2)
+        return path
+
+    def record(self, pk, name, images=()):
+        return {
+            'model': 'destinations.destination',
+            'pk': pk,
+            'fields': {
+                'place_name': name, 'slug': '', 'weather': 'Rainy', 'state': 'Goa',
+                'district': 'North Goa', 'google_map_link': None, 'description': '',
+                'images': [{'image': url, 'caption': ''} for url in images],
+            },
+        }
+
+    def test_round_trip_with_local_images(self):
+        make_destination('Hampi', images=2)
+        make_destination('Gokarna')
+        export = f'{MEDIA_ROOT}/round-trip.ndjson'
+        call_command('export_data', output=export, format='ndjson', stdout=StringIO())
+        image_root = tempfile.mkdtemp(dir=MEDIA_ROOT)
+        shutil.copytree(f'{MEDIA_ROOT}/destinations', f'{image_root}/destinations')
+        Destination.objects.all().delete()
+
+        call_command('import_data', export, image_root=image_root, batch_size=1, stdout=StringIO())
+        hampi = Destination.objects.get(slug='hampi')
+        self.assertEqual(hampi.images.count(), 2)
+        self.assertEqual(ImageJob.objects.filter(image__destination=hampi).count(), 2)
+        self.assertTrue(all(os.path.exists(image.image.path) for image in hampi.images.all()))
+        self.assertTrue(Destination.objects.filter(slug='gokarna').exists())
+
+    def test_reimport_updates_rows_without_duplicating_images(self):
+        source = f'{MEDIA_ROOT}/source.png'
+        with open(source, 'wb') as f:
+            f.write(make_image_file().read())
+        feed = self.write_feed([self.record(10, 'Calangute', [f'file://{source}']), self.record(11, 'Anjuna')])
+
+        call_command('import_data', feed, stdout=StringIO())
+        feed = self.write_feed([self.record(10, 'Calangute Beach', [f'file://{source}'])], ndjson=True)
+        out = StringIO()
+        call_command('import_data', feed, stdout=out)
+
+        destination = Destination.objects.get(pk=10)
+        self.assertEqual(destination.place_name, 'Calangute Beach')
+        self.assertEqual(destination.images.count(), 1)
+        self.assertIn('0 created, 1 updated', out.getvalue())
+
+    def test_slugs_and_natural_keys_resolve_to_existing_rows(self):
+        baga = make_destination('Baga', state='Goa', district='North Goa')
+        colva = make_destination('Colva')
+        by_slug = self.record(None, 'Baga Beach')
+        by_slug['fields']['slug'] = baga.slug
+        clash = self.record(999, 'Somewhere Else')
+        clash['fields']['slug'] = colva.slug
+        feed = self.write_feed([by_slug, clash, self.record(None, 'Anjuna')])
+
+        call_command('import_data', feed, stdout=StringIO())
+        out = StringIO()
+        call_command('import_data', feed, stdout=out)
+
+        self.assertEqual(Destination.objects.get(pk=baga.pk).place_name, 'Baga Beach')
+        self.assertEqual(Destination.objects.get(pk=colva.pk).place_name, 'Colva')
+        self.assertFalse(Destination.objects.filter(pk=999).exists())
+        self.assertEqual(Destination.objects.filter(place_name='Anjuna').count(), 1)
+        self.assertIn('0 created, 2 updated, 0 images, 1 errors', out.getvalue())
+
+    def test_images_without_returning_bulk_inserts(self):
+        source = f'{MEDIA_ROOT}/source.png'
+        with open(source, 'wb') as f:
+            f.write(make_image_file().read())
+        feed = self.write_feed([self.record(10, 'Calangute', [f'file://{source}', f'file://{source}'])])
+
+        features = mock.patch.object(
+            type(connection.features), 'can_return_rows_from_bulk_insert', new_callable=mock.PropertyMock,
+            return_value=False,
+        )
+        with features, CaptureQueriesContext(connection) as context:
+            call_command('import_data', feed, stdout=StringIO())
+        image_inserts = [q for q in context.captured_queries if q['sql'].startswith('INSERT INTO "destinations_destinationimage"')]
+        self.assertEqual(len(image_inserts), 1)
+        images = DestinationImage.objects.filter(destination_id=10)
+        self.assertEqual(ImageJob.objects.filter(image__in=images).count(), 2)
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class ContentAddressedStorageTests(TestCase):
+    def test_identical_uploads_share_one_file(self):
+        with self.settings(DESTINATION_CONTENT_ADDRESSED_MEDIA=True):
+            first = make_destination('Pondicherry', images=1).images.get()
+            second = make_destination('Auroville', images=1).images.get()
+            self.assertTrue(first.image.name.startswith('cas/'))
+            self.assertEqual(first.image.name, second.image.name)
+
+            call_command('process_image_jobs', once=True, workers=1, stdout=StringIO())
+            first.refresh_from_db()
+            second.refresh_from_db()
+            self.assertEqual(first.thumbnail.name, second.thumbnail.name)
+
+            path = first.image.path
+            first.delete()
+            self.assertTrue(os.path.exists(path))
+            second.delete()
+            self.assertFalse(os.path.exists(path))
+
+    def test_dedupe_media_converts_existing_files(self):
+        images = [make_destination(f'Place {i}', images=1).images.get() for i in range(2)]
+        old_paths = [image.image.path for image in images]
+        self.assertNotEqual(*old_paths)
+
+        call_command('dedupe_media', stdout=StringIO())
+        for image in images:
+            image.refresh_from_db()
+        self.assertEqual(images[0].image.name, images[1].image.name)
+        self.assertTrue(os.path.exists(images[0].image.path))
+        self.assertFalse(any(os.path.exists(path) for path in old_paths))
+
+    @override_settings(STORAGES={
+        'default': {'BACKEND': 'django.core.files.storage.InMemoryStorage'},
+        'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+    })
+    def test_files_go_to_the_configured_default_storage(self):
+        from django.core.files.storage import storages
+
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        with self.settings(MEDIA_ROOT=media_root):
+            images = [make_destination(f'Place {i}', images=1).images.get() for i in range(2)]
+            backend = storages['default']
+            for image in images:
+                self.assertTrue(backend.exists(image.image.name))
+            self.assertEqual(os.listdir(media_root), [])
+
+            # Not a local filesystem, so dedupe_media copies instead of hard-linking
+            call_command('dedupe_media', stdout=StringIO())
+            for image in images:
+                image.refresh_from_db()
+            self.assertEqual(images[0].image.name, images[1].image.name)
+            self.assertTrue(backend.exists(images[0].image.name))
+            self.assertEqual(os.listdir(media_root), [])
+
+    @skipUnless(connection.vendor == 'sqlite', 'checks SQLite query plans')
+    def test_reference_lookups_use_indexes(self):
+        name = 'cas/ab/abc.png'
+        lookups = [
+            DestinationImage.objects.filter(Q(image=name) | Q(thumbnail=name)),
+            DestinationImage.objects.filter(image=name, thumbnail_status=DestinationImage.THUMBNAIL_READY),
+            ImageDerivative.objects.filter(file=name),
+        ]
+        for queryset in lookups:
+            plan = queryset.explain()
+            self.assertNotIn('SCAN', plan)
+            self.assertIn('_idx', plan)
+
+
+class CleanupMediaTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        media_settings = self.settings(MEDIA_ROOT=self.media_root)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+
+        destination = make_destination('Mysore', images=1)
+        call_command('process_image_jobs', once=True, workers=1, stdout=StringIO())
+        self.image = destination.images.get()
+        self.orphan = self.write('destinations/999/orphan.png')
+        self.fresh = self.write('thumbnails/fresh.jpg')
+        for dirpath, _, files in os.walk(self.media_root):
+            for name in files:
+                path = os.path.join(dirpath, name)
+                if path != self.fresh:
+                    os.utime(path, (0, 0))
+
+    def write(self, name):
+        path = os.path.join(self.media_root, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(b'x')
+        return path
+
+    def test_keeps_referenced_thumbnails_and_recent_files(self):
+        call_command('cleanup_media', workers=2, batch_size=2, stdout=StringIO())
+        self.assertFalse(os.path.exists(self.orphan))
+        self.assertTrue(os.path.exists(self.fresh))
+        self.assertTrue(os.path.exists(self.image.image.path))
+        self.assertTrue(os.path.exists(self.image.thumbnail.path))
+        for derivative in self.image.derivatives.all():
+            self.assertTrue(os.path.exists(derivative.file.path))
+
+    def test_collect_error_stops_the_scanners(self):
+        for i in range(20):
+            self.write(f'destinations/998/{i}.png')
+        with mock.patch('destinations.management.commands.cleanup_media.Command.collect', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                call_command('cleanup_media', workers=1, batch_size=1, stdout=StringIO())
+        self.assertTrue(os.path.exists(self.orphan))
+
+    def test_dry_run_and_quarantine(self):
+        out = StringIO()
+        call_command('cleanup_media', dry_run=True, stdout=out)
+        self.assertTrue(os.path.exists(self.orphan))
+        self.assertIn('would be removed', out.getvalue())
+        self.assertNotIn('Cleaned up', out.getvalue())
+
+        quarantine = os.path.join(self.media_root, '..', os.path.basename(self.media_root) + '-quarantine')
+        self.addCleanup(shutil.rmtree, quarantine, ignore_errors=True)
+        call_command('cleanup_media', quarantine=quarantine, stdout=StringIO())
+        self.assertFalse(os.path.exists(self.orphan))
+        (run,) = os.listdir(quarantine)
+        self.assertTrue(os.path.exists(os.path.join(quarantine, run, 'destinations/999/orphan.png')))
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class CheckBrokenImagesTests(TestCase):
+    def test_reports_and_fixes_problems(self):
+        destination = make_destination('Madurai', images=2)
+        call_command('process_image_jobs', once=True, workers=1, stdout=StringIO())
+        ok, lost_thumbnail = destination.images.order_by('id')
+        os.remove(lost_thumbnail.thumbnail.path)
+        corrupt = DestinationImage.objects.create(
+            destination=destination,
+            image=SimpleUploadedFile('corrupt.png', make_image_file().read()[:60], content_type='image/png'),
+        )
+
+        Destination.objects.filter(pk=destination.pk).update(updated_at='2020-05-01T00:00:00Z')
+
+        out = StringIO()
+        call_command('check_broken_images', verify=True, fix=True, report='-', stdout=out, stderr=StringIO())
+        report = json.loads(out.getvalue())
+        problems = {issue['image_id']: issue['problem'] for issue in report['issues']}
+        self.assertEqual(problems, {lost_thumbnail.pk: 'missing_thumbnail', corrupt.pk: 'undecodable'})
+        self.assertEqual(report['fixed'], 1)
+
+        lost_thumbnail.refresh_from_db()
+        self.assertEqual(lost_thumbnail.thumbnail_status, DestinationImage.THUMBNAIL_PENDING)
+        self.assertTrue(lost_thumbnail.jobs.filter(status=ImageJob.PENDING).exists())
+        destination.refresh_from_db()
+        self.assertGreater(destination.updated_at.year, 2020)
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class MigrateStorageTests(TestCase):
+    def setUp(self):
+        self.target_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.target_root, ignore_errors=True)
+        self.manifest = os.path.join(self.target_root, 'manifest.jsonl')
+        storages = {
+            'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+            'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+            'target': {
+                'BACKEND': 'django.core.files.storage.FileSystemStorage',
+                'OPTIONS': {'location': os.path.join(self.target_root, 'media')},
+            },
+            'other': {
+                'BACKEND': 'django.core.files.storage.FileSystemStorage',
+                'OPTIONS': {'location': os.path.join(self.target_root, 'other')},
+            },
+        }
+        storage_settings = self.settings(STORAGES=storages)
+        storage_settings.enable()
+        self.addCleanup(storage_settings.disable)
+
+    def migrate(self, destination='target'):
+        call_command(
+            'migrate_storage', destination=destination, workers=2, batch_size=2,
+            manifest=self.manifest, stdout=StringIO(),
+        )
+
+    def test_copies_verifies_and_resumes(self):
+        destination = make_destination('Shillong', images=2)
+        first, second = destination.images.order_by('id')
+        with second.image.open('rb') as f:
+            second_bytes = f.read()
+        # A different file already occupies one name on the destination
+        clash = os.path.join(self.target_root, 'media', second.image.name)
+        os.makedirs(os.path.dirname(clash))
+        with open(clash, 'wb') as f:
+            f.write(b'someone else')
+
+        with mock.patch.object(DestinationImage, 'save') as save:
+            self.migrate()
+        save.assert_not_called()
+
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertTrue(os.path.exists(os.path.join(self.target_root, 'media', first.image.name)))
+        self.assertNotEqual(os.path.join(self.target_root, 'media', second.image.name), clash)
+        with open(os.path.join(self.target_root, 'media', second.image.name), 'rb') as copied:
+            self.assertEqual(copied.read(), second_bytes)
+
+        with open(self.manifest) as f:
+            entries = len(f.readlines())
+        self.migrate()
+        with open(self.manifest) as f:
+            self.assertEqual(len(f.readlines()), entries)
+
+    def test_missing_source_files_are_skipped(self):
+        destination = make_destination('Aizawl', images=1)
+        image = destination.images.get()
+        os.remove(image.image.path)
+        out = StringIO()
+        call_command('migrate_storage', destination='target', manifest=self.manifest, stdout=out)
+        self.assertIn(f'Skipping non-existent file: {image.image.name}', out.getvalue())
+        self.assertIn('Errors: 0', out.getvalue())
+
+    def test_manifest_is_per_destination_and_renames_are_batched(self):
+        destination = make_destination('Kohima', images=3)
+        images = list(destination.images.order_by('id'))
+        self.migrate(destination='other')
+        for image in images:
+            self.assertTrue(os.path.exists(os.path.join(self.target_root, 'other', image.image.name)))
+            clash = os.path.join(self.target_root, 'media', image.image.name)
+            os.makedirs(os.path.dirname(clash), exist_ok=True)
+            with open(clash, 'wb') as f:
+                f.write(b'someone else')
+
+        # The shared manifest's entries for "other" don't count as copies to "target"
+        with CaptureQueriesContext(connection) as queries:
+            self.migrate()
+        updates = [q['sql'] for q in queries.captured_queries if q['sql'].startswith('UPDATE "destinations_destinationimage"')]
+        # Three renamed files in chunks of two: one CASE update per field and chunk
+        self.assertEqual(len(updates), 4)
+        for image in images:
+            image.refresh_from_db()
+            with open(os.path.join(self.target_root, 'media', image.image.name), 'rb') as f:
+                self.assertNotEqual(f.read(), b'someone else')
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class BackupRestoreTests(TestCase):
+    def setUp(self):
+        self.output = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.output, ignore_errors=True)
+
+    def backup(self):
+        call_command('backup_database', output=self.output, compress='gzip', media=True, stdout=StringIO())
+        return sorted(os.path.join(self.output, name) for name in os.listdir(self.output))
+
+    def test_logical_backup_verifies_and_restores(self):
+        destination = make_destination('Tawang', images=1)
+        Destination.objects.filter(pk=destination.pk).update(updated_at='2020-05-01T00:00:00Z')
+        (backup_dir,) = self.backup()
+        call_command('restore_database', backup_dir, verify=True, stdout=StringIO())
+
+        Destination.objects.all().delete()
+        make_destination('Ziro')
+        call_command('restore_database', backup_dir, interactive=False, stdout=StringIO())
+
+        restored = Destination.objects.get()
+        self.assertEqual(restored.place_name, 'Tawang')
+        self.assertEqual(restored.updated_at.year, 2020)
+        self.assertEqual(restored.images.count(), 1)
+        # Restored rows are searchable and new rows still get fresh ids
+        self.assertEqual(list(search_destinations(Destination.objects.all(), 'tawang')), [restored])
+        self.assertGreater(make_destination('Ziro').pk, restored.pk)
+
+    def test_media_snapshots_are_incremental_and_verified(self):
+        make_destination('Kohima', images=1)
+        (first,) = self.backup()
+        (second,) = [path for path in self.backup() if path != first]
+        name = DestinationImage.objects.get().image.name
+        self.assertEqual(
+            os.stat(os.path.join(first, 'media', name)).st_ino,
+            os.stat(os.path.join(second, 'media', name)).st_ino,
+        )
+
+        data_file = next(os.scandir(os.path.join(second, 'data'))).path
+        with open(data_file, 'ab') as f:
+            f.write(b'tampered')
+        with self.assertRaises(CommandError):
+            call_command('restore_database', second, verify=True, stdout=StringIO())
+
+
+class BulkApiTests(TestCase):
+    url = '/destinations/api/destinations/bulk/'
+
+    def setUp(self):
+        from django.contrib.auth.models import User
+        User.objects.create_user('editor', password='pw')
+        self.client.login(username='editor', password='pw')
+
+    def test_create_reports_each_item_and_allocates_slugs(self):
+        make_destination('Munnar')
+        items = [
+            {'place_name': 'Munnar', 'weather': 'Cool', 'state': 'Kerala', 'district': 'Idukki'},
+            {'place_name': 'Munnar', 'weather': 'Cool', 'state': 'Kerala', 'district': 'Idukki'},
+            {'place_name': 'Wayanad', 'slug': 'munnar', 'weather': 'Cool', 'state': 'Kerala', 'district': 'Wayanad'},
+            {'place_name': 'Varkala'},
+        ]
+        response = self.client.post(self.url, items, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        results = response.json()['results']
+        self.assertEqual([r['status'] for r in results], ['created', 'created', 'error', 'error'])
+        self.assertEqual([r['slug'] for r in results[:2]], ['munnar-2', 'munnar-3'])
+        self.assertIn('slug', results[2]['errors'])
+        self.assertIn('weather', results[3]['errors'])
+        self.assertEqual(Destination.objects.count(), 3)
+
+    def test_update_and_delete(self):
+        first = make_destination('Hampi')
+        second = make_destination('Badami')
+        self.client.get(f'/destinations/api/destinations/{first.slug}/')
+        response = self.client.patch(self.url, [
+            {'id': first.pk, 'weather': 'Hot'},
+            {'id': second.pk, 'slug': 'hampi'},
+            {'id': 0, 'weather': 'Hot'},
+        ], content_type='application/json')
+        self.assertEqual([r['status'] for r in response.json()['results']], ['updated', 'error', 'not_found'])
+        first.refresh_from_db()
+        self.assertEqual(first.weather, 'Hot')
+        self.assertContains(self.client.get(f'/destinations/api/destinations/{first.slug}/'), 'Hot')
+
+        response = self.client.delete(self.url, ['hampi', 'nowhere'], content_type='application/json')
+        self.assertEqual([r['status'] for r in response.json()['results']], ['deleted', 'not_found'])
+        self.assertFalse(Destination.objects.filter(pk=first.pk).exists())
+
+    def test_create_survives_slugs_taken_concurrently(self):
+        from . import bulk, slugs
+
+        def allocate_then_race(*args, **kwargs):
+            allocated = slugs.allocate_slugs(*args, **kwargs)
+            if not Destination.objects.exists():
+                # Another request creates the same slugs before this insert
+                make_destination('Munnar')
+                make_destination('Kochi', slug='kochi')
+            return allocated
+
+        items = [
+            {'place_name': 'Munnar', 'weather': 'Cool', 'state': 'Kerala', 'district': 'Idukki'},
+            {'place_name': 'Fort Kochi', 'slug': 'kochi', 'weather': 'Hot', 'state': 'Kerala', 'district': 'Ernakulam'},
+        ]
+        with mock.patch.object(bulk, 'allocate_slugs', side_effect=allocate_then_race):
+            response = self.client.post(self.url, items, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        results = response.json()['results']
+        self.assertEqual([r['status'] for r in results], ['created', 'error'])
+        self.assertEqual(results[0]['slug'], 'munnar-2')
+        self.assertIn('slug', results[1]['errors'])
+
+    @override_settings(MEDIA_ROOT=MEDIA_ROOT)
+    def test_delete_removes_images_without_per_row_signals(self):
+        destinations = [make_destination(f'Place {i}', images=3) for i in range(2)]
+        paths = [image.image.path for d in destinations for image in d.images.all()]
+        facets.get_totals()
+
+        with CaptureQueriesContext(connection) as context, self.captureOnCommitCallbacks(execute=True):
+            response = self.client.delete(self.url, [d.slug for d in destinations], content_type='application/json')
+        self.assertEqual([r['status'] for r in response.json()['results']], ['deleted', 'deleted'])
+        self.assertFalse(any(q['sql'].startswith('UPDATE') for q in context.captured_queries))
+        self.assertFalse(DestinationImage.objects.exists() or ImageJob.objects.exists())
+        self.assertFalse(any(os.path.exists(path) for path in paths))
+        self.assertEqual(facets.get_totals()['state'], {})
+
+
+class SlugAllocationTests(TestCase):
+    def test_save_and_batches_get_unique_slugs(self):
+        self.assertEqual(make_destination('Goa').slug, 'goa')
+        self.assertEqual(make_destination('Goa').slug, 'goa-2')
+        make_destination('Goa Velha')
+
+        rows = [(i, None, '', name) for i, name in enumerate(['Goa', 'Goa', 'Goa Velha', '!!!'])]
+        with self.assertNumQueries(1):
+            slugs, errors = allocate_slugs(rows, reserved={'goa-3'})
+        self.assertEqual(slugs, {0: 'goa-4', 1: 'goa-5', 2: 'goa-velha-2', 3: 'destination'})
+        self.assertEqual(errors, {})
+
+    def test_non_ascii_names_are_transliterated(self):
+        with mock.patch('destinations.slugs.unidecode', lambda text: 'Thanjavur'):
+            self.assertEqual(slug_base('தஞ்சாவூர்'), 'thanjavur')
+            with self.settings(DESTINATION_SLUG_TRANSLITERATE=False):
+                self.assertEqual(slug_base('தஞ்சாவூர்'), 'destination')
+
+
+@override_settings(DESTINATION_GEO_REFRESH_SECONDS=0)
+class NearbyTests(TestCase):
+    def setUp(self):
+        geo.reset_index()
+        self.addCleanup(geo.reset_index)
+        geo.build_index()
+
+    def test_parses_map_links(self):
+        self.assertEqual(
+            geo.parse_map_link('https://www.google.com/maps/place/Munnar/@10.08,77.05,13z/data=!3d10.0889!4d77.0595'),
+            (10.0889, 77.0595),
+        )
+        self.assertEqual(geo.parse_map_link('https://maps.google.com/?q=27.1751,78.0421'), (27.1751, 78.0421))
+        self.assertIsNone(geo.parse_map_link('https://goo.gl/maps/5Hsm5'))
+        destination = make_destination('Agra', google_map_link='https://maps.google.com/?q=27.1751,78.0421')
+        self.assertEqual((destination.latitude, destination.longitude), (27.1751, 78.0421))
+
+    def test_grid_matches_brute_force(self):
+        import random
+        rng = random.Random(7)
+        grid = geo.GridIndex(cell_size=1)
+        points = {pk: (rng.uniform(-89, 89), rng.uniform(-180, 180)) for pk in range(2000)}
+        for pk, (lat, lng) in points.items():
+            grid.add(pk, lat, lng)
+        grid.discard(0)
+        del points[0]
+        for lat, lng in [(0, 0), (85, 179.5), (-60, -179.9), (20, 78)]:
+            expected = sorted((geo.haversine_km(lat, lng, *point), pk) for pk, point in points.items())
+            self.assertEqual([pk for _, pk in grid.nearest(lat, lng, k=5)], [pk for _, pk in expected[:5]])
+            self.assertEqual(
+                [pk for _, pk in grid.within(lat, lng, 1500)],
+                [pk for distance, pk in expected if distance <= 1500],
+            )
+        inside = {pk for pk, (lat, lng) in points.items() if 10 <= lat <= 30 and (lng >= 170 or lng <= -170)}
+        self.assertEqual(set(grid.bbox(10, 170, 30, -170)), inside)
+
+    def test_nearby_action_follows_edits(self):
+        url = '/destinations/api/destinations/nearby/'
+        delhi = make_destination('Delhi', latitude=28.61, longitude=77.21)
+        make_destination('Agra', latitude=27.18, longitude=78.04)
+        make_destination('Chennai', latitude=13.08, longitude=80.27)
+
+        response = self.client.get(url, {'lat': 28.5, 'lng': 77.3, 'k': 2})
+        self.assertEqual([r['place_name'] for r in response.json()['results']], ['Delhi', 'Agra'])
+        self.assertIn('distance_km', response.json()['results'][0])
+
+        delhi.latitude, delhi.longitude = 12.97, 77.59
+        delhi.save()
+        make_destination('Jaipur', latitude=26.91, longitude=75.79)
+        response = self.client.get(url, {'lat': 28.5, 'lng': 77.3, 'k': 2})
+        self.assertEqual([r['place_name'] for r in response.json()['results']], ['Agra', 'Jaipur'])
+
+        response = self.client.get(url, {'bbox': '10,75,15,81'})
+        self.assertEqual({r['place_name'] for r in response.json()['results']}, {'Delhi', 'Chennai'})
+        self.assertEqual(self.client.get(url, {'lat': 100, 'lng': 0}).status_code, 400)
+
+    def test_deletes_paired_with_inserts_leave_the_index(self):
+        delhi = make_destination('Delhi', latitude=28.61, longitude=77.21)
+        agra = make_destination('Agra', latitude=27.18, longitude=78.04)
+        index = geo.get_index()
+        self.assertIn(delhi.pk, index.grid)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            delhi.delete()
+            make_destination('Jaipur', latitude=26.91, longitude=75.79)
+        with CaptureQueriesContext(connection) as context:
+            geo.get_index()
+        self.assertNotIn(delhi.pk, index.grid)
+        self.assertEqual(len(index.grid), 2)
+        self.assertFalse(any('COUNT(' in query['sql'] for query in context.captured_queries))
+
+        from . import bulk
+        with self.captureOnCommitCallbacks(execute=True):
+            bulk.bulk_delete_destinations([(0, agra.slug)])
+        self.assertNotIn(agra.pk, geo.get_index().grid)
+
+    def test_answers_503_until_the_first_build_finishes(self):
+        geo.reset_index()
+        with mock.patch.object(geo.DestinationIndex, 'start') as start:
+            response = self.client.get('/destinations/api/destinations/nearby/', {'lat': 28.5, 'lng': 77.3})
+        start.assert_called_once()
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '5')
+
+
+class FacetTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def assertTotalsMatchDatabase(self):
+        self.assertEqual(
+            facets.as_lists(facets.get_totals()),
+            facets.as_lists(facets.compute_facets(Destination.objects.all())),
+        )
+
+    def test_totals_are_updated_in_place(self):
+        munnar = make_destination('Munnar')
+        make_destination('Ooty', state='Tamil Nadu', district='Nilgiris', weather='Cool')
+        self.assertEqual(facets.get_facets()['state'], [('Kerala', 1), ('Tamil Nadu', 1)])
+
+        with self.assertNumQueries(0):
+            facets.get_facets()
+        munnar.state, munnar.weather = 'Tamil Nadu', 'Rainy'
+        munnar.save()
+        munnar.weather = 'Cool'
+        munnar.save()
+        self.assertEqual(facets.get_facets()['state'], [('Tamil Nadu', 2)])
+        make_destination('Kodaikanal', state='Tamil Nadu', district='Dindigul').delete()
+        Destination.objects.get(place_name='Ooty').delete()
+        self.assertTotalsMatchDatabase()
+
+    def test_updates_keep_the_recount_deadline(self):
+        make_destination('Munnar')
+        start = 1_000_000
+        with mock.patch('destinations.facets.time.time', return_value=start):
+            facets.get_totals()
+        # Steady writes don't push the recount back
+        with mock.patch('destinations.facets.time.time', return_value=start + facets.TOTALS_TIMEOUT - 1):
+            make_destination('Ooty', state='Tamil Nadu')
+        Destination.objects.filter(state='Tamil Nadu').update(state='Karnataka')
+        with mock.patch('destinations.facets.time.time', return_value=start + facets.TOTALS_TIMEOUT):
+            self.assertTotalsMatchDatabase()
+
+    def test_facets_action_applies_filters(self):
+        make_destination('Munnar')
+        make_destination('Varkala', district='Thiruvananthapuram', weather='Hot')
+        make_destination('Ooty', state='Tamil Nadu', district='Nilgiris')
+        response = self.client.get('/destinations/api/destinations/facets/', {'state': 'Kerala', 'q': 'varkala'})
+        self.assertEqual(response.json()['district'], [{'value': 'Thiruvananthapuram', 'count': 1}])
+        response = self.client.get('/destinations/api/destinations/facets/')
+        self.assertEqual(len(response.json()['state']), 2)
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        metrics.registry.reset()
+
+    def test_histogram_buckets_stay_within_precision(self):
+        histogram = metrics.Histogram()
+        for value in range(1, 100_000):
+            histogram.record(value * 997)
+        for q in (0.5, 0.99):
+            exact = q * 99_999 * 997
+            self.assertLess(abs(histogram.quantile(q) - exact) / exact, 0.13)
+        self.assertEqual(histogram.cumulative([0, 997 * 10])[0], 0)
+
+    def test_unknown_methods_share_one_label(self):
+        for method in ('FOO', 'BAR', 'GET'):
+            self.client.generic(method, '/destinations/')
+        self.assertEqual(
+            sorted(method for _, method in metrics.registry.snapshot()[0]),
+            ['GET', 'OTHER'],
+        )
+
+    @override_settings(DESTINATION_METRICS_LOG_SAMPLE_RATE=1, DESTINATION_METRICS_ALLOWED_IPS=['10.0.0.5'])
+    def test_records_routes_and_serves_prometheus_text(self):
+        destination = make_destination('Hampi')
+        url = reverse('destinations:destination-detail', args=[destination.slug])
+        self.client.get(url)
+        with self.assertLogs('destinations.middleware', 'INFO') as logs, self.assertNumQueries(0):
+            self.client.get(url)
+        entry = json.loads(logs.records[0].getMessage())
+        self.assertEqual((entry['route'], entry['db_queries'], entry['user_id']), ('destinations:destination-detail', 0, None))
+
+        body = self.client.get('/metrics', REMOTE_ADDR='10.0.0.5').content.decode()
+        self.assertIn(
+            'destinations_http_requests_total{route="destinations:destination-detail",method="GET",status="200"} 2',
+            body,
+        )
+        self.assertIn('destinations_http_request_duration_seconds_count{route="destinations:destination-detail"', body)
+        # The cold request's queries were counted
+        self.assertRegex(
+            body, r'destinations_db_queries_per_request_sum\{route="destinations:destination-detail",method="GET"\} [1-9]'
+        )
+        self.assertNotIn(destination.slug + '"', body)
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='10.0.0.9').status_code, 403)
+
+    @override_settings(DESTINATION_METRICS_TOKEN='scrape-me')
+    def test_scraping_needs_a_token_or_listed_address_by_default(self):
+        # Behind a local proxy every client appears as 127.0.0.1
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='127.0.0.1').status_code, 403)
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer scrape-me').status_code, 200)
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class SQLProfilingTests(TestCase):
+    def test_fingerprints_and_flags_repeated_queries(self):
+        self.assertEqual(
+            profiling.fingerprint("SELECT * FROM t WHERE id IN (1, 2, 3) AND name = 'x'  LIMIT 21"),
+            'SELECT * FROM t WHERE id IN (...) AND name = %s LIMIT %s',
+        )
+        for i in range(6):
+            make_destination(f'Place {i}')
+        profiler = profiling.SQLProfiler(threshold=5)
+        with profiler.capture():
+            for destination in Destination.objects.all():
+                destination.images.count()
+        (flagged,) = profiler.report('loop')['n_plus_one']
+        self.assertEqual(flagged['count'], 6)
+        self.assertIn('COUNT', flagged['sql'])
+        self.assertTrue(any('destinations/tests.py' in frame for frame in flagged['stack']))
+
+    @override_settings(DESTINATION_SQL_PROFILE_TOKEN='secret')
+    def test_header_enables_profiling_and_debug_view_serves_reports(self):
+        from django.contrib.auth.models import User
+        make_destination('Coorg', images=1)
+        self.assertNotIn('X-SQL-Profile-Id', self.client.get('/destinations/', HTTP_X_SQL_PROFILE='wrong'))
+        self.assertNotIn('X-SQL-Profile-Id', self.client.get('/destinations/', HTTP_X_SQL_PROFILE='sécret'))
+        cache.clear()
+        report_id = self.client.get('/destinations/', HTTP_X_SQL_PROFILE='secret')['X-SQL-Profile-Id']
+
+        User.objects.create_user('staff', password='pw', is_staff=True)
+        self.client.login(username='staff', password='pw')
+        (report,) = self.client.get('/destinations/debug/sql/', {'id': report_id}).json()['reports']
+        self.assertEqual(report['label'], 'GET /destinations/')
+        self.assertGreater(report['queries'], 0)
+
+        out = StringIO()
+        call_command('profile_sql', 'check_broken_images', stdout=out, stderr=StringIO())
+        self.assertIn('queries in', out.getvalue())
+        # The profiled command's own output is captured too
+        self.assertIn('Checked', out.getvalue())
+
+        out, err = StringIO(), StringIO()
+        call_command('profile_sql', 'check_broken_images', json=True, stdout=out, stderr=err)
+        self.assertGreater(json.loads(out.getvalue())['queries'], 0)
+        self.assertIn('Checked', err.getvalue())
+
+
+class BenchTests(TestCase):
+    def test_percentile_is_nearest_rank(self):
+        from destinations.management.commands.bench import percentile
+        self.assertEqual(percentile(list(range(50)), 0.50), 24)
+        self.assertEqual(percentile(list(range(100)), 0.95), 94)
+        self.assertEqual(percentile(list(range(100)), 0.99), 98)
+        self.assertEqual(percentile(list(range(3)), 0.50), 1)
+        self.assertEqual(percentile([7], 0.99), 7)
+
+    def test_reports_every_case_and_fails_on_regression(self):
+        work_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, work_dir, ignore_errors=True)
+        report_path = os.path.join(work_dir, 'report.json')
+        call_command(
+            'bench', count=4, images=1, repeat=2, batch_repeat=1, current_db=True,
+            output=report_path, stdout=StringIO(),
+        )
+        with open(report_path) as f:
+            report = json.load(f)
+        self.assertEqual(
+            set(report['cases']), {'list', 'detail', 'api_list', 'api_retrieve', 'search', 'export', 'import', 'thumbnails'}
+        )
+        self.assertGreater(report['cases']['export']['rows_per_s'], 0)
+        self.assertGreater(report['cases']['list']['queries'], 0)
+        # The synthetic rows were rolled back
+        self.assertFalse(Destination.objects.exists())
+
+        report['cases']['detail'].update(p50_ms=0.001, queries=0)
+        baseline_path = os.path.join(work_dir, 'baseline.json')
+        with open(baseline_path, 'w') as f:
+            json.dump(report, f)
+        with self.assertRaisesRegex(CommandError, 'detail: p50_ms'):
+            call_command(
+                'bench', count=4, images=1, repeat=2, cases='detail', current_db=True,
+                baseline=baseline_path, output=os.path.join(work_dir, 'again.json'), stdout=StringIO(),
+            )
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class LoadSampleDataTests(TestCase):
+    def test_count_generates_seeded_rows_with_images(self):
+        call_command('load_sample_data', count=6, images=2, seed=7, batch_size=4, stdout=StringIO())
+        first = list(Destination.objects.order_by('pk').values_list('place_name', 'state', 'district'))
+        self.assertEqual(len(first), 6)
+        self.assertEqual(DestinationImage.objects.count(), 12)
+        self.assertEqual(ImageJob.objects.count(), 12)
+        self.assertTrue(DestinationImage.objects.first().image.storage.exists(DestinationImage.objects.first().image.name))
+
+        # The same seed repeats the same rows, under fresh slugs
+        call_command('load_sample_data', count=6, seed=7, stdout=StringIO())
+        second = list(Destination.objects.order_by('pk').values_list('place_name', 'state', 'district'))[6:]
+        self.assertEqual(second, first)
+        self.assertEqual(Destination.objects.values('slug').distinct().count(), 12)
+
+    def test_slugs_taken_elsewhere_are_reallocated(self):
+        from . import synthetic
+        taken = synthetic.Generator(seed=7).destination(101).slug
+        Destination.objects.create(pk=100, place_name='Elsewhere', slug=taken)
+
+        call_command('load_sample_data', count=3, seed=7, stdout=StringIO())
+        self.assertEqual(Destination.objects.count(), 4)
+        self.assertEqual(Destination.objects.filter(slug=taken).count(), 1)
+
+    def test_default_loads_three_samples(self):
+        call_command('load_sample_data', stdout=StringIO())
+        self.assertEqual(Destination.objects.count(), 3)
+
+
+class GenerateSitemapTests(TestCase):
+    def generate(self, **options):
+        out = StringIO()
+        call_command('generate_sitemap', output_dir=self.output_dir, base_url='https://example.org', stdout=out, **options)
+        return out.getvalue()
+
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.output_dir, ignore_errors=True)
+
+    def test_shards_under_an_index_and_rewrites_only_changed_shards(self):
+        destinations = [make_destination(f'Place {i}') for i in range(5)]
+        shards = {(destination.pk - 1) // 2 for destination in destinations}
+        self.assertIn(f'{len(shards)} of {len(shards)} destination sitemaps rewritten (5 URLs)', self.generate(shard_size=2))
+
+        with open(os.path.join(self.output_dir, 'sitemap.xml')) as f:
+            index = f.read()
+        shard = (destinations[0].pk - 1) // 2
+        self.assertIn(f'https://example.org/static/sitemaps/sitemap-destinations-{shard}.xml', index)
+        with open(os.path.join(self.output_dir, 'sitemaps', f'sitemap-destinations-{shard}.xml')) as f:
+            self.assertIn(f'<loc>https://example.org{destinations[0].get_absolute_url()}</loc>', f.read())
+
+        self.assertIn(f'0 of {len(shards)} destination sitemaps rewritten', self.generate(shard_size=2))
+        destinations[0].description = 'Changed'
+        destinations[0].save()
+        self.assertIn(f'1 of {len(shards)} destination sitemaps rewritten', self.generate(shard_size=2))
+
+        self.generate(shard_size=2, gzip=True)
+        path = os.path.join(self.output_dir, 'sitemaps', f'sitemap-destinations-{shard}.xml')
+        self.assertFalse(os.path.exists(path))
+        with gzip.open(path + '.gz', 'rt') as f:
+            self.assertIn(destinations[0].slug, f.read())
@@ -14,6 +14,7 @@ urlpatterns = [
     # Template views
     path('', views.DestinationListView.as_view(), name='destination-list'),
     path('add/', views.DestinationCreateView.as_view(), name='destination-create'),
+    path('debug/sql/', views.sql_profiles, name='sql-profiles'),
     path('<slug:slug>/', views.DestinationDetailView.as_view(), name='destination-detail'),
     path('<slug:slug>/update/', views.DestinationUpdateView.as_view(), name='destination-update'),
     path('<slug:slug>/delete/', views.destination_delete, name='destination-delete'),
@@ -1,3 +1,4 @@
+import hmac
 from django.shortcuts import render, get_object_or_404, redirect
 
 # Home page view
@@ -10,30 +11,210 @@ from django.urls import reverse_lazy
 from django.contrib import messages
 from .models import Destination, DestinationImage
 from .forms import DestinationForm, DestinationImageFormSet
-from rest_framework import viewsets, permissions
-from .serializers import DestinationSerializer
+from .filters import filter_destinations, get_filter_params
+from rest_framework import viewsets, permissions, status
+from rest_framework.decorators import action
+from rest_framework.response import Response
+from .serializers import (
+    DestinationSerializer, DestinationListSerializer, DestinationBulkSerializer, NearbyQuerySerializer,
+)
+from . import bulk, facets, geo, profiling
+from .pagination import DestinationCursorPagination
+from .conditional import detail_validators, list_validators
+from .cache import CachedResponseMixin, slug_scope
 from django.views.decorators.http import require_http_methods
 from django.template import RequestContext
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import HttpResponse, HttpResponseForbidden, JsonResponse
+from .metrics import render_prometheus
 
 # REST API Views
-class DestinationViewSet(viewsets.ModelViewSet):
+class DestinationViewSet(CachedResponseMixin, viewsets.ModelViewSet):
     queryset = Destination.objects.all()
     serializer_class = DestinationSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+    pagination_class = DestinationCursorPagination
     lookup_field = 'slug'
+    cache_namespace = 'api'
+
+    def get_queryset(self):
+        queryset = super().get_queryset().with_images()
+        if self.action == 'list':
+            queryset = filter_destinations(queryset, self.request.query_params)
+        return queryset
+
+    def get_serializer_class(self):
+        if self.action == 'list':
+            return DestinationListSerializer
+        return DestinationSerializer
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(request, super().list, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(request, super().retrieve, *args, **kwargs)
+
+    def get_cache_scope(self, request, *args, **kwargs):
+        if self.action == 'list':
+            return super().get_cache_scope(request, *args, **kwargs)
+        return slug_scope(kwargs[self.lookup_field])
+
+    def get_validators(self, request, *args, **kwargs):
+        if self.action == 'list':
+            queryset = filter_destinations(Destination.objects.all(), request.query_params)
+            return list_validators(queryset, request.get_full_path(), request.accepted_media_type)
+        queryset = Destination.objects.filter(slug=kwargs[self.lookup_field])
+        return detail_validators(queryset, request.accepted_media_type)
+
+    @action(detail=False, methods=['get'], url_path='facets')
+    def facet_counts(self, request):
+        """Counts per state, district and weather, under the list filters if any are given."""
+        return Response({
+            field: [{'value': value, 'count': count} for value, count in values]
+            for field, values in facets.get_facets(request.query_params).items()
+        })
+
+    @action(detail=False, methods=['get'])
+    def nearby(self, request):
+        """
+        The ``k`` destinations nearest to ``lat``/``lng`` (optionally within
+        ``radius_km``), each with its ``distance_km``, or those inside
+        ``bbox``. Answered from the in-process spatial index.
+        """
+        params = NearbyQuerySerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        query = params.validated_data
+        index = geo.get_index()
+        try:
+            if 'bbox' in query:
+                hits = [(None, pk) for pk in sorted(index.bbox(*query['bbox']))[:query['k']]]
+            else:
+                hits = index.nearest(query['lat'], query['lng'], k=query['k'], max_km=query.get('radius_km'))
+        except geo.IndexNotReady:
+            return Response(
+                {'detail': 'The spatial index is still loading, try again shortly.'},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE, headers={'Retry-After': '5'},
+            )
+
+        destinations = Destination.objects.with_images().in_bulk([pk for _, pk in hits])
+        context = self.get_serializer_context()
+        results = []
+        for distance, pk in hits:
+            # Deleted since the index last caught up
+            if pk not in destinations:
+                continue
+            data = DestinationListSerializer(destinations[pk], context=context).data
+            if distance is not None:
+                data['distance_km'] = round(distance, 3)
+            results.append(data)
+        return Response({'results': results})
+
+    @action(detail=False, methods=['post', 'patch', 'delete'], url_path='bulk')
+    def bulk_operations(self, request):
+        """
+        Create (POST), update (PATCH, items carry an ``id``) or delete
+        (DELETE, a list of slugs) up to BULK_MAX_ITEMS destinations at once.
+        Every item gets its own entry in ``results``; invalid items are
+        reported without stopping the valid ones from being applied.
+        """
+        if request.method == 'DELETE':
+            data = request.data
+            if not isinstance(data, list) or not data:
+                return Response({'non_field_errors': ['Expected a list of slugs.']}, status=status.HTTP_400_BAD_REQUEST)
+            results = {}
+            items = []
+            for index, item in enumerate(data):
+                slug = item.get('slug') if isinstance(item, dict) else item
+                if isinstance(slug, str) and slug:
+                    items.append((index, slug))
+                else:
+                    results[index] = bulk.result(index, 'error', errors={'slug': ['A slug is required.']})
+            results.update(bulk.bulk_delete_destinations(items))
+            return self.bulk_response(results, len(data))
+
+        partial = request.method == 'PATCH'
+        serializer = DestinationBulkSerializer(
+            data=request.data, many=True, partial=partial, context=self.get_serializer_context()
+        )
+        serializer.is_valid(raise_exception=True)
+        results = {
+            index: bulk.result(index, 'error', errors=errors)
+            for index, errors in serializer.item_errors.items()
+        }
+        if partial:
+            items = []
+            for index, attrs in serializer.validated_data:
+                pk = request.data[index].get('id')
+                items.append((index, pk if isinstance(pk, int) else None, attrs))
+            results.update(bulk.bulk_update_destinations(items))
+        else:
+            results.update(bulk.bulk_create_destinations(serializer.validated_data))
+        return self.bulk_response(results, len(request.data), created=not partial)
+
+    def bulk_response(self, results, count, created=False):
+        results = [results[index] for index in range(count)]
+        applied = [entry for entry in results if entry['status'] in ('created', 'updated', 'deleted')]
+        if not applied:
+            code = status.HTTP_400_BAD_REQUEST
+        elif created and len(applied) == count:
+            code = status.HTTP_201_CREATED
+        else:
+            code = status.HTTP_200_OK
+        return Response({'results': results}, status=code)
 
 # Template Views
-class DestinationListView(ListView):
+class DestinationListView(CachedResponseMixin, ListView):
     model = Destination
     template_name = 'destinations/destination_list.html'
     context_object_name = 'destinations'
     paginate_by = 10
+    ordering = ['-id']
+    cache_namespace = 'list'
 
-class DestinationDetailView(DetailView):
+    def get(self, request, *args, **kwargs):
+        return self.cached_response(request, super().get, *args, **kwargs)
+
+    def get_validators(self, request, *args, **kwargs):
+        # The whole table rather than just the filtered rows, because the
+        # state dropdown on the page depends on every destination.
+        return list_validators(Destination.objects.all(), request.get_full_path(), request.user.pk)
+
+    def get_queryset(self):
+        return filter_destinations(super().get_queryset(), self.request.GET).with_images(derivatives=True)
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        filters = get_filter_params(self.request.GET)
+        context['filters'] = filters
+        # Querystring without the page number, for the pagination links
+        querystring = self.request.GET.copy()
+        querystring.pop('page', None)
+        context['filter_querystring'] = querystring.urlencode()
+        # Counts over the whole table, so every option stays selectable
+        # whatever is filtered; cached and kept current by the signals.
+        context['facets'] = facets.get_facets()
+        return context
+
+class DestinationDetailView(CachedResponseMixin, DetailView):
     model = Destination
     template_name = 'destinations/destination_detail.html'
     context_object_name = 'destination'
     slug_url_kwarg = 'slug'
+    cache_namespace = 'detail'
+
+    def get(self, request, *args, **kwargs):
+        return self.cached_response(request, super().get, *args, **kwargs)
+
+    def get_cache_scope(self, request, *args, **kwargs):
+        return slug_scope(kwargs[self.slug_url_kwarg])
+
+    def get_validators(self, request, *args, **kwargs):
+        queryset = Destination.objects.filter(slug=kwargs[self.slug_url_kwarg])
+        return detail_validators(queryset, request.user.pk)
+
+    def get_queryset(self):
+        return super().get_queryset().with_images(derivatives=True)
 
 class DestinationCreateView(LoginRequiredMixin, CreateView):
     model = Destination
@@ -101,6 +282,25 @@ def destination_delete(request, slug):
         return redirect('destination-list')
     return render(request, 'destinations/destination_confirm_delete.html', {'destination': destination})
 
+def metrics(request):
+    """Prometheus scrape endpoint, for the configured scraper token or addresses, and staff."""
+    token = getattr(settings, 'DESTINATION_METRICS_TOKEN', '')
+    allowed = getattr(settings, 'DESTINATION_METRICS_ALLOWED_IPS', [])
+    has_token = bool(token) and hmac.compare_digest(
+        request.headers.get('Authorization', ''), f'Bearer {token}'
+    )
+    if not (has_token or request.META.get('REMOTE_ADDR') in allowed or request.user.is_staff):
+        return HttpResponseForbidden()
+    return HttpResponse(render_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+@staff_member_required
+def sql_profiles(request):
+    """Recent SQL profiling reports (newest first), or one by ``?id=``."""
+    reports = profiling.recent_reports()
+    if request.GET.get('id'):
+        reports = [report for report in reports if str(report['id']) == request.GET['id']]
+    return JsonResponse({'reports': reports})
+
 def handler404(request, exception, template_name='404.html'):
     response = render(request, template_name)
     response.status_code = 404